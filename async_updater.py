@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import random
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, generate_latest
+
+import instrumentation
+from dyndns_updater import UpdateDetector
+from netwatch import SOURCE_POLL
+
+prom_notifications_superseded = Counter('dnsclient_notifications_superseded_total', 'Amount of running notifications cancelled because a newer IP was detected')
+
+
+class AsyncUpdateNotifier:
+    """
+    Sends updates through a blocking notifier without blocking the event loop. Failed attempts
+    are retried with exponential backoff; cancelling the coroutine stops the retries at once.
+    Sends are serialized: a cancelled send keeps running in its thread, so the next one waits
+    for it and the superseded IP can not reach the server after the newer one.
+    """
+    def __init__(self, notifier, executor=None, max_tries=10, base_delay=1.0, max_delay=60.0):
+        self.notifier = notifier
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._executor = executor
+        self._sending = None
+
+    async def _send(self, fetched_ip):
+        if self._sending is not None:
+            await asyncio.wait([self._sending])
+        self._sending = asyncio.get_running_loop().run_in_executor(self._executor, partial(self.notifier.notify_update, fetched_ip, retry=False))
+        # shielded, the future has to outlive a cancelled caller until the thread is done
+        await asyncio.shield(self._sending)
+
+    async def notify_update(self, fetched_ip):
+        for attempt in range(1, self.max_tries + 1):
+            try:
+                await self._send(fetched_ip)
+                return
+            except Exception as err:
+                if attempt == self.max_tries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+                logging.warning("Could not send update (attempt %d), retrying in %.1fs: %s", attempt, delay, err)
+                await asyncio.sleep(delay)
+
+
+class AsyncUpdateDetector(UpdateDetector):
+    """
+    UpdateDetector running on an asyncio event loop. Blocking provider queries run in a thread
+    pool and notifications run as separate tasks, so a slow update server never delays the
+    next detection cycle. A notification still running when a newer IP is detected is cancelled.
+    """
+    def __init__(self, update_notifier, ip_providers, executor=None, **kwargs):
+        super().__init__(update_notifier, ip_providers, **kwargs)
+        self._executor = executor or ThreadPoolExecutor(max_workers=max(4, self.fanout), thread_name_prefix="detector")
+        if not asyncio.iscoroutinefunction(self.update_notifier.notify_update):
+            self.update_notifier = AsyncUpdateNotifier(self.update_notifier, self._executor)
+        self._notification = None
+        self._notifying_ip = None
+        self._notified_ip = None
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _notify(self, fetched_ip):
+        try:
+            if await self._run_blocking(self._is_published, fetched_ip):
+                logging.info("Record is already published with %s, skipping update", fetched_ip)
+            else:
+                await self.update_notifier.notify_update(fetched_ip)
+                if self.published_record:
+                    self.published_record.invalidate()
+            await self._run_blocking(self._write_to_persistence_backend, fetched_ip)
+            self._notified_ip = fetched_ip
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logging.error("Giving up sending update for %s: %s", fetched_ip, err)
+        finally:
+            if self._notifying_ip == fetched_ip:
+                self._notifying_ip = None
+
+    async def perform_check_async(self):
+        """ Detect the external IP and start a notification task if it changed. Returns the detected IP. """
+        if not self.scheduler:
+            self.shuffle_providers(self.ip_providers)
+        start = time.monotonic()
+        fetched_ip = await self._run_blocking(self.get_external_ip)
+        instrumentation.observe_check(time.monotonic() - start)
+
+        if fetched_ip and fetched_ip != self._notifying_ip and self.has_update_occured(self._notified_ip, fetched_ip):
+            if self._notification and not self._notification.done():
+                logging.info("Cancelling update for %s, superseded by %s", self._notifying_ip, fetched_ip)
+                prom_notifications_superseded.inc()
+                self._notification.cancel()
+            self._notifying_ip = fetched_ip
+            self._notification = asyncio.ensure_future(self._notify(fetched_ip))
+        return fetched_ip
+
+    async def _wait_async(self, seconds):
+        if not self.watcher:
+            await asyncio.sleep(seconds)
+            return SOURCE_POLL, None
+        # the watcher blocks, so wait for it in a thread; quit() wakes it up
+        return await self._run_blocking(self.watcher.wait, seconds)
+
+    async def run(self):
+        """ Run the detection loop until cancelled. """
+        logging.info("Started!")
+        self._notified_ip = await self._run_blocking(self._read_from_persistence_backend)
+        logging.info("Read %s from persistence backend", self._notified_ip)
+
+        if self.watcher:
+            self.watcher.start()
+
+        try:
+            while not self._quit:
+                try:
+                    last_ip = self._notifying_ip or self._notified_ip
+                    fetched_ip = await self.perform_check_async()
+                    delay = self._next_delay(changed=fetched_ip is not None and fetched_ip != last_ip, failed=fetched_ip is None)
+                except Exception as error:
+                    logging.error("Error while updating: %s", error)
+                    delay = self._next_delay(failed=True)
+                source, _ = await self._wait_async(delay)
+                if source != SOURCE_POLL and self.ip_cache:
+                    self.ip_cache.invalidate()
+        finally:
+            if self._notification and not self._notification.done():
+                self._notification.cancel()
+            self.quit()
+            self._executor.shutdown(wait=False)
+
+
+async def serve_metrics(port, host="0.0.0.0"):
+    """ Serve the prometheus metrics from the event loop. """
+    async def handle(reader, writer):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+            body = generate_latest()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: " + CONTENT_TYPE_LATEST.encode() +
+                         b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def run(detectors, metrics_port=0):
+    """ Run the detectors and the metrics endpoint until SIGTERM or SIGINT is received. """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = None
+    if metrics_port > 0:
+        logging.info("Start prometheus metrics endpoint at %d", metrics_port)
+        server = await serve_metrics(metrics_port)
+
+    tasks = [asyncio.ensure_future(detector.run()) for detector in detectors]
+    tasks.append(asyncio.ensure_future(stop.wait()))
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+    logging.info("Received signal, quitting")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if server:
+        server.close()
+        await server.wait_closed()
@@ -0,0 +1,241 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from prometheus_client import Counter, Histogram
+
+import instrumentation
+import retry
+import transport
+
+prom_batch_requests = Counter('dnsclient_batch_requests_total', 'Status code of batched update requests', ['status_code'])
+prom_batch_size = Histogram('dnsclient_batch_size', 'Amount of record updates per batched request', buckets=(1, 10, 50, 100, 250, 500, 1000))
+prom_batch_fallbacks = Counter('dnsclient_batch_fallbacks_total', 'Amount of record updates sent one by one because the server does not support batching')
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 0.05
+DEFAULT_PROBE_INTERVAL = 3600
+BATCH_PATH = "/batch"
+# status codes of servers that do not know the batch endpoint
+UNSUPPORTED_STATUS_CODES = (404, 405, 415, 501)
+
+
+class BatchingUnsupported(Exception):
+    """ Raised when the server does not support batched updates. """
+
+
+class PendingRecordUpdate:
+    def __init__(self, notifier, fetched_ip, fetched_ipv6, retry, enqueued_at):
+        self.notifier = notifier
+        self.fetched_ip = fetched_ip
+        self.fetched_ipv6 = fetched_ipv6
+        self.retry = retry
+        self.enqueued_at = enqueued_at
+        self.future = Future()
+
+    def succeed(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def fail(self, err) -> None:
+        if not self.future.done():
+            self.future.set_exception(err)
+
+
+class BatchNotifier:
+    """
+    Sends the updates of many records to their server in a single request. Updates are
+    collected until `batch_size` records are pending for a server or the oldest one waited
+    `flush_interval` seconds. The batch {"updates": [...]} is posted to the URL of the server
+    with /batch appended, every update is signed with the secret of its record just like a
+    single update. The server answers {"results": [{"status_code": 200}, ...]} in the order
+    of the updates, updates without a successful result are failed. Servers that do not
+    know the batch endpoint are sent one request per record and probed again after
+    `probe_interval` seconds.
+    """
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL, concurrency=4, probe_interval=DEFAULT_PROBE_INTERVAL, clock=time.monotonic):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if flush_interval < 0:
+            raise ValueError("flush_interval must not be negative")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.concurrency = concurrency
+        self.probe_interval = probe_interval
+        self._clock = clock
+        self._pending = dict()
+        self._unsupported = dict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._fallback_executor = None
+        self._quit = False
+
+    def notify_many(self, notifiers, fetched_ip, fetched_ipv6=None, retry=True) -> list:
+        """ Send the IPs to the records of all notifiers. Returns the error per notifier, None on success. """
+        now = self._clock()
+        updates = [PendingRecordUpdate(notifier, fetched_ip, fetched_ipv6, retry, now) for notifier in notifiers]
+        with self._cond:
+            if self._quit:
+                raise RuntimeError("batch notifier has been stopped")
+            if self._thread is None:
+                self._start()
+            for update in updates:
+                self._pending.setdefault(update.notifier.host, []).append(update)
+            self._cond.notify()
+        return [update.future.exception() for update in updates]
+
+    def _start(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._fallback_executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._thread = threading.Thread(target=self._run, name="batch-notifier", daemon=True)
+        self._thread.start()
+
+    def _take_due(self, now) -> list:
+        """ Remove the batches that are due from the pending updates. """
+        batches = list()
+        for host, updates in list(self._pending.items()):
+            while updates and (self._quit or len(updates) >= self.batch_size or now - updates[0].enqueued_at >= self.flush_interval):
+                batches.append((host, updates[:self.batch_size]))
+                del updates[:self.batch_size]
+            if not updates:
+                del self._pending[host]
+        return batches
+
+    def _next_wakeup(self, now):
+        if not self._pending:
+            return None
+        oldest = min(updates[0].enqueued_at for updates in self._pending.values())
+        return max(0, oldest + self.flush_interval - now)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                batches = self._take_due(self._clock())
+                while not batches and not self._quit:
+                    self._cond.wait(self._next_wakeup(self._clock()))
+                    batches = self._take_due(self._clock())
+            if not batches:
+                return
+            for host, updates in batches:
+                self._executor.submit(self._flush, host, updates)
+
+    def _batching_supported(self, host) -> bool:
+        with self._cond:
+            return self._unsupported.get(host, 0) <= self._clock()
+
+    def _flush(self, host, updates) -> None:
+        try:
+            if self._batching_supported(host):
+                try:
+                    self._send_batch(host, updates)
+                    return
+                except BatchingUnsupported:
+                    logging.warning("Server %s does not support batched updates, sending them one by one", host)
+                    with self._cond:
+                        self._unsupported[host] = self._clock() + self.probe_interval
+            prom_batch_fallbacks.inc(len(updates))
+            list(self._fallback_executor.map(self._send_single, updates))
+        except Exception as err:
+            logging.error("Could not send batch of %d updates to %s: %s", len(updates), host, err)
+            for update in updates:
+                update.fail(err)
+
+    def _send_batch(self, host, updates) -> None:
+        entries, owners = list(), list()
+        for update in updates:
+            try:
+                payloads = update.notifier.build_payloads(update.fetched_ip, update.fetched_ipv6)
+            except ValueError as err:
+                update.fail(err)
+                continue
+            entries.extend(payloads)
+            owners.extend([update] * len(payloads))
+        if not entries:
+            return
+
+        url = host.rstrip("/") + BATCH_PATH
+        if any(update.retry for update in updates):
+            results = self._send_batch_request(url, entries)
+        else:
+            results = self._post_batch(url, entries)
+
+        rejected = dict()
+        for index, owner in enumerate(owners):
+            result = results[index] if index < len(results) else None
+            status_code = result.get("status_code") if isinstance(result, dict) else None
+            if not isinstance(status_code, int) or status_code >= 400:
+                rejected.setdefault(id(owner), status_code)
+
+        for update in updates:
+            status_code = rejected.get(id(update))
+            if self._combined_unsupported(update, status_code):
+                update.notifier.disable_combined(status_code)
+                self._send_single(update)
+            elif id(update) in rejected:
+                update.fail(ValueError(f"server rejected update of '{update.notifier.dns_record}' with status code {rejected[id(update)]}"))
+            else:
+                update.succeed()
+
+    @staticmethod
+    def _combined_unsupported(update, status_code) -> bool:
+        """ Whether a combined update was rejected with a client error, see UpdateNotifier.notify_update. """
+        return update.fetched_ipv6 is not None and getattr(update.notifier, "combined", False) and isinstance(status_code, int) and 400 <= status_code < 500 and status_code != 429
+
+    @retry.on_exception(requests.exceptions.RequestException, max_tries=10, operation=instrumentation.OPERATION_UPDATE)
+    def _send_batch_request(self, url, entries) -> list:
+        """ Post the batch, retrying on connection errors. """
+        return self._post_batch(url, entries)
+
+    def _post_batch(self, url, entries) -> list:
+        """ Post the batch and return the results per update. """
+        logging.info("Sending batch of %d updates to remote server", len(entries))
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        start = time.monotonic()
+        try:
+            response = transport.get_session().post(url, data=json.dumps({"updates": entries}), headers=headers)
+        finally:
+            instrumentation.observe_update(time.monotonic() - start)
+
+        prom_batch_requests.labels(response.status_code).inc()
+        prom_batch_size.observe(len(entries))
+        if response.status_code in UNSUPPORTED_STATUS_CODES:
+            raise BatchingUnsupported()
+        if response.status_code >= 400:
+            raise ValueError(f"batch rejected with status code {response.status_code}")
+
+        try:
+            results = response.json()["results"]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("invalid response to batch")
+        if not isinstance(results, list):
+            raise ValueError("invalid response to batch")
+        return results
+
+    @staticmethod
+    def _send_single(update) -> None:
+        try:
+            if update.fetched_ipv6 is None:
+                update.notifier.notify_update(update.fetched_ip, retry=update.retry)
+            else:
+                update.notifier.notify_update(update.fetched_ip, retry=update.retry, fetched_ipv6=update.fetched_ipv6)
+        except Exception as err:
+            update.fail(err)
+        else:
+            update.succeed()
+
+    def quit(self, timeout=None) -> None:
+        """ Send all pending updates and stop. """
+        with self._cond:
+            self._quit = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._executor.shutdown(wait=True)
+            self._fallback_executor.shutdown(wait=True)
@@ -0,0 +1,54 @@
+"""
+Compares sending an IP change to many records one request per record with batched requests.
+Run with: python3 -m benchmarks.bench_batch
+"""
+import json
+import logging
+import time
+
+import transport
+from batch_notifier import BatchNotifier
+from multi_record import RecordFanout
+from notifier import UpdateNotifier
+from tests.stubs import StubResponse, StubServer
+
+RECORD_COUNTS = (1000, 10000)
+BATCH_SIZES = (50, 250)
+CONCURRENCY = 16
+
+
+def batch_response(body):
+    updates = json.loads(body)["updates"]
+    return StubResponse(json.dumps({"results": [{"status_code": 200}] * len(updates)}))
+
+
+def bench(server, count, batch_size=None):
+    notifiers = [UpdateNotifier(f"record{i}.example.com.", server.url("/update"), "secret") for i in range(count)]
+    batcher = BatchNotifier(batch_size=batch_size, concurrency=CONCURRENCY) if batch_size else None
+    fanout = RecordFanout(notifiers, concurrency=CONCURRENCY, batcher=batcher)
+
+    requests_before = len(server.requests)
+    start = time.perf_counter()
+    fanout.notify_update("1.1.1.1")
+    elapsed = time.perf_counter() - start
+    if batcher:
+        batcher.quit()
+
+    mode = f"batch={batch_size}" if batch_size else "single"
+    print(f"records={count:>6} {mode:<10} requests={len(server.requests) - requests_before:>6} elapsed={elapsed:.2f}s updates/s={count / elapsed:.0f}")
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    transport.configure(pool_maxsize=CONCURRENCY)
+    with StubServer() as server:
+        server.add_route("/update", StubResponse("okay"), method="POST")
+        server.add_route("/update/batch", batch_response, method="POST")
+        for count in RECORD_COUNTS:
+            bench(server, count)
+            for batch_size in BATCH_SIZES:
+                bench(server, count, batch_size)
+
+
+if __name__ == "__main__":
+    main()
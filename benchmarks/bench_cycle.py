@@ -0,0 +1,125 @@
+"""
+Measures complete check cycles (IP detection and update notification) against in-process
+stub IP providers and a stub update server, covering the scenarios of mountebank/dyndns.json
+without a container or network access.
+Run with: python3 -m benchmarks.bench_cycle
+"""
+import json
+import logging
+import os
+import resource
+import time
+
+import transport
+from dyndns_updater import UpdateDetector
+from notifier import UpdateNotifier
+from tests.stubs import StubResponse, StubServer
+
+CYCLES = 200
+# hanging providers are retried with backoff by the detector, so fewer cycles suffice
+TIMEOUT_CYCLES = 10
+NOTIFICATIONS = 2000
+TIMEOUT_SECONDS = 0.2
+REQUIRED_KEYS = ("validation_hash", "dns_record", "public_ip")
+
+# every scenario maps provider paths to the responses they cycle through
+SCENARIOS = {
+    "healthy": {
+        "/a": [StubResponse("1.1.1.1"), StubResponse("1.1.1.2")],
+        "/b": [StubResponse("1.1.1.1"), StubResponse("1.1.1.2")],
+    },
+    "latency": {
+        "/slow": [StubResponse("1.1.1.1", delay=0.02), StubResponse("1.1.1.2", delay=0.02)],
+    },
+    "errors": {
+        "/bla/errors": [StubResponse("502", 502), StubResponse("404", 404), StubResponse("403", 403), StubResponse("500", 500)],
+        "/a": [StubResponse("1.1.1.1"), StubResponse("1.1.1.2")],
+    },
+    "garbage": {
+        "/garbage": [StubResponse(os.urandom(512)), StubResponse("<html><body>1.1.1.1</body></html>"), StubResponse("999.1.1.1")],
+        "/a": [StubResponse("1.1.1.1"), StubResponse("1.1.1.2")],
+    },
+    "timeout": {
+        "/hang": [StubResponse("1.1.1.1", delay=TIMEOUT_SECONDS * 2)],
+        "/a": [StubResponse("1.1.1.1"), StubResponse("1.1.1.2")],
+    },
+}
+
+
+def update_server_response(body):
+    """ Mirrors the update server imposter: accept complete JSON payloads only. """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return StubResponse("nonono", 403)
+    if not isinstance(payload, dict) or not all(key in payload for key in REQUIRED_KEYS):
+        return StubResponse("nonono", 403)
+    return StubResponse("okay")
+
+
+def rss_bytes():
+    """ Current resident set size, falls back to the peak if /proc is not available. """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def build_providers(server, routes):
+    providers = list()
+    for path, responses in routes.items():
+        server.add_route(path, list(responses))
+        url = server.url(path)
+        providers.append((path, lambda url=url: transport.fetch(url, timeout=TIMEOUT_SECONDS)))
+    return providers
+
+
+def bench_cycles(server, name, routes, cycles=CYCLES):
+    notifier = UpdateNotifier("bench.example.com.", server.url("/update"), "secret")
+    detector = UpdateDetector(update_notifier=notifier, ip_providers=build_providers(server, routes))
+
+    latencies, cpu_times, rss = list(), list(), list()
+    last_ip = None
+    for _ in range(cycles):
+        wall, cpu = time.perf_counter(), time.process_time()
+        last_ip = detector.perform_check(last_ip) or last_ip
+        latencies.append(time.perf_counter() - wall)
+        cpu_times.append(time.process_time() - cpu)
+        rss.append(rss_bytes())
+
+    print(f"{name:<8} cycles={cycles:<3} "
+          f"p50={percentile(latencies, 50) * 1e3:7.2f}ms p95={percentile(latencies, 95) * 1e3:7.2f}ms p99={percentile(latencies, 99) * 1e3:7.2f}ms "
+          f"cpu/cycle={sum(cpu_times) / cycles * 1e6:6.0f}us rss={max(rss) / 2 ** 20:.1f}MiB")
+
+
+def bench_notifications(server):
+    notifier = UpdateNotifier("bench.example.com.", server.url("/update"), "secret")
+    start = time.perf_counter()
+    for i in range(NOTIFICATIONS):
+        notifier.notify_update(f"10.0.{i // 256 % 256}.{i % 256}")
+    elapsed = time.perf_counter() - start
+    print(f"notifications={NOTIFICATIONS} elapsed={elapsed:.2f}s notifications/s={NOTIFICATIONS / elapsed:.0f}")
+
+
+def main():
+    logging.basicConfig(level=logging.CRITICAL)
+    logging.getLogger("backoff").setLevel(logging.CRITICAL)
+    transport.configure()
+    for name, routes in SCENARIOS.items():
+        with StubServer() as server:
+            server.add_route("/update", update_server_response, method="POST")
+            bench_cycles(server, name, routes, TIMEOUT_CYCLES if name == "timeout" else CYCLES)
+
+    with StubServer() as server:
+        server.add_route("/update", update_server_response, method="POST")
+        bench_notifications(server)
+
+
+if __name__ == "__main__":
+    main()
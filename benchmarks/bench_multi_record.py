@@ -0,0 +1,37 @@
+"""
+Measures how fast a single process fans out an IP change to many records.
+Run with: python3 -m benchmarks.bench_multi_record
+"""
+import logging
+import time
+
+import transport
+from multi_record import RecordFanout
+from notifier import UpdateNotifier
+from tests.stubs import StubResponse, StubServer
+
+RECORD_COUNTS = (1000, 10000)
+CONCURRENCY = 32
+
+
+def bench(server, count):
+    notifiers = [UpdateNotifier(f"record{i}.example.com.", server.url("/update"), "secret") for i in range(count)]
+    fanout = RecordFanout(notifiers, concurrency=CONCURRENCY)
+
+    start = time.perf_counter()
+    fanout.notify_update("1.1.1.1")
+    elapsed = time.perf_counter() - start
+    print(f"records={count:>6} concurrency={CONCURRENCY} elapsed={elapsed:.2f}s updates/s={count / elapsed:.0f}")
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    transport.configure(pool_maxsize=CONCURRENCY)
+    with StubServer() as server:
+        server.add_route("/update", StubResponse("okay"), method="POST")
+        for count in RECORD_COUNTS:
+            bench(server, count)
+
+
+if __name__ == "__main__":
+    main()
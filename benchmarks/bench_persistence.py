@@ -0,0 +1,57 @@
+"""
+Compares saving the state of many records to one file per record against the SQLite store.
+Run with: python3 -m benchmarks.bench_persistence
+"""
+import os
+import tempfile
+import time
+
+from persistence import FilePersistence, SqliteStore
+
+RECORD_COUNTS = (1000, 5000)
+
+
+def report(name, count, elapsed):
+    print(f"{name:<22} records={count:>5} elapsed={elapsed:.3f}s writes/s={count / elapsed:.0f}")
+
+
+def bench_files(directory, count):
+    backends = [FilePersistence(os.path.join(directory, f"record{i}.ip")) for i in range(count)]
+    start = time.perf_counter()
+    for backend in backends:
+        backend.write("1.1.1.1")
+    report("files", count, time.perf_counter() - start)
+
+
+def bench_sqlite_single(directory, count):
+    store = SqliteStore(os.path.join(directory, f"single{count}.db"))
+    backends = [store.for_record(f"record{i}.example.com.") for i in range(count)]
+    start = time.perf_counter()
+    for backend in backends:
+        backend.write("1.1.1.1")
+    report("sqlite single writes", count, time.perf_counter() - start)
+    store.close()
+
+
+def bench_sqlite_batch(directory, count):
+    store = SqliteStore(os.path.join(directory, f"batch{count}.db"))
+    start = time.perf_counter()
+    store.write_many({f"record{i}.example.com.": "1.1.1.1" for i in range(count)})
+    report("sqlite batch", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    state = store.read_all()
+    print(f"{'sqlite read_all':<22} records={len(state):>5} elapsed={time.perf_counter() - start:.3f}s")
+    store.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        for count in RECORD_COUNTS:
+            bench_files(directory, count)
+            bench_sqlite_single(directory, count)
+            bench_sqlite_batch(directory, count)
+
+
+if __name__ == "__main__":
+    main()
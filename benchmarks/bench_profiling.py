@@ -0,0 +1,61 @@
+"""
+Measures the cost of on-demand profiling per check cycle: without a profiler, with an idle
+profiler waiting for a signal and while profiling or tracing memory.
+Run with: python3 -m benchmarks.bench_profiling
+"""
+import logging
+import tempfile
+import time
+import tracemalloc
+
+import transport
+from benchmarks.bench_cycle import build_providers, percentile, update_server_response
+from dyndns_updater import UpdateDetector
+from notifier import UpdateNotifier
+from profiling import Profiler
+from tests.stubs import StubResponse, StubServer
+
+CYCLES = 500
+ROUTES = {"/a": [StubResponse("1.1.1.1")]}
+
+
+def bench(server, name, profiler=None, cycles=CYCLES):
+    notifier = UpdateNotifier("bench.example.com.", server.url("/update"), "secret")
+    detector = UpdateDetector(update_notifier=notifier, ip_providers=build_providers(server, ROUTES))
+    perform_check = profiler.profiled(detector.perform_check) if profiler else detector.perform_check
+
+    latencies, cpu_times = list(), list()
+    for _ in range(cycles):
+        wall, cpu = time.perf_counter(), time.process_time()
+        perform_check("1.1.1.1")
+        latencies.append(time.perf_counter() - wall)
+        cpu_times.append(time.process_time() - cpu)
+
+    print(f"{name:<10} cycles={cycles} p50={percentile(latencies, 50) * 1e3:6.2f}ms p99={percentile(latencies, 99) * 1e3:6.2f}ms "
+          f"cpu/cycle={sum(cpu_times) / cycles * 1e6:6.0f}us")
+
+
+def main():
+    logging.basicConfig(level=logging.CRITICAL)
+    transport.configure()
+    with StubServer() as server, tempfile.TemporaryDirectory() as output_dir:
+        server.add_route("/update", update_server_response, method="POST")
+        bench(server, "off")
+        bench(server, "idle", Profiler(output_dir))
+
+        profiler = Profiler(output_dir, cycles=CYCLES)
+        profiler.request_cpu_profile()
+        bench(server, "cpu", profiler)
+
+        profiler = Profiler(output_dir)
+        profiler.start()
+        profiler.request_memory_trace()
+        while not tracemalloc.is_tracing():
+            time.sleep(0.01)
+        bench(server, "memory", profiler)
+        profiler.request_memory_trace()
+        profiler.stop()
+
+
+if __name__ == "__main__":
+    main()
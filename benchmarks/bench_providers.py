@@ -0,0 +1,37 @@
+"""
+Compares the per-check cost of HTTP and DNS based IP discovery against local stub servers.
+Run with: python3 -m benchmarks.bench_providers
+"""
+import socket
+import time
+
+import dns_wire
+import transport
+from tests.stubs import StubDnsServer, StubResponse, StubServer
+
+CHECKS = 1000
+
+
+def bench(name, provider):
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(CHECKS):
+        provider()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    print(f"{name:<18} latency={wall / CHECKS * 1e6:8.0f}us cpu={cpu / CHECKS * 1e6:8.0f}us per check")
+
+
+def main():
+    with StubServer() as http_server, StubDnsServer() as dns_server:
+        http_server.add_route("/ip", StubResponse("1.2.3.4"))
+        dns_server.add("myip.opendns.com", dns_wire.QTYPE_A, socket.inet_aton("1.2.3.4"))
+        host, port = dns_server.address
+        url = http_server.url("/ip")
+
+        transport.configure()
+        bench("http keep-alive", lambda: transport.fetch(url, timeout=5))
+        bench("http new conn", lambda: transport.build_session().get(url, timeout=5).text)
+        bench("dns udp", lambda: dns_wire.query_first("myip.opendns.com", dns_wire.QTYPE_A, host, port=port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Measures the cold start cost of one-shot runs: interpreter startup, importing dns_client and
+running `dns_client.py --once` against in-process stubs, each in a fresh process.
+Run with: python3 -m benchmarks.bench_startup
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.stubs import StubResponse, StubServer
+
+RUNS = 10
+ENTRY_POINT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dns_client.py")
+
+
+def bench(name, args):
+    durations = list()
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True, capture_output=True)
+        durations.append(time.perf_counter() - start)
+    print(f"{name:<16} runs={RUNS} median={statistics.median(durations) * 1e3:7.1f}ms min={min(durations) * 1e3:7.1f}ms")
+
+
+def main():
+    with StubServer() as server, tempfile.TemporaryDirectory() as directory:
+        server.add_route("/ip", StubResponse("1.1.1.1"))
+        server.add_route("/update", StubResponse("okay"), method="POST")
+        providers_file = os.path.join(directory, "providers.json")
+        with open(providers_file, "w") as f:
+            json.dump({"providers": [{"name": "stub", "url": server.url("/ip")}]}, f)
+
+        bench("interpreter", ["-c", "pass"])
+        bench("import", ["-c", "import dns_client"])
+        bench("once", [ENTRY_POINT, "--once", "--url", server.url("/update"), "--record", "bench.example.com.",
+                       "--secret", "secret", "--providers_file", providers_file])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when a request would start, or is still being read, after the deadline of the check has passed. """
+
+
+@contextmanager
+def budget(seconds):
+    """
+    Run the block with a deadline `seconds` from now. Nested budgets never extend the deadline
+    of an outer one. Worker threads only see the deadline if they run in a copy of the context.
+    """
+    if seconds is None:
+        yield
+        return
+
+    until = time.monotonic() + seconds
+    outer = _current.get()
+    if outer is not None:
+        until = min(until, outer)
+
+    token = _current.set(until)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def remaining():
+    """ Seconds until the current deadline, None if there is none. """
+    until = _current.get()
+    if until is None:
+        return None
+    return max(0.0, until - time.monotonic())
+
+
+def expired() -> bool:
+    return remaining() == 0
+
+
+def clamp(seconds):
+    """ Limit a wait to the time that remains until the deadline. """
+    left = remaining()
+    if left is None:
+        return seconds
+    if seconds is None:
+        return left
+    return min(seconds, left)
+
+
+def timeout(seconds):
+    """ Like clamp, but for network timeouts: raises DeadlineExceeded if no time is left. """
+    if expired():
+        raise DeadlineExceeded()
+    return clamp(seconds)
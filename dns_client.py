@@ -1,35 +1,161 @@
+import argparse
+import atexit
 import logging
-from inspect import getmembers, isfunction
+import os
+import sys
 
 import configargparse
-import ipv4_providers
+import instrumentation
+import transport
 
-from prometheus_client import start_http_server
+from prometheus_client import REGISTRY, start_http_server, write_to_textfile
 from dyndns_updater import UpdateDetector
+from interval_scheduler import IntervalScheduler
+from ip_cache import SharedIpCache
 from notifier import UpdateNotifier
+from provider_scheduler import ProviderScheduler
+from rate_limiter import RateLimiter
 
-from persistence import FilePersistence
+EXIT_OK = 0
+EXIT_NO_IP = 2
+EXIT_UPDATE_FAILED = 3
+
+# defaults of the modules that are only imported once their feature is used, see test_cmd.py
+DEFAULT_CONCURRENCY = 16
+DEFAULT_BATCH_FLUSH_INTERVAL = 0.05
+DEFAULT_RECORD_MAX_TTL = 300
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_DNS_CACHE_NEGATIVE_TTL = 30
+DEFAULT_DNS_CACHE_MAX_STALE = 3600
+DEFAULT_PROFILE_CYCLES = 10
 
 
 def read_config():
     """ Parse CLI args. """
     parser = configargparse.ArgumentParser(prog='dns_client')
 
-    parser.add_argument('-u', '--url', dest="url", action="store", env_var="DNSCLIENT_URL", required=True, help="The URL of the server component")
-    parser.add_argument('-r', '--record', dest="record", action="store", env_var="DNSCLIENT_RECORD", required=True, help="The full DNS record to update. It should end with a dot")
-    parser.add_argument('-s', '--secret', dest="shared_secret", action="store", env_var="DNSCLIENT_SECRET", required=True, help="The secret that's associated with the appropriate record")
+    parser.add_argument('-u', '--url', dest="url", action="store", env_var="DNSCLIENT_URL", required=False, help="The URL of the server component")
+    parser.add_argument('-r', '--record', dest="record", action="store", env_var="DNSCLIENT_RECORD", required=False, help="The full DNS record to update. It should end with a dot")
+    parser.add_argument('-s', '--secret', dest="shared_secret", action="store", env_var="DNSCLIENT_SECRET", required=False, help="The secret that's associated with the appropriate record")
+    parser.add_argument('--records_file', dest="records_file", action="store", env_var="DNSCLIENT_RECORDS_FILE", required=False, help="JSON file defining multiple records to update. Replaces --url, --record and --secret")
+    parser.add_argument('--concurrency', dest="concurrency", action="store", type=int, env_var="DNSCLIENT_CONCURRENCY", default=DEFAULT_CONCURRENCY, help="Maximum amount of concurrent update requests when using --records_file. Defaults to %(default)s")
+    parser.add_argument('--workers', dest="workers", action="store", type=int, env_var="DNSCLIENT_WORKERS", default=1, help="Spread the records of --records_file across this many worker processes. Crashed workers are restarted and changes of the records file are picked up. Defaults to 1 (no worker processes)")
+    parser.add_argument('--batch_size', dest="batch_size", action="store", type=int, env_var="DNSCLIENT_BATCH_SIZE", default=0, help="Send the updates of up to this many records in a single request to the /batch endpoint of the server when using --records_file. Servers without it are updated one record at a time. Defaults to 0 (disabled)")
+    parser.add_argument('--batch_flush_interval', dest="batch_flush_interval", action="store", type=float, env_var="DNSCLIENT_BATCH_FLUSH_INTERVAL", default=DEFAULT_BATCH_FLUSH_INTERVAL, help="Seconds to collect updates before sending an incomplete batch. Defaults to %(default)s")
+    parser.add_argument('--state_dir', dest="state_dir", action="store", env_var="DNSCLIENT_STATE_DIR", required=False, help="Directory to save the resolved IP per network to when using --records_file")
+    parser.add_argument('--once', dest="once", action="store_true", env_var="DNSCLIENT_ONCE", default=False, help="Perform a single check and exit, e.g. when run from a systemd timer. Exits with 0 on success, 2 if the IP could not be detected and 3 if the update could not be sent")
+    parser.add_argument('--textfile', dest="textfile", action="store", env_var="DNSCLIENT_TEXTFILE", required=False, help="Write the metrics to this file for the node exporter's textfile collector when using --once")
+    parser.add_argument('--asyncio', dest="asyncio", action="store_true", env_var="DNSCLIENT_ASYNCIO", default=False, help="Run detection, notifications and the metrics endpoint on an asyncio event loop. Slow notifications do not delay detection and SIGTERM shuts down cleanly")
     parser.add_argument('--debug', dest="debug", action="store_true", env_var="DNSCLIENT_DEBUG", default=False, help="Print debug messages")
     parser.add_argument('--prometheus_port', dest='promport', action="store", env_var="DNSCLIENT_PROMPORT", type=int, default=0, help="Start a prometheus metrics server on the given port. To disable this feature, supply 0 as port. (Defaults to 0)")
+    parser.add_argument('--latency_buckets', dest="latency_buckets", action="store", env_var="DNSCLIENT_LATENCY_BUCKETS", required=False, help="Comma separated upper bounds in seconds of the buckets of all latency histograms")
+    parser.add_argument('--low_cardinality_metrics', dest="low_cardinality_metrics", action="store_true", env_var="DNSCLIENT_LOW_CARDINALITY_METRICS", default=False, help="Aggregate metrics that are labelled per provider or per record, recommended for large fleets")
     parser.add_argument('-i', '--interval', dest="interval", action="store", type=int, env_var="DNSCLIENT_INTERVAL", default=60, help="The interval in seconds to check a random IP provider. Defaults to 60")
+    parser.add_argument('--dns_providers', dest="dns_providers", action="store_true", env_var="DNSCLIENT_DNS_PROVIDERS", default=False, help="Also discover the IP using a single DNS query to resolvers such as OpenDNS or Google")
+    parser.add_argument('--ipv6', dest="ipv6", action="store_true", env_var="DNSCLIENT_IPV6", default=False, help="Also detect the IPv6 address in every check and update the AAAA record")
+    parser.add_argument('--combined_updates', dest="combined_updates", action="store_true", env_var="DNSCLIENT_COMBINED_UPDATES", default=False, help="Send the IPv4 and IPv6 address in a single update request. Requires a server that accepts the public_ipv6 field. If the server rejects such a request, one request per address is sent from then on")
+    parser.add_argument('--providers_file', dest="providers_file", action="store", env_var="DNSCLIENT_PROVIDERS_FILE", required=False, help="JSON file declaring the IP providers to use instead of the built-in ones")
+    parser.add_argument('--ip_cache', dest="ip_cache", action="store", env_var="DNSCLIENT_IP_CACHE", required=False, help="File to share the discovered IP with other clients on this host. Only one client at a time queries the providers")
+    parser.add_argument('--ip_cache_max_age', dest="ip_cache_max_age", action="store", type=int, env_var="DNSCLIENT_IP_CACHE_MAX_AGE", default=60, help="Use a shared IP that is at most this many seconds old. Defaults to %(default)s")
+    parser.add_argument('--nameserver', dest="nameserver", action="store", env_var="DNSCLIENT_NAMESERVER", required=False, help="IP address of a nameserver to look up the published record at. Updates are skipped if the record already points to the detected IP")
+    parser.add_argument('--nameserver_port', dest="nameserver_port", action="store", type=int, env_var="DNSCLIENT_NAMESERVER_PORT", default=53, help="Port of the nameserver. Defaults to 53")
+    parser.add_argument('--record_max_ttl', dest="record_max_ttl", action="store", type=int, env_var="DNSCLIENT_RECORD_MAX_TTL", default=DEFAULT_RECORD_MAX_TTL, help="Cache the looked up record for at most this many seconds. Defaults to %(default)s")
+    parser.add_argument('--fanout', dest="fanout", action="store", type=int, env_var="DNSCLIENT_FANOUT", default=1, help="Amount of IP providers to query concurrently, the first valid answer wins. Defaults to 1 (query providers one after another)")
+    parser.add_argument('--hedge_delay', dest="hedge_delay", action="store", type=float, env_var="DNSCLIENT_HEDGE_DELAY", default=0.0, help="Seconds to wait for an answer before querying the next provider concurrently. Only used if fanout > 1. Defaults to 0")
+    parser.add_argument('--quorum', dest="quorum", action="store", type=int, env_var="DNSCLIENT_QUORUM", default=1, help="Only accept an IP once this many of the concurrently queried providers (see fanout) agree on it. Defaults to 1")
+    parser.add_argument('--breaker_threshold', dest="breaker_threshold", action="store", type=int, env_var="DNSCLIENT_BREAKER_THRESHOLD", default=3, help="Bench an IP provider after this many consecutive failures. Defaults to 3")
+    parser.add_argument('--breaker_cooldown', dest="breaker_cooldown", action="store", type=int, env_var="DNSCLIENT_BREAKER_COOLDOWN", default=300, help="Seconds a failing IP provider is benched before it is probed again. Defaults to 300")
+    parser.add_argument('--check_budget', dest="check_budget", action="store", type=float, env_var="DNSCLIENT_CHECK_BUDGET", default=30, help="Maximum seconds a check may spend discovering the IP, including all providers and retries. Defaults to %(default)s")
+    parser.add_argument('--provider_timeout', dest="provider_timeout", action="store", type=float, env_var="DNSCLIENT_PROVIDER_TIMEOUT", default=10, help="Maximum seconds a single IP provider may take including retries. Defaults to %(default)s")
+    parser.add_argument('--provider_timeouts', dest="provider_timeouts", action="store", env_var="DNSCLIENT_PROVIDER_TIMEOUTS", required=False, help="Comma separated timeouts of individual providers overriding --provider_timeout, e.g. ipify_org=3,ident_me=5")
+    parser.add_argument('--provider_rate', dest="provider_rate", action="store", type=float, env_var="DNSCLIENT_PROVIDER_RATE", default=0, help="Maximum amount of queries per minute to a single IP provider, shared by all records. Defaults to 0 (unlimited)")
+    parser.add_argument('--global_rate', dest="global_rate", action="store", type=float, env_var="DNSCLIENT_GLOBAL_RATE", default=0, help="Maximum amount of queries per minute to all IP providers together. Defaults to 0 (unlimited)")
+    parser.add_argument('--pool_connections', dest="pool_connections", action="store", type=int, env_var="DNSCLIENT_POOL_CONNECTIONS", default=transport.DEFAULT_POOL_CONNECTIONS, help="Amount of hosts to keep HTTP connection pools for. Defaults to %(default)s")
+    parser.add_argument('--pool_maxsize', dest="pool_maxsize", action="store", type=int, env_var="DNSCLIENT_POOL_MAXSIZE", default=transport.DEFAULT_POOL_MAXSIZE, help="Maximum amount of keep-alive connections per host. Defaults to %(default)s")
+    parser.add_argument('--pool_idle_timeout', dest="pool_idle_timeout", action="store", type=float, env_var="DNSCLIENT_POOL_IDLE_TIMEOUT", default=transport.DEFAULT_IDLE_TIMEOUT, help="Close keep-alive connections that have been idle for this many seconds. Defaults to %(default)s")
+    parser.add_argument('--dns_cache', dest="dns_cache", action="store_true", env_var="DNSCLIENT_DNS_CACHE", default=False, help="Cache the addresses of IP providers and update servers in-process, serving stale addresses while the resolver is down")
+    parser.add_argument('--dns_cache_ttl', dest="dns_cache_ttl", action="store", type=int, env_var="DNSCLIENT_DNS_CACHE_TTL", default=DEFAULT_DNS_CACHE_TTL, help="Seconds to cache addresses if the resolver does not tell their TTL. Defaults to %(default)s")
+    parser.add_argument('--dns_cache_negative_ttl', dest="dns_cache_negative_ttl", action="store", type=int, env_var="DNSCLIENT_DNS_CACHE_NEGATIVE_TTL", default=DEFAULT_DNS_CACHE_NEGATIVE_TTL, help="Seconds to remember hostnames that could not be resolved. Defaults to %(default)s")
+    parser.add_argument('--dns_cache_max_stale', dest="dns_cache_max_stale", action="store", type=int, env_var="DNSCLIENT_DNS_CACHE_MAX_STALE", default=DEFAULT_DNS_CACHE_MAX_STALE, help="Seconds expired addresses are still used while the resolver fails. Defaults to %(default)s")
+    parser.add_argument('--dns_cache_server', dest="dns_cache_server", action="store", env_var="DNSCLIENT_DNS_CACHE_SERVER", required=False, help="Query this nameserver directly instead of using the system resolver, honoring the TTL of the records")
+    parser.add_argument('--profile_dir', dest="profile_dir", action="store", env_var="DNSCLIENT_PROFILE_DIR", required=False, help="Enable on-demand profiling: SIGUSR1 profiles the next check cycles with cProfile, including the threads they start, but not long-lived background threads such as the ones of the outbox. SIGUSR2 starts and stops tracing memory allocations right away. Reports are written to this directory")
+    parser.add_argument('--profile_cycles', dest="profile_cycles", action="store", type=int, env_var="DNSCLIENT_PROFILE_CYCLES", default=DEFAULT_PROFILE_CYCLES, help="Amount of check cycles to profile after receiving SIGUSR1. Defaults to %(default)s")
+    parser.add_argument('--outbox', dest="outbox", action="store_true", env_var="DNSCLIENT_OUTBOX", default=False, help="Send updates from a background queue so a slow server does not block detecting IP changes")
+    parser.add_argument('--outbox_file', dest="outbox_file", action="store", env_var="DNSCLIENT_OUTBOX_FILE", required=False, help="Save pending updates of the outbox to a file to preserve them across service restarts. Defaults to a file next to --db, --file or in --state_dir")
+    parser.add_argument('--max_interval', dest="max_interval", action="store", type=int, env_var="DNSCLIENT_MAX_INTERVAL", default=0, help="Stretch the interval up to this many seconds while the IP is stable. Disabled if not larger than --interval")
+    parser.add_argument('--jitter', dest="jitter", action="store", type=float, env_var="DNSCLIENT_JITTER", default=0.1, help="Shorten the delays between checks at random by up to this fraction of --interval, so clients started at the same time do not poll in lockstep. Defaults to %(default)s")
+    parser.add_argument('--watch', dest="watch", action="store", choices=["netlink", "procfs"], env_var="DNSCLIENT_WATCH", required=False, help="Check immediately when the local network changes, using netlink events or polling /proc/net. --interval then only serves as safety poll for changes that are not visible locally")
+    parser.add_argument('--db', dest="db", action="store", env_var="DNSCLIENT_DB", required=False, help="Save the resolved IP of all records and a history of changes to this SQLite database. Replaces --file and --state_dir")
+    parser.add_argument('--history_retention', dest="history_retention", action="store", type=int, env_var="DNSCLIENT_HISTORY_RETENTION", default=0, help="Delete history entries of the database older than this many days, the newest entry per record is always kept. Defaults to 0 (keep forever)")
     parser.add_argument('-f', '--file', dest="file", action="store", env_var="DNSCLIENT_FILE", required=False, help="Save resolved IP to a file to preserve the status across service restarts.")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    try:
+        args.latency_buckets = instrumentation.parse_buckets(args.latency_buckets)
+        args.provider_timeouts = parse_provider_timeouts(args.provider_timeouts)
+    except ValueError as err:
+        parser.error(str(err))
+    if not args.records_file and not (args.url and args.record and args.shared_secret):
+        parser.error("either --records_file or all of --url, --record and --secret are required")
+    if args.ipv6 and (args.outbox or args.asyncio):
+        parser.error("--ipv6 can not be combined with --outbox or --asyncio")
+    if args.batch_size > 0 and args.outbox:
+        parser.error("--batch_size can not be combined with --outbox")
+    if args.workers > 1 and (not args.records_file or args.once or args.outbox):
+        parser.error("--workers requires --records_file and can not be combined with --once or --outbox")
+    if not 0 <= args.jitter < 1:
+        parser.error("--jitter must be between 0 and 1")
+    if args.outbox and not args.outbox_file:
+        args.outbox_file = default_outbox_file(args)
+    return args
+
+
+def default_outbox_file(args):
+    """
+    Derive the file of the outbox from the persisted state. The detected IP is persisted as
+    soon as it is queued, so pending updates must survive restarts as well or they would be
+    lost for good. Returns None if nothing is persisted.
+    """
+    if args.db:
+        return args.db + ".outbox"
+    if args.records_file and args.state_dir:
+        return os.path.join(args.state_dir, "outbox")
+    if not args.records_file and args.file:
+        return args.file + ".outbox"
+    return None
+
+
+def parse_provider_timeouts(value) -> dict:
+    """ Parse timeouts of individual providers given as name=seconds,name=seconds. """
+    timeouts = dict()
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        name, _, seconds = entry.partition("=")
+        try:
+            timeouts[name.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError(f"invalid provider timeout: {entry}")
+        if timeouts[name.strip()] <= 0:
+            raise ValueError(f"provider timeout must be positive: {entry}")
+    return timeouts
 
 
-def get_ipv4_providers():
+def get_ipv4_providers(use_dns_providers=False, providers_file=None):
     """ Return all configured IP providers """
-    logging.info("Loading IP providers")
-    return [f for f in getmembers(ipv4_providers, isfunction)]
+    return get_ip_providers(use_dns_providers, providers_file)
+
+
+def get_ip_providers(use_dns_providers=False, providers_file=None, family=4):
+    """ Return all configured IP providers of the address family """
+    import provider_registry
+
+    logging.info("Loading IPv%d providers", family)
+    if providers_file:
+        providers = provider_registry.load_providers(providers_file)
+    else:
+        providers = provider_registry.default_providers(use_dns_providers, family)
+    return provider_registry.as_ip_providers(providers, family)
 
 
 def init_logging(debug=False):
@@ -42,16 +168,77 @@ def init_logging(debug=False):
     logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 
-def print_config(args, ipv4_providers):
+def print_config(args, ipv4_providers, ipv6_providers=None):
     """ Print configuration after startup """
     logging.info("Using the following parameters")
-    logging.info("url=%s", args.url)
-    logging.info("record=%s", args.record)
+    if args.records_file:
+        logging.info("records_file=%s", args.records_file)
+        logging.info("concurrency=%d", args.concurrency)
+        logging.info("workers=%d", args.workers)
+        if args.batch_size > 0:
+            logging.info("batch_size=%d", args.batch_size)
+            logging.info("batch_flush_interval=%s", args.batch_flush_interval)
+        logging.info("state_dir=%s", args.state_dir)
+    else:
+        logging.info("url=%s", args.url)
+        logging.info("record=%s", args.record)
+        if args.nameserver:
+            logging.info("nameserver=%s:%d", args.nameserver, args.nameserver_port)
     logging.info("interval=%d", args.interval)
+    if args.ip_cache:
+        logging.info("ip_cache=%s", args.ip_cache)
+        logging.info("ip_cache_max_age=%d", args.ip_cache_max_age)
+    if args.max_interval > args.interval:
+        logging.info("max_interval=%d", args.max_interval)
+    logging.info("jitter=%s", args.jitter)
+    if args.watch:
+        logging.info("watch=%s", args.watch)
     logging.info("prometheus_port=%d", args.promport)
+    logging.info("latency_buckets=%s", args.latency_buckets)
+    logging.info("low_cardinality_metrics=%s", args.low_cardinality_metrics)
+    logging.info("once=%s", args.once)
+    if args.textfile:
+        logging.info("textfile=%s", args.textfile)
+    logging.info("asyncio=%s", args.asyncio)
+    logging.info("fanout=%d", args.fanout)
+    logging.info("hedge_delay=%s", args.hedge_delay)
+    logging.info("quorum=%d", args.quorum)
+    logging.info("outbox=%s", args.outbox)
+    if args.outbox_file:
+        logging.info("outbox_file=%s", args.outbox_file)
+    logging.info("breaker_threshold=%d", args.breaker_threshold)
+    logging.info("breaker_cooldown=%d", args.breaker_cooldown)
+    logging.info("check_budget=%s", args.check_budget)
+    logging.info("provider_timeout=%s", args.provider_timeout)
+    if args.provider_timeouts:
+        logging.info("provider_timeouts=%s", args.provider_timeouts)
+    logging.info("provider_rate=%s", args.provider_rate)
+    logging.info("global_rate=%s", args.global_rate)
+    logging.info("pool_connections=%d", args.pool_connections)
+    logging.info("pool_maxsize=%d", args.pool_maxsize)
+    logging.info("pool_idle_timeout=%s", args.pool_idle_timeout)
+    logging.info("dns_cache=%s", args.dns_cache)
+    if args.profile_dir:
+        logging.info("profile_dir=%s", args.profile_dir)
+        logging.info("profile_cycles=%d", args.profile_cycles)
+    if args.dns_cache:
+        logging.info("dns_cache_ttl=%d", args.dns_cache_ttl)
+        logging.info("dns_cache_negative_ttl=%d", args.dns_cache_negative_ttl)
+        logging.info("dns_cache_max_stale=%d", args.dns_cache_max_stale)
+        if args.dns_cache_server:
+            logging.info("dns_cache_server=%s", args.dns_cache_server)
+    if args.db:
+        logging.info("db=%s", args.db)
+        logging.info("history_retention=%d", args.history_retention)
     if "file" in args:
         logging.info("file=%s", args.file)
+    if args.providers_file:
+        logging.info("providers_file=%s", args.providers_file)
     logging.info("providers=%s", [x[0] for x in ipv4_providers])
+    logging.info("ipv6=%s", args.ipv6)
+    if args.ipv6:
+        logging.info("combined_updates=%s", args.combined_updates)
+        logging.info("ipv6_providers=%s", [x[0] for x in ipv6_providers or []])
 
 
 def prometheus_server(args):
@@ -66,30 +253,332 @@ def prometheus_server(args):
 def initialize():
     """ Start up """
     args = read_config()
+    if args.workers > 1:
+        return run_supervisor(args)
 
+    store = build_store(args)
     persistence_provider = None
-    if args.file:
+    if store:
+        persistence_provider = store.for_record(args.record or "default")
+    elif args.file:
+        from persistence import FilePersistence
         persistence_provider = FilePersistence(args.file)
 
     init_logging(args.debug)
-    ip_providers = get_ipv4_providers()
+    instrumentation.configure(buckets=args.latency_buckets, detailed_labels=not args.low_cardinality_metrics)
+    ip_providers = get_ipv4_providers(args.dns_providers, args.providers_file)
+    ipv6_providers = None
+    if args.ipv6:
+        ipv6_providers = get_ip_providers(args.dns_providers, args.providers_file, family=6)
+        if not ipv6_providers:
+            logging.warning("No IPv6 providers configured, only detecting IPv4")
     
-    print_config(args, ip_providers)
-    prometheus_server(args)
+    print_config(args, ip_providers, ipv6_providers)
+    if not args.asyncio and not args.once:
+        prometheus_server(args)
+
+    pool_maxsize = args.pool_maxsize
+    if args.records_file:
+        # allow every concurrent update request to keep its connection alive
+        pool_maxsize = max(pool_maxsize, args.concurrency)
+
+    transport.configure(
+        pool_connections=args.pool_connections,
+        pool_maxsize=pool_maxsize,
+        idle_timeout=args.pool_idle_timeout,
+        resolver_cache=build_resolver_cache(args))
+
+    scheduler = ProviderScheduler(
+        failure_threshold=args.breaker_threshold,
+        cooldown=args.breaker_cooldown)
+
+    rate_limiter = build_rate_limiter(args)
+    outbox = build_outbox(args)
+
+    if args.records_file:
+        return run_multi_record(args, ip_providers, scheduler, rate_limiter, outbox, store, ipv6_providers)
 
     notifier = UpdateNotifier(
         dns_record=args.record,
         host=args.url,
         shared_secret=args.shared_secret,
+        combined=args.combined_updates,
     )
+    if outbox:
+        notifier = outbox.register(notifier)
 
-    detector = UpdateDetector(
+    published_record = None
+    published_record_ipv6 = None
+    if args.nameserver:
+        from record_lookup import PublishedRecord
+        published_record = PublishedRecord(
+            dns_record=notifier.dns_record,
+            nameserver=args.nameserver,
+            port=args.nameserver_port,
+            max_ttl=args.record_max_ttl)
+        if ipv6_providers:
+            published_record_ipv6 = PublishedRecord(
+                dns_record=notifier.dns_record,
+                nameserver=args.nameserver,
+                port=args.nameserver_port,
+                max_ttl=args.record_max_ttl,
+                family=6)
+
+    detector = detector_class(args)(
         update_notifier=notifier,
         ip_providers=ip_providers, 
         interval=args.interval, 
-        persistence=persistence_provider)
-    detector.start()
+        persistence=persistence_provider,
+        fanout=args.fanout,
+        hedge_delay=args.hedge_delay,
+        quorum=args.quorum,
+        scheduler=scheduler,
+        rate_limiter=rate_limiter,
+        budget=args.check_budget,
+        provider_timeout=args.provider_timeout,
+        provider_timeouts=args.provider_timeouts,
+        published_record=published_record,
+        ipv6_providers=ipv6_providers,
+        published_record_ipv6=published_record_ipv6,
+        watcher=build_watcher(args),
+        interval_scheduler=build_interval_scheduler(args, args.interval),
+        ip_cache=build_ip_cache(args))
+    return start([detector], args)
+
+
+def detector_class(args):
+    if args.asyncio and not args.once:
+        from async_updater import AsyncUpdateDetector
+        return AsyncUpdateDetector
+    return UpdateDetector
+
+
+def build_watcher(args):
+    """ Create the watcher for local network changes if enabled. """
+    if not args.watch or args.once:
+        return None
+    import netwatch
+    return netwatch.build_watcher(args.watch)
+
+
+def build_rate_limiter(args):
+    """ Create the rate limiter shared by all detectors. Throttling responses are always honored. """
+    return RateLimiter(
+        provider_rate=args.provider_rate / 60 if args.provider_rate > 0 else None,
+        global_rate=args.global_rate / 60 if args.global_rate > 0 else None,
+        # a concurrent cycle may query `fanout` providers at once
+        global_burst=max(1, args.fanout))
+
+
+def build_ip_cache(args, network=None):
+    """ Create the IP cache shared with other clients if configured. """
+    if not args.ip_cache:
+        return None
+
+    path = args.ip_cache
+    if network:
+        path = f"{path}.{network}"
+    return SharedIpCache(path, max_age=args.ip_cache_max_age)
+
+
+def build_interval_scheduler(args, interval):
+    """ Create the interval scheduler, adaptive if a larger max_interval is configured. """
+    if args.max_interval <= interval and not args.jitter:
+        return None
+    return IntervalScheduler(min_interval=interval, max_interval=max(interval, args.max_interval), jitter=args.jitter)
+
+
+def build_store(args):
+    """ Open the SQLite state database if configured. """
+    if not args.db:
+        return None
+
+    from persistence import SqliteStore
+
+    retention = None
+    if args.history_retention > 0:
+        retention = args.history_retention * 86400
+    return SqliteStore(args.db, retention=retention)
+
+
+def build_resolver_cache(args):
+    """ Create the cache resolving the hosts of the HTTP transport if enabled. """
+    if not args.dns_cache:
+        return None
+    import resolver_cache
+
+    resolver = resolver_cache.system_resolver
+    if args.dns_cache_server:
+        resolver = resolver_cache.WireResolver(args.dns_cache_server)
+    return resolver_cache.ResolverCache(
+        resolver=resolver,
+        default_ttl=args.dns_cache_ttl,
+        max_ttl=max(args.dns_cache_ttl, resolver_cache.DEFAULT_MAX_TTL),
+        negative_ttl=args.dns_cache_negative_ttl,
+        max_stale=args.dns_cache_max_stale)
+
+
+def build_profiler(args):
+    """ Create the on-demand profiler if enabled. """
+    if not args.profile_dir:
+        return None
+    import profiling
+    return profiling.Profiler(args.profile_dir, cycles=args.profile_cycles)
+
+
+def build_batcher(args):
+    """ Create the batch notifier shared by all networks if enabled. """
+    if args.batch_size < 1:
+        return None
+    import batch_notifier
+    return batch_notifier.BatchNotifier(batch_size=args.batch_size, flush_interval=args.batch_flush_interval, concurrency=args.concurrency)
+
+
+def build_outbox(args):
+    """ Create and start the outbox if enabled. """
+    if not args.outbox:
+        return None
+    if args.once:
+        logging.warning("Ignoring --outbox when using --once, updates are sent directly")
+        return None
+    from outbox import Outbox, OutboxFile
+
+    state_file = None
+    if args.outbox_file:
+        state_file = OutboxFile(args.outbox_file)
+
+    outbox = Outbox(state_file=state_file, concurrency=args.concurrency)
+    outbox.start()
+    # changes are saved with a short delay, do not lose them when exiting
+    atexit.register(outbox.flush)
+    return outbox
+
+
+def run_multi_record(args, ip_providers, scheduler, rate_limiter=None, outbox=None, store=None, ipv6_providers=None):
+    """ Update all records of the records file, sharing the IP detection per network. """
+    import multi_record
+
+    records = multi_record.load_records(args.records_file)
+    logging.info("Loaded %d records from %s", len(records), args.records_file)
+
+    detectors = build_record_detectors(args, records, ip_providers, scheduler, rate_limiter, outbox, store, ipv6_providers)
+    return start(detectors, args)
+
+
+def build_record_detectors(args, records, ip_providers, scheduler, rate_limiter=None, outbox=None, store=None, ipv6_providers=None, network_state=True):
+    import multi_record
+    return multi_record.build_detectors(
+        records,
+        ip_providers,
+        concurrency=args.concurrency,
+        state_dir=args.state_dir,
+        store=store,
+        outbox=outbox,
+        fanout=args.fanout,
+        hedge_delay=args.hedge_delay,
+        quorum=args.quorum,
+        scheduler=scheduler,
+        rate_limiter=rate_limiter,
+        budget=args.check_budget,
+        provider_timeout=args.provider_timeout,
+        provider_timeouts=args.provider_timeouts,
+        ipv6_providers=ipv6_providers,
+        combined_updates=args.combined_updates,
+        batcher=build_batcher(args),
+        watcher_factory=lambda: build_watcher(args),
+        interval_scheduler_factory=lambda interval: build_interval_scheduler(args, interval),
+        ip_cache_factory=lambda network: build_ip_cache(args, network),
+        detector_class=detector_class(args),
+        network_state=network_state)
+
+
+def run_supervisor(args) -> int:
+    """ Spread the records across worker processes and supervise them. """
+    import supervisor
+
+    init_logging(args.debug)
+    print_config(args, get_ipv4_providers(args.dns_providers, args.providers_file))
+
+    # the rate limits apply to the whole host, every worker gets its share
+    worker_args = argparse.Namespace(**vars(args))
+    worker_args.provider_rate = args.provider_rate / args.workers
+    worker_args.global_rate = args.global_rate / args.workers
+    # the supervisor serves the combined metrics of all workers
+    worker_args.promport = 0
+
+    pool = supervisor.Supervisor(run_worker, args.records_file, args.workers, args=(worker_args,))
+    if args.promport > 0:
+        logging.info("Start prometheus metrics endpoint at %d", args.promport)
+        start_http_server(args.promport, registry=pool.metrics_registry())
+    pool.run()
+    return EXIT_OK
+
+
+def run_worker(index, records, args) -> None:
+    """ Entry point of a worker process, updates its share of the records. """
+    init_logging(args.debug)
+    logging.info("Worker %d updating %d records", index, len(records))
+    instrumentation.configure(buckets=args.latency_buckets, detailed_labels=not args.low_cardinality_metrics)
+    ip_providers = get_ipv4_providers(args.dns_providers, args.providers_file)
+    ipv6_providers = get_ip_providers(args.dns_providers, args.providers_file, family=6) if args.ipv6 else None
+
+    transport.configure(
+        pool_connections=args.pool_connections,
+        pool_maxsize=max(args.pool_maxsize, args.concurrency),
+        idle_timeout=args.pool_idle_timeout,
+        resolver_cache=build_resolver_cache(args))
+
+    scheduler = ProviderScheduler(
+        failure_threshold=args.breaker_threshold,
+        cooldown=args.breaker_cooldown)
+
+    # records move between workers when rebalancing, so the state per network is not restored
+    detectors = build_record_detectors(args, records, ip_providers, scheduler, build_rate_limiter(args), None, build_store(args), ipv6_providers, network_state=False)
+    start(detectors, args)
+
+
+def run_once(detectors, args) -> int:
+    """ Perform a single check per detector and return the exit code. """
+    exit_code = EXIT_OK
+    for detector in detectors:
+        try:
+            if not detector.check_once():
+                exit_code = max(exit_code, EXIT_NO_IP)
+        except Exception as err:
+            logging.error("Could not send update: %s", err)
+            exit_code = max(exit_code, EXIT_UPDATE_FAILED)
+
+    if args.textfile:
+        try:
+            write_to_textfile(args.textfile, REGISTRY)
+        except OSError as err:
+            logging.error("Could not write metrics to %s: %s", args.textfile, err)
+    return exit_code
+
+
+def start(detectors, args):
+    """ Run the detection loops, either on an event loop or in threads. """
+    if args.once:
+        return run_once(detectors, args)
+
+    profiler = build_profiler(args)
+    if profiler and args.asyncio:
+        logging.warning("Ignoring --profile_dir when using --asyncio, check cycles interleave on the event loop")
+    elif profiler:
+        profiler.install()
+        for detector in detectors:
+            detector.profiler = profiler
+
+    if args.asyncio:
+        import asyncio
+        import async_updater
+        asyncio.run(async_updater.run(detectors, args.promport))
+    elif len(detectors) == 1:
+        detectors[0].start()
+    else:
+        import multi_record
+        multi_record.start(detectors)
 
 
 if __name__ == "__main__":
-    initialize()
+    sys.exit(initialize())
@@ -0,0 +1,199 @@
+import ipaddress
+import random
+import socket
+import struct
+import time
+
+import deadline
+
+QTYPE_A = 1
+QTYPE_TXT = 16
+QTYPE_AAAA = 28
+
+QCLASS_IN = 1
+QCLASS_CH = 3
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+_FLAG_QR = 0x8000
+_FLAG_TC = 0x0200
+_FLAG_RD = 0x0100
+_HEADER = struct.Struct("!HHHHHH")
+_MAX_UDP_SIZE = 4096
+
+_random = random.SystemRandom()
+
+
+class DnsError(Exception):
+    """ Raised when a DNS query fails or the response does not pass validation. """
+    def __init__(self, message, rcode=None):
+        super().__init__(message)
+        self.rcode = rcode
+
+
+class ResourceRecord:
+    def __init__(self, name, rtype, rclass, ttl, data):
+        self.name = name
+        self.rtype = rtype
+        self.rclass = rclass
+        self.ttl = ttl
+        self.data = data
+
+    def __repr__(self):
+        return f"ResourceRecord({self.name!r}, {self.rtype}, {self.rclass}, {self.ttl}, {self.data!r})"
+
+
+def _encode_name(name) -> bytes:
+    encoded = b""
+    for label in name.rstrip(".").split("."):
+        if not label:
+            continue
+        raw = label.encode("idna")
+        if len(raw) > 63:
+            raise ValueError(f"label too long: {label}")
+        encoded += bytes([len(raw)]) + raw
+    return encoded + b"\x00"
+
+
+def _read_name(data, offset):
+    """ Read a possibly compressed name, returns the name and the offset after it. """
+    labels = list()
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise DnsError("truncated name")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise DnsError("truncated name pointer")
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 16:
+                raise DnsError("name compression loop")
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        if length & 0xC0:
+            raise DnsError("unsupported label type")
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode("ascii", errors="replace"))
+        offset += length
+
+    return ".".join(labels) + ".", end if end is not None else offset
+
+
+def _decode_rdata(rtype, rdata):
+    if rtype == QTYPE_A:
+        if len(rdata) != 4:
+            raise DnsError("invalid A record")
+        return str(ipaddress.IPv4Address(rdata))
+    if rtype == QTYPE_AAAA:
+        if len(rdata) != 16:
+            raise DnsError("invalid AAAA record")
+        return str(ipaddress.IPv6Address(rdata))
+    if rtype == QTYPE_TXT:
+        strings, offset = list(), 0
+        while offset < len(rdata):
+            length = rdata[offset]
+            strings.append(rdata[offset + 1:offset + 1 + length].decode("ascii", errors="replace"))
+            offset += 1 + length
+        return "".join(strings)
+    return rdata
+
+
+def build_query(qname, qtype, qclass=QCLASS_IN, query_id=None):
+    """ Build a query packet. Returns the query id and the packet. """
+    if query_id is None:
+        query_id = _random.getrandbits(16)
+    header = _HEADER.pack(query_id, _FLAG_RD, 1, 0, 0, 0)
+    return query_id, header + _encode_name(qname) + struct.pack("!HH", qtype, qclass)
+
+
+def parse_response(data, query_id, qname, qtype, qclass=QCLASS_IN) -> list:
+    """ Validate the response against the query and return the answers matching the question. """
+    if len(data) < _HEADER.size:
+        raise DnsError("response too short")
+
+    response_id, flags, qdcount, ancount, _, _ = _HEADER.unpack_from(data)
+    if response_id != query_id:
+        raise DnsError("response id does not match query")
+    if not flags & _FLAG_QR:
+        raise DnsError("not a response")
+    if flags & _FLAG_TC:
+        raise DnsError("response truncated")
+    rcode = flags & 0x000F
+    if rcode != RCODE_NOERROR:
+        raise DnsError(f"server answered with rcode {rcode}", rcode)
+    if qdcount != 1:
+        raise DnsError("unexpected amount of questions")
+
+    offset = _HEADER.size
+    name, offset = _read_name(data, offset)
+    if offset + 4 > len(data):
+        raise DnsError("truncated question")
+    rtype, rclass = struct.unpack_from("!HH", data, offset)
+    offset += 4
+    if name.lower() != qname.rstrip(".").lower() + "." or rtype != qtype or rclass != qclass:
+        raise DnsError("question in response does not match query")
+
+    answers = list()
+    for _ in range(ancount):
+        name, offset = _read_name(data, offset)
+        if offset + 10 > len(data):
+            raise DnsError("truncated answer")
+        rtype, rclass, ttl, length = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        if offset + length > len(data):
+            raise DnsError("truncated rdata")
+        if rtype == qtype and rclass == qclass:
+            answers.append(ResourceRecord(name, rtype, rclass, ttl, _decode_rdata(rtype, data[offset:offset + length])))
+        offset += length
+    return answers
+
+
+def query(qname, qtype, server, port=53, qclass=QCLASS_IN, timeout=2.0, attempts=2) -> list:
+    """
+    Send a single UDP query to the server and return the validated answers. Responses that do
+    not originate from the server or do not match the query are ignored until the timeout.
+    The timeout of every attempt is shortened to the deadline of the current check.
+    """
+    family = socket.AF_INET6 if ipaddress.ip_address(server).version == 6 else socket.AF_INET
+    last_error = None
+    for _ in range(attempts):
+        query_id, packet = build_query(qname, qtype, qclass)
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.connect((server, port))
+            sock.send(packet)
+            until = time.monotonic() + deadline.timeout(timeout)
+            while True:
+                remaining = until - time.monotonic()
+                if remaining <= 0:
+                    last_error = DnsError(f"timeout querying {server}:{port}")
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data = sock.recv(_MAX_UDP_SIZE)
+                except socket.timeout:
+                    continue
+                except OSError as err:
+                    raise DnsError(f"could not query {server}:{port}: {err}")
+                try:
+                    return parse_response(data, query_id, qname, qtype, qclass)
+                except DnsError as err:
+                    if err.rcode is not None:
+                        raise
+                    # possibly spoofed or stale datagram, keep waiting for the real answer
+                    last_error = err
+    raise last_error
+
+
+def query_first(qname, qtype, server, port=53, qclass=QCLASS_IN, timeout=2.0) -> str:
+    """ Return the data of the first answer, e.g. the address of an A record. """
+    answers = query(qname, qtype, server, port=port, qclass=qclass, timeout=timeout)
+    if not answers:
+        raise DnsError(f"no answer for {qname}")
+    return answers[0].data
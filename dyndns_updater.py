@@ -1,23 +1,47 @@
+import contextvars
 import random
+import re
 import logging
 import ipaddress
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-import backoff
 import requests
-from prometheus_client import Counter, Gauge
-from persistence import Persistence
+from prometheus_client import Counter, Gauge, Histogram
+
+import deadline
+import instrumentation
+import retry
+import transport
+from netwatch import SOURCE_POLL
+from persistence import FAMILY_LABELS, Persistence
 
 prom_ipresolver_status = Counter('dnsclient_ipresolver_count_total', 'Amount of calls for external IP resolving', ['site', 'status_code'])
-prom_ipresolver_failed = Counter('dnsclient_ipresolver_failed_total', 'Amount of failed external IP discoverings')
+prom_ipresolver_failed = Counter('dnsclient_ipresolver_failed_total', 'Amount of failed external IP discoverings', ['family'])
 prom_last_check = Gauge('dnsclient_last_check_ts_seconds', 'Timestamp of the latest check for a new IP')
-prom_update_detected = Counter('dnsclient_updates_detected_total', 'Amount of IP updates detected')
-prom_update_detected_ts = Gauge('dnsclient_last_detected_update_ts_seconds', 'Timestamp of update')
+prom_update_detected = Counter('dnsclient_updates_detected_total', 'Amount of IP updates detected', ['family'])
+prom_update_detected_ts = Gauge('dnsclient_last_detected_update_ts_seconds', 'Timestamp of update', ['family'])
+prom_ipresolver_disagreements = Counter('dnsclient_ipresolver_disagreements_total', 'Amount of answers that disagreed with the quorum of providers', ['site'])
+prom_ipresolver_no_quorum = Counter('dnsclient_ipresolver_no_quorum_total', 'Amount of checks where providers did not reach a quorum')
+prom_updates_avoided = Counter('dnsclient_updates_avoided_total', 'Amount of updates skipped because the published record already matched')
+prom_check_triggers = Counter('dnsclient_check_triggers_total', 'Amount of checks per trigger', ['source'])
+prom_detection_latency = Histogram('dnsclient_change_detection_seconds', 'Time from a local network change to the completed check')
+prom_check_budget_used = Histogram('dnsclient_check_budget_used_ratio', 'Share of the time budget of a check used for discovering the IP', buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0))
+prom_deadline_exceeded = Counter('dnsclient_check_deadline_exceeded_total', 'Amount of checks cut off because their time budget was used up')
 prom_backend_errors = Counter('dnsclient_backend_errors_total', 'Errors with backend interaction', ['operation', 'backend_name'])
 
 
+_IPV4_CHARS = re.compile(r"[0-9./]{7,18}")
+_IPV6_CHARS = re.compile(r"[0-9a-fA-F:.]{2,45}")
+
+
+class QueryCancelled(Exception):
+    """ Raised when a provider query is abandoned because another provider already answered. """
+
+
 class UpdateDetector:
-    def __init__(self, update_notifier, ip_providers, interval=None, persistence=None):
+    def __init__(self, update_notifier, ip_providers, interval=None, persistence=None, fanout=1, hedge_delay=0.0, quorum=1, scheduler=None, published_record=None, watcher=None, interval_scheduler=None, ip_cache=None, rate_limiter=None, budget=None, provider_timeout=None, provider_timeouts=None, ipv6_providers=None, published_record_ipv6=None, profiler=None):
         if not update_notifier:
             raise ValueError("No update_notifier configured")
         self.update_notifier = update_notifier
@@ -25,6 +49,10 @@ class UpdateDetector:
         if not ip_providers:
             raise ValueError("No providers for determing IP address found")
         self.ip_providers = ip_providers
+
+        # if set, IPv6 is detected alongside IPv4 in every check
+        self.ipv6_providers = ipv6_providers
+        self.last_ipv6 = None
         
         if not interval:
             interval = 60
@@ -34,13 +62,44 @@ class UpdateDetector:
             persistence = Persistence()
         self.persistence_backend = persistence
 
+        if not fanout or fanout < 1:
+            raise ValueError("fanout must be at least 1")
+        self.fanout = fanout
+
+        if hedge_delay is not None and hedge_delay < 0:
+            raise ValueError("hedge_delay must not be negative")
+        self.hedge_delay = hedge_delay
+
+        if not quorum or quorum < 1:
+            raise ValueError("quorum must be at least 1")
+        if quorum > fanout:
+            raise ValueError("quorum can not be larger than fanout")
+        self.quorum = quorum
+
+        self.scheduler = scheduler
+        self.published_record = published_record
+        self.published_record_ipv6 = published_record_ipv6
+        self.watcher = watcher
+        self.interval_scheduler = interval_scheduler
+        self.ip_cache = ip_cache
+        self.rate_limiter = rate_limiter
+
+        if budget is not None and budget <= 0:
+            raise ValueError("budget must be positive")
+        self.budget = budget
+        self.provider_timeout = provider_timeout
+        self.provider_timeouts = provider_timeouts or dict()
+        # if set, check cycles can be profiled on demand, see profiling.Profiler
+        self.profiler = profiler
+
         self._quit = False
     
     @staticmethod
     def shuffle_providers(providers):
-        """ Makes sure we're using the providers more or less evenly. """
+        """ Makes sure we're using the providers more or less evenly, respecting their weights. """
         if providers:
-            random.shuffle(providers)
+            keys = {id(provider): random.random() ** (1 / getattr(provider[1], "weight", 1.0)) for provider in providers}
+            providers.sort(key=lambda provider: keys[id(provider)], reverse=True)
 
     @staticmethod
     def is_valid_ipv4(ip: str) -> bool:
@@ -48,6 +107,10 @@ class UpdateDetector:
         if not ip:
             return False
 
+        # cheap check to reject garbage before parsing it
+        if not _IPV4_CHARS.fullmatch(ip):
+            return False
+
         try:
             parsed = ipaddress.ip_interface(ip)
             return isinstance(parsed, ipaddress.IPv4Interface)
@@ -55,7 +118,25 @@ class UpdateDetector:
             return False
 
     @staticmethod
-    @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3)
+    def is_valid_ipv6(ip: str) -> bool:
+        """ Check whether the supplied argument is a valid IPv6 address """
+        if not ip or not _IPV6_CHARS.fullmatch(ip):
+            return False
+
+        try:
+            return isinstance(ipaddress.ip_address(ip), ipaddress.IPv6Address)
+        except ValueError:
+            return False
+
+    @staticmethod
+    def normalize_ip(ip: str, family: int = 4):
+        """ Returns the address if it is valid for the family, IPv6 addresses in their compressed form. """
+        if family == 6:
+            return ipaddress.IPv6Address(ip).compressed if UpdateDetector.is_valid_ipv6(ip) else None
+        return ip if UpdateDetector.is_valid_ipv4(ip) else None
+
+    @staticmethod
+    @retry.on_exception(requests.exceptions.RequestException, max_tries=3, operation=instrumentation.OPERATION_PROVIDER)
     def request_wrapper(provider_function):
         """
         Wrapper using a backoff annotation that just executes the function to fetch data
@@ -66,80 +147,404 @@ class UpdateDetector:
 
         return provider_function()
 
-    def get_external_ip(self):
-        """ Iterate all IP providers until the first one gives a valid response. """
+    def _query_provider(self, provider, cancelled=None, family=4):
+        """ Ask a single provider for our external IP. Returns None if it did not yield a valid answer. """
+        if self.rate_limiter and not self.rate_limiter.acquire(provider[0]):
+            return None
+
+        provider_function = provider[1]
+        if cancelled is not None:
+            def provider_function():
+                if cancelled.is_set():
+                    raise QueryCancelled()
+                return provider[1]()
+
+        error = None
+        start = time.monotonic()
+        try:
+            with deadline.budget(self.provider_timeouts.get(provider[0], self.provider_timeout)):
+                external_ip, status_code = UpdateDetector.request_wrapper(provider_function)
+            instrumentation.observe_provider(provider[0], time.monotonic() - start)
+            prom_ipresolver_status.labels(provider[0], status_code).inc()
+            if external_ip:
+                # before proceeding make sure this provider didn't provide garbage
+                external_ip = UpdateDetector.normalize_ip(external_ip.strip(), family)
+                if external_ip and status_code < 400:
+                    if self.scheduler:
+                        self.scheduler.record_success(provider[0], time.monotonic() - start)
+                    return external_ip
+            error = f"invalid response with status code {status_code}"
+        except QueryCancelled:
+            logging.debug("Query to provider '%s' cancelled", provider[0])
+            return None
+        except deadline.DeadlineExceeded:
+            # the time budget ran out, that says nothing about the health of the provider
+            logging.debug("Query to provider '%s' exceeded the deadline", provider[0])
+            instrumentation.observe_provider(provider[0], time.monotonic() - start)
+            return None
+        except transport.ThrottledError as err:
+            prom_ipresolver_status.labels(provider[0], err.status_code).inc()
+            instrumentation.observe_provider(provider[0], time.monotonic() - start)
+            if self.rate_limiter:
+                self.rate_limiter.throttle(provider[0], err.status_code, err.retry_after)
+                # being throttled says nothing about the health of the provider, the limiter benches it
+                return None
+            error = err
+        except Exception as err:
+            logging.debug("Failed to fetch information from provider '%s': %s", provider[0], err)
+            instrumentation.observe_provider(provider[0], time.monotonic() - start)
+            error = err
+
+        if self.scheduler:
+            self.scheduler.record_failure(provider[0], time.monotonic() - start, error)
+        return None
+
+    def _submit(self, executor, provider, cancelled, family):
+        # run in a copy of the context so the query sees the deadline of the check
+        return executor.submit(contextvars.copy_context().run, self._query_provider, provider, cancelled, family)
+
+    @staticmethod
+    def _deadline_exceeded() -> bool:
+        if not deadline.expired():
+            return False
+        logging.warning("Time budget of the check used up, giving up")
+        prom_deadline_exceeded.inc()
+        return True
+
+    def _race_providers(self, providers, family=4):
+        """
+        Query up to `fanout` providers concurrently. Another provider is started whenever a
+        running query fails or no answer arrived within `hedge_delay` seconds. The first valid
+        answer wins, queries that are still running are cancelled.
+        """
+        providers = iter(providers)
+        cancelled = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.fanout)
+        in_flight = set()
+
+        def launch():
+            provider = next(providers, None)
+            if provider is None:
+                return False
+            in_flight.add(self._submit(executor, provider, cancelled, family))
+            return True
+
+        try:
+            exhausted = not launch()
+            while in_flight:
+                can_hedge = not exhausted and len(in_flight) < self.fanout
+                timeout = deadline.clamp(self.hedge_delay if can_hedge else None)
+                done, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result():
+                        return future.result()
+                if self._deadline_exceeded():
+                    return None
+
+                # either all finished queries failed or the hedge delay passed: start more providers
+                for _ in range(len(done) or 1):
+                    if exhausted or len(in_flight) >= self.fanout:
+                        break
+                    exhausted = not launch()
+            return None
+        finally:
+            cancelled.set()
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _quorum_providers(self, providers, family=4):
+        """
+        Query `fanout` providers concurrently and only accept an IP once `quorum` providers
+        agree on it. Failed queries are replaced by the next provider, as are disagreeing ones if
+        the quorum could not be reached otherwise. Returns as soon as the quorum is reached or can
+        not be reached anymore.
+        """
+        providers = iter(providers)
+        cancelled = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.fanout)
+        in_flight = dict()
+        votes = dict()
+        consensus = None
+
+        def launch():
+            provider = next(providers, None)
+            if provider is None:
+                return False
+            in_flight[self._submit(executor, provider, cancelled, family)] = provider[0]
+            return True
+
+        try:
+            exhausted = False
+            while not exhausted and len(in_flight) < self.fanout:
+                exhausted = not launch()
+
+            while in_flight and consensus is None:
+                done, _ = wait(in_flight, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    site = in_flight.pop(future)
+                    external_ip = future.result()
+                    if external_ip:
+                        votes.setdefault(external_ip, []).append(site)
+                        if consensus is None and len(votes[external_ip]) >= self.quorum:
+                            consensus = external_ip
+                    elif not exhausted:
+                        exhausted = not launch()
+
+                # a disagreeing answer frees a slot as well, keep enough providers in flight to reach the quorum
+                best = max((len(sites) for sites in votes.values()), default=0)
+                while consensus is None and not exhausted and best + len(in_flight) < self.quorum:
+                    exhausted = not launch()
+                if best + len(in_flight) < self.quorum:
+                    break
+                if consensus is None and self._deadline_exceeded():
+                    break
+        finally:
+            cancelled.set()
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        if consensus is None:
+            prom_ipresolver_no_quorum.inc()
+            logging.warning("Providers did not agree on an IP: %s", votes)
+            return None
+
+        for external_ip, sites in votes.items():
+            if external_ip != consensus:
+                for site in sites:
+                    logging.warning("Provider '%s' disagreed with quorum: %s != %s", site, external_ip, consensus)
+                    prom_ipresolver_disagreements.labels(site).inc()
+        return consensus
+
+    def get_external_ip(self, family=4):
+        """
+        Returns the external IP from the shared cache if configured, otherwise from the providers.
+        The shared cache only holds the IPv4 address.
+        """
         prom_last_check.set_to_current_time()
-        
-        for provider in self.ip_providers:
+        start = time.monotonic()
+        with deadline.budget(self.budget):
             try:
-                external_ip, status_code = UpdateDetector.request_wrapper(provider[1])
-                prom_ipresolver_status.labels(provider[0], status_code).inc()
+                if family == 6:
+                    return self._discover_external_ip(self.ipv6_providers, family)
+                if self.ip_cache:
+                    try:
+                        return self.ip_cache.get(self._discover_external_ip)
+                    except deadline.DeadlineExceeded:
+                        self._deadline_exceeded()
+                        return None
+                return self._discover_external_ip()
+            finally:
+                if self.budget:
+                    prom_check_budget_used.observe(min(1.0, (time.monotonic() - start) / self.budget))
+
+    def get_external_ips(self):
+        """ Discover the IPv4 and IPv6 address concurrently. Returns None for a family that failed. """
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            ipv6 = executor.submit(contextvars.copy_context().run, self.get_external_ip, 6)
+            return self.get_external_ip(), ipv6.result()
+        finally:
+            executor.shutdown(wait=False)
+
+    def _discover_external_ip(self, providers=None, family=4):
+        """ Iterate all IP providers until the first one gives a valid response. """
+        if providers is None:
+            providers = self.ip_providers
+        if self.scheduler:
+            providers = self.scheduler.order(providers)
+
+        if self.quorum > 1:
+            external_ip = self._quorum_providers(providers, family)
+            if external_ip:
+                return external_ip
+        elif self.fanout > 1:
+            external_ip = self._race_providers(providers, family)
+            if external_ip:
+                return external_ip
+        else:
+            for provider in providers:
+                if self._deadline_exceeded():
+                    break
+                external_ip = self._query_provider(provider, family=family)
                 if external_ip:
-                    external_ip = external_ip.strip()
-                    # before proceeding make sure this provider didn't provide garbage
-                    if UpdateDetector.is_valid_ipv4(external_ip) is True and status_code < 400:
-                        return external_ip
-            except Exception as err:
-                logging.debug("Failed to fetch information from provider '%s': %s", provider[0], err)
-
-        prom_ipresolver_failed.inc()
-        logging.error("Giving up after all providers failed: Is the network down?")
+                    return external_ip
+
+        prom_ipresolver_failed.labels(FAMILY_LABELS[family]).inc()
+        logging.error("Giving up after all IPv%d providers failed: Is the network down?", family)
         return None
 
     @staticmethod
-    def has_update_occured(last_ip, fetched_ip):
+    def has_update_occured(last_ip, fetched_ip, family=4):
         """ Returns True when a IP change has been detected, otherwise False. """
         if fetched_ip and last_ip != fetched_ip:
             logging.info("Detected new IP -> %s", fetched_ip)
-            prom_update_detected.inc()
-            prom_update_detected_ts.set_to_current_time()
+            prom_update_detected.labels(FAMILY_LABELS[family]).inc()
+            prom_update_detected_ts.labels(FAMILY_LABELS[family]).set_to_current_time()
             return True
 
         logging.debug("No update detected")
         return False
 
     def perform_check(self, last_ip):
-        self.shuffle_providers(self.ip_providers)
+        start = time.monotonic()
+        try:
+            return self._perform_check(last_ip)
+        finally:
+            instrumentation.observe_check(time.monotonic() - start)
+
+    def _perform_check(self, last_ip):
+        if not self.scheduler:
+            self.shuffle_providers(self.ip_providers)
+        if self.ipv6_providers:
+            return self._perform_dual_stack_check(last_ip)
         fetched_ip = self.get_external_ip()
 
         if self.has_update_occured(last_ip, fetched_ip) is True:
-            self.update_notifier.notify_update(fetched_ip)
+            if self._is_published(fetched_ip):
+                logging.info("Record is already published with %s, skipping update", fetched_ip)
+                prom_updates_avoided.inc()
+            else:
+                self.update_notifier.notify_update(fetched_ip)
+                if self.published_record:
+                    self.published_record.invalidate()
             self._write_to_persistence_backend(fetched_ip)
             
         return fetched_ip
 
-    def _write_to_persistence_backend(self, new_ip: str) -> None:
+    def _perform_dual_stack_check(self, last_ip):
+        """
+        Detect both addresses in one check. A change of either family sends a single notification
+        carrying both current addresses, a family that could not be detected keeps its last address.
+        Returns the detected IPv4 address.
+        """
+        if not self.scheduler:
+            self.shuffle_providers(self.ipv6_providers)
+        fetched_ip, fetched_ipv6 = self.get_external_ips()
+
+        ipv4_changed = self.has_update_occured(last_ip, fetched_ip)
+        ipv6_changed = self.has_update_occured(self.last_ipv6, fetched_ipv6, family=6)
+        if ipv4_changed or ipv6_changed:
+            ipv4, ipv6 = fetched_ip or last_ip, fetched_ipv6 or self.last_ipv6
+            if self._is_published(ipv4) and self._is_published(ipv6, family=6):
+                logging.info("Record is already published with %s and %s, skipping update", ipv4, ipv6)
+                prom_updates_avoided.inc()
+            else:
+                self.update_notifier.notify_update(ipv4, fetched_ipv6=ipv6)
+                for published_record in (self.published_record, self.published_record_ipv6):
+                    if published_record:
+                        published_record.invalidate()
+            if ipv4_changed:
+                self._write_to_persistence_backend(fetched_ip)
+            if ipv6_changed:
+                self._write_to_persistence_backend(fetched_ipv6, family=6)
+                self.last_ipv6 = fetched_ipv6
+
+        return fetched_ip
+
+    def check_once(self):
+        """
+        Perform a single check against the persisted IP. Returns the detected IP or None,
+        errors while sending the update are raised.
+        """
+        last_ip = self._read_last_ips()
+        return self.perform_check(last_ip)
+
+    def _read_last_ips(self):
+        """ Restore the state of the last check, returns the IPv4 address. """
+        last_ip = self._read_from_persistence_backend()
+        logging.info("Read %s from persistence backend", last_ip)
+        if self.ipv6_providers:
+            self.last_ipv6 = self._read_from_persistence_backend(family=6)
+            logging.info("Read %s from persistence backend", self.last_ipv6)
+        return last_ip
+
+    def _is_published(self, fetched_ip, family=4) -> bool:
+        """ Checks whether the record already points to the IP. Lookup errors never prevent an update. """
+        published_record = self.published_record_ipv6 if family == 6 else self.published_record
+        if not published_record or not fetched_ip:
+            return False
+
+        try:
+            return published_record.matches(fetched_ip)
+        except Exception as err:
+            logging.warning("Could not look up published record: %s", err)
+            return False
+
+    def _write_to_persistence_backend(self, new_ip: str, family: int = 4) -> None:
         logging.debug("Writing IP to persistence backend '%s'", self.persistence_backend.get_plugin_name())
+        start = time.monotonic()
         try:
-            self.persistence_backend.write(new_ip)
+            # persistence plugins written before address families were supported only know IPv4
+            if family == 4:
+                self.persistence_backend.write(new_ip)
+            else:
+                self.persistence_backend.write(new_ip, family)
         except Exception as err:
             prom_backend_errors.labels("write", self.persistence_backend.get_plugin_name()).inc()
             logging.error("Could not write IP to persistence backend '%s': %s", self.persistence_backend.get_plugin_name(), err)
+        finally:
+            instrumentation.observe_persistence("write", self.persistence_backend.get_plugin_name(), time.monotonic() - start)
 
-    def _read_from_persistence_backend(self) -> str:
+    def _read_from_persistence_backend(self, family: int = 4) -> str:
+        start = time.monotonic()
         try:
-            return self.persistence_backend.read()
+            if family == 4:
+                return self.persistence_backend.read()
+            return self.persistence_backend.read(family)
         except Exception as err:
             prom_backend_errors.labels("read", self.persistence_backend.get_plugin_name()).inc()
             logging.warning("Could not read old IP from persistence backend '%s': %s", self.persistence_backend.get_plugin_name(), err)
             return None
+        finally:
+            instrumentation.observe_persistence("read", self.persistence_backend.get_plugin_name(), time.monotonic() - start)
 
     def quit(self):
         self._quit = True
+        if self.watcher:
+            self.watcher.stop()
+
+    def _next_delay(self, changed=False, failed=False) -> float:
+        if not self.interval_scheduler:
+            return self.interval
+        return self.interval_scheduler.next_delay(changed=changed, failed=failed)
+
+    def _wait(self, seconds):
+        """
+        Sleep until the next check is due or the watcher reports a local network change.
+        Returns the trigger source and the time of the change.
+        """
+        if not self.watcher:
+            time.sleep(seconds)
+            return SOURCE_POLL, None
+        return self.watcher.wait(seconds)
 
     def start(self):
         logging.info("Started!")
 
-        last_ip = self._read_from_persistence_backend()
-        logging.info("Read %s from persistence backend", last_ip)
+        last_ip = self._read_last_ips()
+
+        if self.watcher:
+            self.watcher.start()
 
+        perform_check = self.profiler.profiled(self.perform_check) if self.profiler else self.perform_check
+        source, changed_at = SOURCE_POLL, None
         while not self._quit:
             try:
-                last_ip = self.perform_check(last_ip)
-                time.sleep(self.interval)
+                prom_check_triggers.labels(source).inc()
+                fetched_ip = perform_check(last_ip)
+                if changed_at is not None:
+                    prom_detection_latency.observe(time.monotonic() - changed_at)
+                delay = self._next_delay(changed=fetched_ip is not None and fetched_ip != last_ip, failed=fetched_ip is None)
+                last_ip = fetched_ip
+                source, changed_at = self._wait(delay)
+                if source != SOURCE_POLL and self.ip_cache:
+                    # the cached IP is likely outdated after a local network change
+                    self.ip_cache.invalidate()
             except KeyboardInterrupt:
                 logging.info("Received signal, quitting")
                 self.quit()
             except Exception as error:
-                time.sleep(self.interval)
-                logging.error("Error while updating: %s", error)
\ No newline at end of file
+                source, changed_at = self._wait(self._next_delay(failed=True))
+                logging.error("Error while updating: %s", error)
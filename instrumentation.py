@@ -0,0 +1,79 @@
+from prometheus_client import REGISTRY, Histogram
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TRIES_BUCKETS = (1, 2, 3, 4, 5, 7, 10)
+AGGREGATED = "all"
+
+OPERATION_PROVIDER = "ip_provider"
+OPERATION_UPDATE = "update"
+
+
+class _Histograms:
+    def __init__(self, buckets, registry):
+        self.provider = Histogram('dnsclient_provider_request_seconds', 'Duration of querying an IP provider including retries', ['site'], buckets=buckets, registry=registry)
+        self.check = Histogram('dnsclient_check_duration_seconds', 'Duration of a complete check including notification and persistence', buckets=buckets, registry=registry)
+        self.update = Histogram('dnsclient_update_request_seconds', 'Duration of a single update request to the server', buckets=buckets, registry=registry)
+        self.persistence = Histogram('dnsclient_persistence_seconds', 'Duration of reading or writing the persistence backend', ['operation', 'backend_name'], buckets=buckets, registry=registry)
+        self.tries = Histogram('dnsclient_backoff_tries', 'Amount of attempts until a retried operation succeeded or gave up', ['operation'], buckets=TRIES_BUCKETS, registry=registry)
+        self._registry = registry
+
+    def unregister(self):
+        for histogram in (self.provider, self.check, self.update, self.persistence, self.tries):
+            self._registry.unregister(histogram)
+
+
+_histograms = _Histograms(DEFAULT_BUCKETS, REGISTRY)
+_detailed_labels = True
+
+
+def configure(buckets=None, detailed_labels=True, registry=REGISTRY) -> None:
+    """
+    Replace the latency histograms using the given buckets. Without detailed labels, metrics
+    labelled per provider or per record are aggregated, which keeps large fleets cheap to scrape.
+    """
+    global _histograms, _detailed_labels
+    buckets = tuple(sorted(buckets)) if buckets else DEFAULT_BUCKETS
+    _histograms.unregister()
+    _histograms = _Histograms(buckets, registry)
+    _detailed_labels = detailed_labels
+
+
+def parse_buckets(value) -> tuple:
+    """ Parse a comma separated list of bucket bounds in seconds. """
+    if not value:
+        return DEFAULT_BUCKETS
+    try:
+        buckets = tuple(sorted(float(bound) for bound in value.split(",") if bound.strip()))
+    except ValueError:
+        raise ValueError(f"invalid buckets: {value}")
+    if not buckets or buckets[0] <= 0:
+        raise ValueError(f"buckets must be positive: {value}")
+    return buckets
+
+
+def label(value) -> str:
+    """ Returns the label value, or a constant if detailed labels are turned off. """
+    return value if _detailed_labels else AGGREGATED
+
+
+def observe_provider(site, seconds) -> None:
+    _histograms.provider.labels(label(site)).observe(seconds)
+
+
+def observe_check(seconds) -> None:
+    _histograms.check.observe(seconds)
+
+
+def observe_update(seconds) -> None:
+    _histograms.update.observe(seconds)
+
+
+def observe_persistence(operation, backend_name, seconds) -> None:
+    _histograms.persistence.labels(operation, backend_name).observe(seconds)
+
+
+def backoff_handler(operation):
+    """ Handler for backoff's on_success and on_giveup hooks that records the amount of tries. """
+    def handler(details):
+        _histograms.tries.labels(operation).observe(details["tries"])
+    return handler
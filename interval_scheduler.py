@@ -0,0 +1,51 @@
+import logging
+import random
+import time
+
+from prometheus_client import Gauge
+
+prom_check_interval = Gauge('dnsclient_check_interval_seconds', 'Current upper bound of the interval between checks')
+prom_next_check_ts = Gauge('dnsclient_next_check_ts_seconds', 'Timestamp of the next scheduled check')
+
+
+class IntervalScheduler:
+    """
+    Decides how long to sleep between checks. The interval grows by `growth` after every check
+    without a change, up to `max_interval`, and is reset right after a change or a failure.
+    The actual delay is drawn uniformly between `min_interval`, shortened by the fraction
+    `jitter`, and the current interval (bounded jitter), so clients started at the same time
+    drift apart instead of polling in lockstep. With equal bounds the interval is fixed and
+    only `jitter` spreads the delays.
+    """
+    def __init__(self, min_interval, max_interval, growth=2.0, jitter=0.0, clock=time.time, rand=random.random):
+        if not min_interval or min_interval <= 0:
+            raise ValueError("min_interval must be positive")
+        if max_interval < min_interval:
+            raise ValueError("max_interval must not be smaller than min_interval")
+        if growth < 1:
+            raise ValueError("growth must be at least 1")
+        if not 0 <= jitter < 1:
+            raise ValueError("jitter must be between 0 and 1")
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.jitter = jitter
+        self._clock = clock
+        self._rand = rand
+        self._reset_interval = min(max_interval, min_interval * growth)
+        self.interval = self._reset_interval
+
+    def next_delay(self, changed=False, failed=False) -> float:
+        """ Returns the seconds to wait until the next check. """
+        if changed or failed:
+            self.interval = self._reset_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.growth)
+
+        lower = self.min_interval * (1 - self.jitter)
+        delay = lower + self._rand() * (self.interval - lower)
+        logging.debug("Next check in %.1fs (interval %.1fs, changed=%s, failed=%s)", delay, self.interval, changed, failed)
+        prom_check_interval.set(self.interval)
+        prom_next_check_ts.set(self._clock() + delay)
+        return delay
@@ -1,8 +1,7 @@
 from unittest import TestCase
-from inspect import getmembers, isfunction
 
 import logging
-import ipv4_providers
+import provider_registry
 
 class TestProviders(TestCase):
     @staticmethod
@@ -12,7 +11,7 @@ class TestProviders(TestCase):
         logging.getLogger("urllib3").setLevel(logging.WARNING)
 
     def test_providers(self):
-        providers = [f for f in getmembers(ipv4_providers, isfunction)]
+        providers = provider_registry.as_ip_providers(provider_registry.default_providers())
         logging.info("Got %d providers", len(providers))
 
         failing_providers = list()
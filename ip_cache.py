@@ -0,0 +1,126 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+from prometheus_client import Counter, Gauge
+
+import deadline
+
+prom_ip_cache_requests = Counter('dnsclient_ip_cache_requests_total', 'Amount of IP lookups through the shared cache', ['result'])
+prom_ip_cache_age = Gauge('dnsclient_ip_cache_age_seconds', 'Age of the IP served by the shared cache')
+
+RESULT_HIT = "hit"
+RESULT_COALESCED = "coalesced"
+RESULT_REFRESHED = "refreshed"
+RESULT_ERROR = "error"
+
+
+class SharedIpCache:
+    """
+    IP discovery cache in a file shared by all clients on the host. A cached IP is served as
+    long as it is at most `max_age` seconds old. Otherwise a single client refreshes it
+    upstream while holding an exclusive lock, the others wait and use its result. Waiting for
+    the lock is bounded by `lock_timeout` and the deadline of the current check.
+    """
+    def __init__(self, path, max_age=60, lock_timeout=30.0, clock=time.time):
+        if not path:
+            raise ValueError("no path supplied")
+        if max_age <= 0:
+            raise ValueError("max_age must be positive")
+
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.max_age = max_age
+        self.lock_timeout = lock_timeout
+        self._clock = clock
+
+    def _read(self):
+        """ Returns the cached IP and when it was fetched, or (None, None). """
+        try:
+            with open(self.path, "r") as f:
+                entry = json.load(f)
+            return entry["ip"], float(entry["fetched_at"])
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logging.warning("Ignoring unreadable IP cache %s: %s", self.path, err)
+            return None, None
+
+    def _write(self, ip) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"ip": ip, "fetched_at": self._clock()}, f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _fresh(self):
+        ip, fetched_at = self._read()
+        if ip is None:
+            return None
+        age = self._clock() - fetched_at
+        if age < 0 or age > self.max_age:
+            return None
+        prom_ip_cache_age.set(age)
+        return ip
+
+    def _lock(self, f) -> bool:
+        """ Returns False if the lock timeout passed, raises DeadlineExceeded if the deadline of the check passed. """
+        until = time.monotonic() + deadline.clamp(self.lock_timeout)
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if deadline.expired():
+                    raise deadline.DeadlineExceeded()
+                if time.monotonic() >= until:
+                    return False
+                time.sleep(min(0.05, max(0.0, until - time.monotonic())))
+
+    def get(self, refresh):
+        """
+        Returns a cached IP that is not too old, or calls `refresh` to discover it upstream.
+        Raises DeadlineExceeded if the deadline of the check passed while waiting for the lock.
+        """
+        ip = self._fresh()
+        if ip:
+            prom_ip_cache_requests.labels(RESULT_HIT).inc()
+            return ip
+
+        with open(self.lock_path, "a") as lock:
+            if not self._lock(lock):
+                logging.warning("Timed out waiting for the lock of the IP cache, refreshing without it")
+            else:
+                # another client may have refreshed the cache while we were waiting
+                ip = self._fresh()
+                if ip:
+                    prom_ip_cache_requests.labels(RESULT_COALESCED).inc()
+                    return ip
+
+            ip = refresh()
+            if not ip:
+                prom_ip_cache_requests.labels(RESULT_ERROR).inc()
+                return None
+
+            try:
+                self._write(ip)
+            except OSError as err:
+                logging.error("Could not write IP cache %s: %s", self.path, err)
+            prom_ip_cache_requests.labels(RESULT_REFRESHED).inc()
+            prom_ip_cache_age.set(0)
+            return ip
+
+    def invalidate(self) -> None:
+        """ Forget the cached IP, e.g. after the local network changed. """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import Counter, Gauge
+
+import instrumentation
+from dyndns_updater import UpdateDetector
+from notifier import UpdateNotifier
+from persistence import FilePersistence
+
+prom_record_updates = Counter('dnsclient_record_updates_total', 'Amount of update notifications sent per record', ['record', 'status'])
+prom_record_last_update = Gauge('dnsclient_record_last_update_ts_seconds', 'Timestamp of the last successful update of the record', ['record'])
+
+DEFAULT_NETWORK = "default"
+DEFAULT_CONCURRENCY = 16
+
+
+class RecordConfig:
+    def __init__(self, record, url, secret, interval=60, network=DEFAULT_NETWORK):
+        if not record:
+            raise ValueError("record not specified")
+        if not url:
+            raise ValueError(f"url not specified for record {record}")
+        if not secret:
+            raise ValueError(f"secret not specified for record {record}")
+
+        self.record = record
+        self.url = url
+        self.secret = secret
+        self.interval = interval or 60
+        self.network = network or DEFAULT_NETWORK
+
+
+class FanoutError(Exception):
+    """ Raised when some of the records could not be updated. """
+    def __init__(self, failed):
+        super().__init__(f"Could not update {len(failed)} record(s): {', '.join(sorted(failed)[:10])}")
+        self.failed = failed
+
+
+def load_records(path) -> list:
+    """
+    Read the records from a JSON file. Values at the top level serve as defaults for all records:
+    {"url": "https://...", "interval": 60, "records": [{"record": "a.example.com.", "secret": "..."}]}
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+
+    defaults = {key: config[key] for key in ("url", "secret", "interval", "network") if key in config}
+    records = list()
+    for entry in config.get("records", []):
+        values = dict(defaults)
+        values.update(entry)
+        records.append(RecordConfig(
+            record=values.get("record"),
+            url=values.get("url"),
+            secret=values.get("secret"),
+            interval=values.get("interval"),
+            network=values.get("network")))
+
+    if not records:
+        raise ValueError(f"No records defined in {path}")
+    return records
+
+
+class RecordFanout:
+    """
+    Notifier that forwards a detected IP to many records using at most `concurrency` requests
+    at a time. Records that already received the IP are skipped, so when the detector retries
+    after a partial failure only the failed records are notified again. If a SqliteStore is
+    given, the IP per record is saved in one batch after each round and restored on startup.
+    The state is kept per address family. With a BatchNotifier, the updates are sent in
+    batched requests instead of one request per record.
+    """
+    def __init__(self, notifiers, concurrency=DEFAULT_CONCURRENCY, store=None, batcher=None):
+        if not notifiers:
+            raise ValueError("No notifiers configured")
+        self.notifiers = notifiers
+
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+
+        self.store = store
+        self.batcher = batcher
+        self._state = {4: dict(), 6: dict()}
+        self._lock = threading.Lock()
+        if store:
+            records = {notifier.dns_record for notifier in notifiers}
+            for family in self._state:
+                self._state[family] = {record: ip for record, ip in store.read_all(family).items() if record in records}
+
+    def last_ip(self, record, family=4):
+        with self._lock:
+            return self._state[family].get(record)
+
+    def _is_pending(self, record, fetched_ip, fetched_ipv6) -> bool:
+        if fetched_ip and self.last_ip(record) != fetched_ip:
+            return True
+        return bool(fetched_ipv6) and self.last_ip(record, 6) != fetched_ipv6
+
+    def _notify(self, notifier, fetched_ip, fetched_ipv6, retry):
+        try:
+            if fetched_ipv6 is None:
+                notifier.notify_update(fetched_ip, retry=retry)
+            else:
+                notifier.notify_update(fetched_ip, retry=retry, fetched_ipv6=fetched_ipv6)
+        except Exception as err:
+            return self._notified(notifier, fetched_ip, fetched_ipv6, err)
+        return self._notified(notifier, fetched_ip, fetched_ipv6)
+
+    def _notified(self, notifier, fetched_ip, fetched_ipv6, err=None):
+        """ Account for the outcome of an update, returns whether it succeeded. """
+        if err is not None:
+            logging.error("Could not update record '%s': %s", notifier.dns_record, err)
+            prom_record_updates.labels(instrumentation.label(notifier.dns_record), "error").inc()
+            return False
+
+        with self._lock:
+            for family, ip in ((4, fetched_ip), (6, fetched_ipv6)):
+                if ip:
+                    self._state[family][notifier.dns_record] = ip
+        prom_record_updates.labels(instrumentation.label(notifier.dns_record), "success").inc()
+        prom_record_last_update.labels(instrumentation.label(notifier.dns_record)).set_to_current_time()
+        return True
+
+    def notify_update(self, fetched_ip, retry=True, fetched_ipv6=None):
+        pending = [notifier for notifier in self.notifiers if self._is_pending(notifier.dns_record, fetched_ip, fetched_ipv6)]
+        logging.info("Updating %d of %d records", len(pending), len(self.notifiers))
+
+        if self.batcher and pending:
+            errors = self.batcher.notify_many(pending, fetched_ip, fetched_ipv6, retry)
+            results = [self._notified(notifier, fetched_ip, fetched_ipv6, err) for notifier, err in zip(pending, errors)]
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                results = list(executor.map(lambda notifier: self._notify(notifier, fetched_ip, fetched_ipv6, retry), pending))
+
+        if self.store:
+            for family, ip in ((4, fetched_ip), (6, fetched_ipv6)):
+                updated = {notifier.dns_record: ip for notifier, success in zip(pending, results) if success and ip}
+                try:
+                    self.store.write_many(updated, family)
+                except Exception as err:
+                    logging.error("Could not save state of %d records: %s", len(updated), err)
+
+        failed = [notifier.dns_record for notifier, success in zip(pending, results) if not success]
+        if failed:
+            raise FanoutError(failed)
+
+
+def group_by_network(records) -> dict:
+    groups = dict()
+    for record in records:
+        groups.setdefault(record.network, []).append(record)
+    return groups
+
+
+def build_detectors(records, ip_providers, concurrency=DEFAULT_CONCURRENCY, state_dir=None, store=None, outbox=None, watcher_factory=None, interval_scheduler_factory=None, ip_cache_factory=None, detector_class=UpdateDetector, combined_updates=False, batcher=None, network_state=True, **detector_args) -> list:
+    """
+    Build one UpdateDetector per network. All records of a network share a single IP
+    detection that runs at the shortest interval of its records. If an outbox is given,
+    updates are handed over to it instead of being sent by the detection loop. A SqliteStore
+    keeps the state of every record and network and takes precedence over state_dir. As each
+    network has its own external IP, `ip_cache_factory` is called with the network name.
+    A BatchNotifier is shared by all networks, so their updates can end up in the same batch.
+    Without `network_state` the detected IP per network is not restored, so the first check
+    notifies every record whose own state does not match, e.g. after records were reassigned.
+    """
+    detectors = list()
+    for network, members in sorted(group_by_network(records).items()):
+        notifiers = [UpdateNotifier(dns_record=r.record, host=r.url, shared_secret=r.secret, combined=combined_updates) for r in members]
+        if outbox:
+            notifiers = [outbox.register(notifier) for notifier in notifiers]
+
+        persistence = None
+        if network_state and store:
+            persistence = store.for_record(f"network:{network}")
+        elif network_state and state_dir:
+            persistence = FilePersistence(os.path.join(state_dir, f"{network}.ip"))
+
+        interval = min(r.interval for r in members)
+        logging.info("Network '%s': %d records, interval=%d", network, len(members), interval)
+        detectors.append(detector_class(
+            update_notifier=RecordFanout(notifiers, concurrency, store=store, batcher=batcher),
+            ip_providers=list(ip_providers),
+            interval=interval,
+            persistence=persistence,
+            watcher=watcher_factory() if watcher_factory else None,
+            interval_scheduler=interval_scheduler_factory(interval) if interval_scheduler_factory else None,
+            ip_cache=ip_cache_factory(network) if ip_cache_factory else None,
+            **detector_args))
+    return detectors
+
+
+def start(detectors) -> None:
+    """ Run the detection loops of all networks until they quit. """
+    threads = [threading.Thread(target=detector.start, daemon=True) for detector in detectors]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        logging.info("Received signal, quitting")
+        for detector in detectors:
+            detector.quit()
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import socket
+import struct
+import threading
+import time
+
+SOURCE_POLL = "poll"
+
+# netlink multicast groups and message types, see linux/rtnetlink.h
+_NETLINK_ROUTE = 0
+_RTMGRP_LINK = 0x1
+_RTMGRP_IPV4_IFADDR = 0x10
+_RTMGRP_IPV4_ROUTE = 0x40
+_RTMGRP_IPV6_IFADDR = 0x100
+_RTMGRP_IPV6_ROUTE = 0x400
+_RTM_TYPES = {
+    16: "newlink", 17: "dellink",
+    20: "newaddr", 21: "deladdr",
+    24: "newroute", 25: "delroute",
+}
+_NLMSGHDR = struct.Struct("=IHHII")
+
+PROCFS_FILES = ("/proc/net/route", "/proc/net/fib_trie", "/proc/net/if_inet6", "/proc/net/ipv6_route")
+
+
+class ChangeWatcher:
+    """
+    Wakes up the detection loop when the local network state changes. Events arriving
+    within `settle` seconds of each other are merged into a single trigger.
+    """
+    def __init__(self, settle=1.0):
+        self.settle = settle
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._source = None
+        self._changed_at = None
+
+    def notify(self, source) -> None:
+        """ Report a local change, e.g. from a netlink message. """
+        with self._lock:
+            if self._changed_at is None:
+                self._source = source
+                self._changed_at = time.monotonic()
+        self._event.set()
+
+    def wait(self, timeout):
+        """
+        Block until a change was reported or `timeout` seconds passed. Returns the source of
+        the trigger and the monotonic time of the first change, or SOURCE_POLL and None.
+        """
+        if not self._event.wait(timeout):
+            return SOURCE_POLL, None
+
+        if self.settle:
+            time.sleep(self.settle)
+
+        with self._lock:
+            self._event.clear()
+            source, changed_at = self._source, self._changed_at
+            self._source = self._changed_at = None
+        return source, changed_at
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        """ Wake up a pending wait. """
+        self._event.set()
+
+
+class NetlinkWatcher(ChangeWatcher):
+    """ Listens to rtnetlink address, route and link events (Linux only). """
+    GROUPS = _RTMGRP_LINK | _RTMGRP_IPV4_IFADDR | _RTMGRP_IPV4_ROUTE | _RTMGRP_IPV6_IFADDR | _RTMGRP_IPV6_ROUTE
+
+    def __init__(self, settle=1.0):
+        super().__init__(settle)
+        self._sock = None
+        self._thread = None
+
+    @staticmethod
+    def parse_messages(data) -> list:
+        """ Returns the names of all relevant rtnetlink messages in the datagram. """
+        events, offset = list(), 0
+        while offset + _NLMSGHDR.size <= len(data):
+            length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+            if length < _NLMSGHDR.size:
+                break
+            if msg_type in _RTM_TYPES:
+                events.append(_RTM_TYPES[msg_type])
+            # messages are aligned to 4 bytes
+            offset += (length + 3) & ~3
+        return events
+
+    def _run(self, sock) -> None:
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            events = self.parse_messages(data)
+            if events:
+                logging.debug("Received netlink events %s", events)
+                self.notify("netlink")
+
+    def start(self) -> None:
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, _NETLINK_ROUTE)
+        self._sock.bind((0, self.GROUPS))
+        self._thread = threading.Thread(target=self._run, args=(self._sock,), name="netlink", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        super().stop()
+
+
+class ProcNetWatcher(ChangeWatcher):
+    """ Polls the routing and address tables in /proc/net for changes, for systems without netlink access. """
+    def __init__(self, poll_interval=2.0, files=PROCFS_FILES, settle=0.0):
+        super().__init__(settle)
+        self.poll_interval = poll_interval
+        self.files = files
+        self._stop = threading.Event()
+        self._thread = None
+
+    def fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        for path in self.files:
+            try:
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+            except OSError:
+                digest.update(b"-")
+        return digest.hexdigest()
+
+    def _run(self) -> None:
+        last = self.fingerprint()
+        while not self._stop.wait(self.poll_interval):
+            current = self.fingerprint()
+            if current != last:
+                logging.debug("Network state in /proc/net changed")
+                last = current
+                self.notify("procfs")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="procfs", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        super().stop()
+
+
+def build_watcher(kind) -> ChangeWatcher:
+    if kind == "netlink":
+        return NetlinkWatcher()
+    if kind == "procfs":
+        return ProcNetWatcher()
+    raise ValueError(f"unknown watcher '{kind}'")
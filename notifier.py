@@ -1,17 +1,33 @@
 import hashlib
 import json
 import logging
+import time
 
-import backoff
 import requests
 from prometheus_client import Counter
 
+import instrumentation
+import retry
+import transport
+
 
 prom_update_request_status_code = Counter('dnsclient_update_requests_total', 'Status code of request', ['status_code'])
+prom_combined_fallbacks = Counter('dnsclient_combined_update_fallbacks_total', 'Amount of combined updates rejected by the server and sent as one request per address')
+
+
+class UpdateRejected(ValueError):
+    """ Raised when the server answers an update with an error status code. """
+    def __init__(self, status_code):
+        super().__init__(f"server rejected update with status code {status_code}")
+        self.status_code = status_code
+
+    @property
+    def client_error(self) -> bool:
+        return 400 <= self.status_code < 500 and self.status_code != 429
 
 
 class UpdateNotifier:
-    def __init__(self, dns_record, host, shared_secret):
+    def __init__(self, dns_record, host, shared_secret, combined=False):
         self._set_dns_record(dns_record)
 
         if not host:
@@ -22,6 +38,9 @@ class UpdateNotifier:
             raise ValueError("secret not specified")
         self.shared_secret = shared_secret
 
+        # whether to send the IPv4 and IPv6 address in a single request, disabled once the server rejects it
+        self.combined = combined
+
     def _set_dns_record(self, dns_record):
         """
         Set the DNS record. The model requires the record to end with a dot,
@@ -34,10 +53,43 @@ class UpdateNotifier:
             dns_record += "."
         self.dns_record = dns_record
 
-    def notify_update(self, fetched_ip):
-        payload = self._build_request(fetched_ip)
-        self._send_update(payload)
-    
+    def notify_update(self, fetched_ip, retry=True, fetched_ipv6=None):
+        """
+        Send the IP to the server. Without `retry`, only a single attempt is made. If combined, an
+        IPv6 address is sent in the same request. Servers rejecting that with a client error do not
+        support it, the addresses are then sent in a request each from now on.
+        """
+        if fetched_ipv6 is not None and self.combined:
+            try:
+                self._notify(self._build_combined_request(fetched_ip, fetched_ipv6), retry)
+                return
+            except UpdateRejected as err:
+                if not err.client_error:
+                    raise
+                self.disable_combined(err.status_code)
+
+        for payload in self.build_payloads(fetched_ip, fetched_ipv6):
+            self._notify(payload, retry)
+
+    def disable_combined(self, status_code) -> None:
+        logging.warning("Server rejected combined update of '%s' with status code %d, sending one request per address from now on", self.dns_record, status_code)
+        prom_combined_fallbacks.inc()
+        self.combined = False
+
+    def _notify(self, payload, retry) -> None:
+        if retry:
+            self._send_update(payload)
+        else:
+            self._post_update(payload)
+
+    def build_payloads(self, fetched_ip, fetched_ipv6=None) -> list:
+        """ Returns the signed request objects needed to send the IPs to the server. """
+        if fetched_ipv6 is None:
+            return [self._build_request(fetched_ip)]
+        if self.combined:
+            return [self._build_combined_request(fetched_ip, fetched_ipv6)]
+        return [self._build_request(ip) for ip in (fetched_ip, fetched_ipv6) if ip]
+
     @staticmethod
     def hash_request(host, external_ip, shared_secret):
         """ 'Sign' our request with the shared secret. """
@@ -58,8 +110,25 @@ class UpdateNotifier:
         payload["public_ip"] = external_ip
         return payload
 
-    @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=10)
+    def _build_combined_request(self, external_ip, external_ipv6):
+        """ Create request object carrying both addresses, the hash covers both of them. """
+        if not external_ipv6:
+            raise ValueError("Can not build request object, external_ipv6 is missing")
+
+        payload = dict()
+        payload["validation_hash"] = UpdateNotifier.hash_request(self.dns_record, f"{external_ip or ''}{external_ipv6}", self.shared_secret)
+        payload["dns_record"] = self.dns_record
+        if external_ip:
+            payload["public_ip"] = external_ip
+        payload["public_ipv6"] = external_ipv6
+        return payload
+
+    @retry.on_exception(requests.exceptions.RequestException, max_tries=10, operation=instrumentation.OPERATION_UPDATE)
     def _send_update(self, payload):
+        """ Notify the server about an updated IP address, retrying on connection errors. """
+        self._post_update(payload)
+
+    def _post_update(self, payload):
         """ Notify the server about an updated IP address. """
         if not payload:
             raise ValueError("payload must not be empty")
@@ -67,9 +136,13 @@ class UpdateNotifier:
         logging.info("Sending update to remote server")
 
         headers = {'Content-type': 'application/json', 'Accept': 'text/plain'}
-        response = requests.post(self.host, data=json.dumps(payload), headers=headers)
-        
+        start = time.monotonic()
+        try:
+            response = transport.get_session().post(self.host, data=json.dumps(payload), headers=headers)
+        finally:
+            instrumentation.observe_update(time.monotonic() - start)
+
         prom_update_request_status_code.labels(response.status_code).inc()
         logging.debug("Response from remote: %s", response.status_code)
         if response.status_code >= 400:
-            raise ValueError()
\ No newline at end of file
+            raise UpdateRejected(response.status_code)
\ No newline at end of file
@@ -0,0 +1,244 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from persistence import write_atomic
+
+prom_outbox_depth = Gauge('dnsclient_outbox_depth', 'Amount of records with a pending update')
+prom_outbox_oldest_age = Gauge('dnsclient_outbox_oldest_pending_age_seconds', 'Age of the oldest pending update')
+prom_outbox_send_duration = Histogram('dnsclient_outbox_send_duration_seconds', 'Duration of sending a pending update to the server')
+prom_outbox_sends = Counter('dnsclient_outbox_sends_total', 'Amount of send attempts of pending updates', ['status'])
+prom_outbox_coalesced = Counter('dnsclient_outbox_coalesced_total', 'Amount of pending updates superseded by a newer IP before being sent')
+
+
+class PendingUpdate:
+    def __init__(self, record, ip, enqueued_at, attempts=0, next_attempt=0.0):
+        self.record = record
+        self.ip = ip
+        self.enqueued_at = enqueued_at
+        self.attempts = attempts
+        self.next_attempt = next_attempt
+        self.in_flight = False
+
+
+class QueuedNotifier:
+    """ Drop-in replacement for an UpdateNotifier that hands the update over to the outbox. """
+    def __init__(self, outbox, notifier):
+        self.outbox = outbox
+        self.notifier = notifier
+        self.dns_record = notifier.dns_record
+
+    def notify_update(self, fetched_ip, retry=True):
+        self.outbox.enqueue(self.dns_record, fetched_ip)
+
+
+class OutboxFile:
+    """ Saves the pending updates of the outbox as JSON, replacing the whole file atomically. """
+    def __init__(self, path):
+        if not path:
+            raise ValueError("no path supplied")
+        self.path = path
+
+    def load(self) -> dict:
+        """ Returns the saved updates, none if the file does not exist yet. """
+        try:
+            with open(self.path, "r") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return dict()
+        return json.loads(content) if content.strip() else dict()
+
+    def save(self, state: dict) -> None:
+        write_atomic(self.path, json.dumps(state))
+
+
+class Outbox:
+    """
+    Sends updates in the background so the detection loop never waits for the server. Only
+    the newest IP per record is kept, failed sends are retried with exponential backoff and
+    pending updates are saved to `state_file` to survive restarts. Saving is done by a
+    separate thread that collects the changes of `save_delay` seconds into a single write.
+    """
+    def __init__(self, state_file=None, concurrency=1, min_retry=1.0, max_retry=300.0, save_delay=0.5, clock=time.time):
+        self.state_file = state_file
+
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+
+        if save_delay < 0:
+            raise ValueError("save_delay must not be negative")
+        self.save_delay = save_delay
+
+        self.min_retry = min_retry
+        self.max_retry = max_retry
+        self._clock = clock
+        self._pending = dict()
+        self._notifiers = dict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._quit = False
+
+        self._unsaved = False
+        self._save_lock = threading.Lock()
+        self._save_requested = threading.Event()
+        self._stopping = threading.Event()
+        self._writer = None
+
+        self._restore()
+        prom_outbox_oldest_age.set_function(self.oldest_age)
+
+    def register(self, notifier) -> QueuedNotifier:
+        """ Make the outbox able to send updates for the notifier's record. """
+        with self._cond:
+            self._notifiers[notifier.dns_record] = notifier
+            self._cond.notify()
+        return QueuedNotifier(self, notifier)
+
+    def enqueue(self, record, ip) -> None:
+        with self._cond:
+            if record in self._pending:
+                logging.debug("Replacing pending update of '%s' with %s", record, ip)
+                prom_outbox_coalesced.inc()
+            self._pending[record] = PendingUpdate(record, ip, self._clock())
+            self._save()
+            self._cond.notify()
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def oldest_age(self) -> float:
+        with self._cond:
+            if not self._pending:
+                return 0
+            return self._clock() - min(update.enqueued_at for update in self._pending.values())
+
+    def _due(self, now) -> list:
+        due = [update for update in self._pending.values()
+               if not update.in_flight and update.next_attempt <= now and update.record in self._notifiers]
+        due = sorted(due, key=lambda update: update.next_attempt)[:self.concurrency]
+        for update in due:
+            update.in_flight = True
+        return due
+
+    def _next_wakeup(self, now):
+        waiting = [update.next_attempt for update in self._pending.values() if not update.in_flight and update.record in self._notifiers]
+        if not waiting:
+            return None
+        return max(0, min(waiting) - now)
+
+    def _send(self, update) -> None:
+        notifier = self._notifiers[update.record]
+        start = time.monotonic()
+        try:
+            notifier.notify_update(update.ip, retry=False)
+            success = True
+        except Exception as err:
+            logging.warning("Could not send update of '%s' to %s (attempt %d): %s", update.record, update.ip, update.attempts + 1, err)
+            success = False
+        prom_outbox_send_duration.observe(time.monotonic() - start)
+        prom_outbox_sends.labels("success" if success else "error").inc()
+
+        with self._cond:
+            update.in_flight = False
+            if self._pending.get(update.record) is not update:
+                # superseded by a newer IP while sending, the newer one is sent next
+                return
+
+            if success:
+                del self._pending[update.record]
+            else:
+                update.attempts += 1
+                delay = min(self.max_retry, self.min_retry * 2 ** (update.attempts - 1))
+                update.next_attempt = self._clock() + delay * random.uniform(0.5, 1)
+            self._save()
+
+    def process_once(self, executor=None) -> int:
+        """ Send all updates that are due. Returns the amount of updates attempted. """
+        with self._cond:
+            due = self._due(self._clock())
+        if executor and len(due) > 1:
+            list(executor.map(self._send, due))
+        else:
+            for update in due:
+                self._send(update)
+        return len(due)
+
+    def _run(self) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not self._quit:
+                if self.process_once(executor):
+                    continue
+                with self._cond:
+                    if not self._quit:
+                        self._cond.wait(self._next_wakeup(self._clock()))
+
+    def start(self) -> None:
+        logging.info("Starting outbox with %d pending updates", self.depth())
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+        if self.state_file:
+            self._writer = threading.Thread(target=self._write_loop, name="outbox-writer", daemon=True)
+            self._writer.start()
+
+    def quit(self, timeout=None) -> None:
+        with self._cond:
+            self._quit = True
+            self._cond.notify_all()
+        self._stopping.set()
+        self._save_requested.set()
+        for thread in (self._thread, self._writer):
+            if thread:
+                thread.join(timeout)
+        self.flush()
+
+    def _save(self) -> None:
+        """ Mark the pending updates as changed, they are written by the writer thread. Requires the condition. """
+        prom_outbox_depth.set(len(self._pending))
+        if self.state_file:
+            self._unsaved = True
+            self._save_requested.set()
+
+    def _write_loop(self) -> None:
+        while not self._stopping.is_set():
+            self._save_requested.wait()
+            self._save_requested.clear()
+            self._stopping.wait(self.save_delay)
+            self.flush()
+
+    def flush(self) -> None:
+        """ Write the pending updates to the state file right away if they changed. """
+        if not self.state_file:
+            return
+        with self._save_lock:
+            with self._cond:
+                if not self._unsaved:
+                    return
+                self._unsaved = False
+                state = {update.record: {"ip": update.ip, "enqueued_at": update.enqueued_at} for update in self._pending.values()}
+            try:
+                self.state_file.save(state)
+            except OSError as err:
+                logging.error("Could not save outbox to %s: %s", self.state_file.path, err)
+                with self._cond:
+                    self._unsaved = True
+
+    def _restore(self) -> None:
+        if not self.state_file:
+            return
+
+        try:
+            state = self.state_file.load()
+            for record, entry in state.items():
+                self._pending[record] = PendingUpdate(record, entry["ip"], entry["enqueued_at"])
+        except OSError as err:
+            logging.warning("Could not read outbox from %s: %s", self.state_file.path, err)
+        except (ValueError, KeyError, AttributeError, TypeError) as err:
+            logging.error("Ignoring corrupt outbox state: %s", err)
+        prom_outbox_depth.set(len(self._pending))
@@ -1,32 +1,215 @@
 import logging
+import os
+import tempfile
+import threading
+import time
+
+FAMILY_LABELS = {4: "ipv4", 6: "ipv6"}
 
 class Persistence:
-    def write(self, new_ip: str) -> None:
+    def write(self, new_ip: str, family: int = 4) -> None:
         pass
 
-    def read(self) -> str:
+    def read(self, family: int = 4) -> str:
         return None
 
     def get_plugin_name(self) -> str:
         return "Dummy"
 
+def write_atomic(path, content) -> None:
+    """ Write to a temporary file first and rename it, so a crash never leaves a half-written file. """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 class FilePersistence(Persistence):
+    """
+    Saves the IP to a file. As long as only IPv4 is used the file contains just the address,
+    otherwise it contains one line per address family, e.g. 'ipv6 2001:db8::1'.
+    """
     def __init__(self, path):
         if not path:
             raise ValueError("no path supplied")
 
         self.file_path = path
 
-    def write(self, new_ip: str) -> None:
+    def _parse(self, content) -> dict:
+        addresses = dict()
+        labels = {label: family for family, label in FAMILY_LABELS.items()}
+        for line in content.splitlines():
+            label, _, value = line.strip().partition(" ")
+            if label not in labels:
+                # file written before address families were supported
+                return {4: content.replace("\n", "").strip()}
+            addresses[labels[label]] = value.strip()
+        return addresses
+
+    def write(self, new_ip: str, family: int = 4) -> None:
         if not new_ip:
             return
 
-        with open(self.file_path, "w") as f:
-            f.write(new_ip)
+        addresses = dict()
+        if family != 4 or os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, "r") as f:
+                    addresses = self._parse(f.read())
+            except FileNotFoundError:
+                pass
+        addresses[family] = new_ip
+
+        if set(addresses) == {4}:
+            write_atomic(self.file_path, new_ip)
+        else:
+            write_atomic(self.file_path, "".join(f"{FAMILY_LABELS[family]} {ip}\n" for family, ip in sorted(addresses.items())))
 
-    def read(self) -> str:
+    def read(self, family: int = 4) -> str:
         with open(self.file_path, "r") as f:
-            return f.read().replace("\n", "").strip()
-    
+            return self._parse(f.read()).get(family)
+
+    def get_plugin_name(self) -> str:
+        return "Filesystem"
+
+class SqliteStore:
+    """
+    SQLite database (WAL mode) holding the current IP of many records and an append-only
+    history of all changes. All writes are atomic, batches are written in a single transaction.
+    """
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS state (
+            record TEXT NOT NULL,
+            family INTEGER NOT NULL DEFAULT 4,
+            ip TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (record, family)
+        );
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record TEXT NOT NULL,
+            family INTEGER NOT NULL DEFAULT 4,
+            ip TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_record ON history (record, changed_at);
+    """
+
+    COMPACTION_INTERVAL = 3600
+
+    def __init__(self, path, retention=None, clock=time.time):
+        if not path:
+            raise ValueError("no path supplied")
+        if retention is not None and retention <= 0:
+            raise ValueError("retention must be positive")
+
+        self.path = path
+        self.retention = retention
+        self._clock = clock
+        self._next_compaction = 0
+        self._lock = threading.Lock()
+        # only deployments with a database need sqlite
+        import sqlite3
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+        self._maybe_compact()
+
+    def write_many(self, updates: dict, family: int = 4) -> None:
+        """ Set the IPs of many records at once. Only actual changes are added to the history. """
+        if not updates:
+            return
+
+        now = self._clock()
+        rows = [(record, ip, now, family) for record, ip in updates.items() if ip]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO history (record, ip, changed_at, family) SELECT ?1, ?2, ?3, ?4 "
+                    "WHERE NOT EXISTS (SELECT 1 FROM state WHERE record = ?1 AND family = ?4 AND ip = ?2)", rows)
+                self._conn.executemany("INSERT OR REPLACE INTO state (record, ip, updated_at, family) VALUES (?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._maybe_compact()
+
+    def write(self, record, new_ip, family: int = 4) -> None:
+        self.write_many({record: new_ip}, family)
+
+    def read(self, record, family: int = 4) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT ip FROM state WHERE record = ? AND family = ?", (record, family)).fetchone()
+        return row[0] if row else None
+
+    def read_all(self, family: int = 4) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT record, ip FROM state WHERE family = ?", (family,)).fetchall())
+
+    def history(self, record, limit=100, family: int = 4) -> list:
+        """ Returns the latest changes of the record as (ip, timestamp) tuples, newest first. """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ip, changed_at FROM history WHERE record = ? AND family = ? ORDER BY id DESC LIMIT ?", (record, family, limit)).fetchall()
+
+    def _maybe_compact(self) -> None:
+        if self.retention is None or self._clock() < self._next_compaction:
+            return
+        self._next_compaction = self._clock() + self.COMPACTION_INTERVAL
+        self.compact()
+
+    def compact(self, max_age=None, keep_last=1) -> int:
+        """
+        Delete history entries older than `max_age` seconds (defaults to the retention), always
+        keeping the `keep_last` newest entries per record. Returns the amount of deleted entries.
+        """
+        if max_age is None:
+            max_age = self.retention
+        if max_age is None:
+            return 0
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM history WHERE changed_at < ? AND id NOT IN ("
+                "SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY record, family ORDER BY id DESC) AS n FROM history) WHERE n <= ?)",
+                (self._clock() - max_age, keep_last))
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        deleted = cursor.rowcount
+        logging.debug("Compacted %d history entries", deleted)
+        return deleted
+
+    def for_record(self, record) -> "SqlitePersistence":
+        return SqlitePersistence(self, record)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class SqlitePersistence(Persistence):
+    """ Persistence of a single record backed by a shared SqliteStore. """
+    def __init__(self, store, record):
+        if not store:
+            raise ValueError("no store supplied")
+        if not record:
+            raise ValueError("no record supplied")
+
+        self.store = store
+        self.record = record
+
+    def write(self, new_ip: str, family: int = 4) -> None:
+        if not new_ip:
+            return
+        self.store.write(self.record, new_ip, family)
+
+    def read(self, family: int = 4) -> str:
+        return self.store.read(self.record, family)
+
     def get_plugin_name(self) -> str:
-        return "Filesystem"
\ No newline at end of file
+        return "SQLite"
@@ -0,0 +1,235 @@
+import functools
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from prometheus_client import Counter
+
+prom_profiles_written = Counter('dnsclient_profiles_written_total', 'Amount of written profiling reports', ['kind'])
+
+DEFAULT_CYCLES = 10
+DEFAULT_FRAMES = 25
+DEFAULT_TOP = 30
+
+
+class Profiler:
+    """
+    On-demand diagnostics of the running daemon, written to `output_dir`.
+
+    SIGUSR1 profiles the next `cycles` check cycles with cProfile, sending it again stops
+    early. Threads started during a profiled cycle, e.g. the ones querying providers
+    concurrently or sending updates of many records, are profiled as well. Long-lived
+    background threads such as the ones of the outbox are not. Only one cycle is profiled at
+    a time, cycles of other records running meanwhile are skipped. SIGUSR2 starts tracing
+    memory allocations, sending it again writes the top allocations and their growth since
+    tracing started and stops tracing. The signal handlers only set flags, stopping and
+    writing reports is done right away by a thread of the profiler instead of waiting for the
+    next cycle. Until a signal is received, nothing is profiled or traced and cProfile and
+    tracemalloc are not even imported.
+    """
+    def __init__(self, output_dir, cycles=DEFAULT_CYCLES, frames=DEFAULT_FRAMES, top=DEFAULT_TOP, clock=time.time):
+        if not output_dir:
+            raise ValueError("output_dir not specified")
+        if cycles < 1:
+            raise ValueError("cycles must be at least 1")
+        if frames < 1 or top < 1:
+            raise ValueError("frames and top must be at least 1")
+
+        self.output_dir = output_dir
+        self.cycles = cycles
+        self.frames = frames
+        self.top = top
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        # only flags are set from signal handlers, profiling is started by the cycles, everything else by the thread
+        self._cpu_requested = False
+        self._memory_requested = False
+        self._requested = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._remaining = 0
+        self._profile = None
+        self._thread_profiles = list()
+        self._profiling = False
+        self._profiled_cycles = 0
+        self._baseline = None
+        self._seq = 0
+
+    def install(self) -> None:
+        """ Start the thread and register the signal handlers, must be called from the main thread. """
+        self.start()
+        signal.signal(signal.SIGUSR1, self.request_cpu_profile)
+        signal.signal(signal.SIGUSR2, self.request_memory_trace)
+        logging.info("Profiling enabled, send SIGUSR1 (cpu) or SIGUSR2 (memory) to pid %d, reports are written to %s", os.getpid(), self.output_dir)
+
+    def start(self) -> None:
+        """ Start the thread handling the requests that do not need a check cycle. """
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None) -> None:
+        """ Handle the pending requests and stop the thread. """
+        self._stopping = True
+        self._requested.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            self._requested.wait()
+            self._requested.clear()
+            with self._lock:
+                if self._memory_requested:
+                    self._memory_requested = False
+                    self._toggle_memory_trace()
+                if self._cpu_requested and self._remaining:
+                    # stop right away, unless a cycle is being profiled, then the cycle writes the report once done
+                    self._cpu_requested = False
+                    logging.info("Stopping cpu profile")
+                    self._remaining = 0
+                    if not self._profiling:
+                        self._write_cpu_profile()
+            if self._stopping:
+                return
+
+    def _path(self, kind, suffix) -> str:
+        self._seq += 1
+        timestamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(self._clock()))
+        return os.path.join(self.output_dir, f"{kind}-{os.getpid()}-{timestamp}-{self._seq}{suffix}")
+
+    def request_cpu_profile(self, *_) -> None:
+        """ Profile the next cycles or, if profiling already, stop right away. """
+        self._cpu_requested = True
+        self._requested.set()
+        logging.info("Received request to start or stop the cpu profile")
+
+    def request_memory_trace(self, *_) -> None:
+        """ Start tracing allocations or, if tracing already, write a report and stop. """
+        self._memory_requested = True
+        self._requested.set()
+        logging.info("Received request to start or stop tracing memory allocations")
+
+    def profiled(self, check):
+        """ Wrap a check cycle, it is only profiled if requested. """
+        @functools.wraps(check)
+        def wrapper(*args, **kwargs):
+            if not self._cpu_requested and not self._remaining:
+                return check(*args, **kwargs)
+            return self._profile_cycle(check, args, kwargs)
+        return wrapper
+
+    def _profile_cycle(self, check, args, kwargs):
+        profile = None
+        with self._lock:
+            if self._cpu_requested:
+                self._cpu_requested = False
+                if self._remaining:
+                    logging.info("Stopping cpu profile")
+                    self._remaining = 0
+                else:
+                    import cProfile
+                    logging.info("Profiling the next %d check cycles", self.cycles)
+                    self._profile = cProfile.Profile()
+                    self._thread_profiles = list()
+                    self._profiled_cycles = 0
+                    self._remaining = self.cycles
+
+            if self._remaining and not self._profiling:
+                self._profiling = True
+                profile = self._profile
+            elif not self._remaining and not self._profiling and self._profile:
+                self._write_cpu_profile()
+
+        if profile is None:
+            return check(*args, **kwargs)
+
+        threading.setprofile(self._profile_thread)
+        profile.enable()
+        try:
+            return check(*args, **kwargs)
+        finally:
+            profile.disable()
+            threading.setprofile(None)
+            with self._lock:
+                self._profiling = False
+                self._profiled_cycles += 1
+                self._remaining = max(0, self._remaining - 1)
+                if not self._remaining:
+                    self._write_cpu_profile()
+
+    def _profile_thread(self, frame, event, arg):
+        """ Installed by threading.setprofile, runs once in every thread started during a profiled cycle. """
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # newer Pythons only allow a single profiler, which covers all threads already
+            sys.setprofile(None)
+            return
+        self._thread_profiles.append(profile)
+
+    def _write_cpu_profile(self) -> None:
+        """ Requires the lock. """
+        import io
+        import pstats
+
+        profile, self._profile = self._profile, None
+        thread_profiles, self._thread_profiles = self._thread_profiles, list()
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = self._path("cpu", ".prof")
+            report = io.StringIO()
+            stats = pstats.Stats(profile, stream=report)
+            for thread_profile in thread_profiles:
+                stats.add(thread_profile)
+            stats.dump_stats(path)
+            stats.sort_stats("cumulative").print_stats(self.top)
+            with open(path[:-len(".prof")] + ".txt", "w") as f:
+                f.write(f"{self._profiled_cycles} check cycles, {len(thread_profiles)} threads\n")
+                f.write(report.getvalue())
+        except (OSError, TypeError) as err:
+            logging.error("Could not write cpu profile to %s: %s", self.output_dir, err)
+            return
+        prom_profiles_written.labels("cpu").inc()
+        logging.info("Wrote cpu profile of %d check cycles to %s", self._profiled_cycles, path)
+
+    def _toggle_memory_trace(self) -> None:
+        """ Start tracing allocations or write a report of them and stop tracing. Requires the lock. """
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._baseline = self._snapshot()
+            logging.info("Started tracing memory allocations")
+            return
+
+        snapshot = self._snapshot()
+        baseline, self._baseline = self._baseline, None
+        tracemalloc.stop()
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = self._path("memory", ".snapshot")
+            snapshot.dump(path)
+            with open(path[:-len(".snapshot")] + ".txt", "w") as f:
+                f.write(f"Top {self.top} allocations\n")
+                for stat in snapshot.statistics("lineno")[:self.top]:
+                    f.write(f"{stat}\n")
+                f.write(f"\nTop {self.top} differences since tracing started\n")
+                for stat in snapshot.compare_to(baseline, "lineno")[:self.top]:
+                    f.write(f"{stat}\n")
+        except OSError as err:
+            logging.error("Could not write memory report to %s: %s", self.output_dir, err)
+            return
+        prom_profiles_written.labels("memory").inc()
+        logging.info("Stopped tracing memory allocations, wrote report to %s", path)
+
+    @staticmethod
+    def _snapshot():
+        import tracemalloc
+        # leave out the allocations of tracemalloc itself
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
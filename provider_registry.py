@@ -0,0 +1,170 @@
+import json
+import logging
+import re
+
+import transport
+
+TYPE_HTTP = "http"
+TYPE_DNS = "dns"
+
+DEFAULT_HTTP_TIMEOUT = 5
+DEFAULT_DNS_TIMEOUT = 2
+
+DEFAULT_PROVIDERS = [
+    {"name": "ipify_org", "url": "https://api.ipify.org"},
+    {"name": "ident_me", "url": "https://v4.ident.me/"},
+    {"name": "whatismyipaddress_com", "url": "http://ipv4bot.whatismyipaddress.com/"},
+    {"name": "ip_sb", "url": "https://api-ipv4.ip.sb/ip"},
+    {"name": "myip_io", "url": "https://api4.my-ip.io/ip"},
+]
+
+DEFAULT_DNS_PROVIDERS = [
+    {"name": "opendns_com", "type": TYPE_DNS, "qname": "myip.opendns.com", "server": "208.67.222.222"},
+    {"name": "akamai_net", "type": TYPE_DNS, "qname": "whoami.akamai.net", "server": "193.108.88.1"},
+    {"name": "google_com", "type": TYPE_DNS, "qname": "o-o.myaddr.l.google.com", "qtype": "TXT", "server": "216.239.32.10"},
+    {"name": "cloudflare_com", "type": TYPE_DNS, "qname": "whoami.cloudflare", "qtype": "TXT", "qclass": "CH", "server": "1.1.1.1"},
+]
+
+DEFAULT_IPV6_PROVIDERS = [
+    {"name": "ipify_org_v6", "url": "https://api6.ipify.org", "family": 6},
+    {"name": "ident_me_v6", "url": "https://v6.ident.me/", "family": 6},
+    {"name": "ip_sb_v6", "url": "https://api-ipv6.ip.sb/ip", "family": 6},
+    {"name": "myip_io_v6", "url": "https://api6.my-ip.io/ip", "family": 6},
+]
+
+DEFAULT_DNS_IPV6_PROVIDERS = [
+    {"name": "opendns_com_v6", "type": TYPE_DNS, "qname": "myip.opendns.com", "qtype": "AAAA", "server": "2620:119:35::35", "family": 6},
+    {"name": "google_com_v6", "type": TYPE_DNS, "qname": "o-o.myaddr.l.google.com", "qtype": "TXT", "server": "2001:4860:4802:32::a", "family": 6},
+]
+
+
+class HttpProvider:
+    """
+    IP provider answering via HTTP. The body is read up to `max_bytes`, the address is taken
+    from the first match of `regex` (its first group if it has one), from the value at the
+    dotted `json_path` or from the whole body.
+    """
+    def __init__(self, name, url, method="GET", family=4, regex=None, json_path=None, weight=1.0, timeout=DEFAULT_HTTP_TIMEOUT, max_bytes=transport.DEFAULT_MAX_BYTES):
+        if not name:
+            raise ValueError("provider name not specified")
+        if not url:
+            raise ValueError(f"url not specified for provider {name}")
+        if family not in (4, 6):
+            raise ValueError(f"family must be 4 or 6 for provider {name}")
+        if regex and json_path:
+            raise ValueError(f"only one of regex and json_path may be set for provider {name}")
+        if weight <= 0 or timeout <= 0 or max_bytes <= 0:
+            raise ValueError(f"weight, timeout and max_bytes must be positive for provider {name}")
+
+        self.name = name
+        self.url = url
+        self.method = method.upper()
+        self.family = family
+        self.regex = re.compile(regex) if regex else None
+        self.json_path = json_path.split(".") if json_path else None
+        self.weight = weight
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+
+    def extract(self, body) -> str:
+        """ Returns the address contained in the body or an empty string. """
+        if self.regex:
+            match = self.regex.search(body)
+            if not match:
+                return ""
+            return match.group(1) if self.regex.groups else match.group(0)
+
+        if self.json_path:
+            try:
+                value = json.loads(body)
+                for key in self.json_path:
+                    value = value[int(key)] if isinstance(value, list) else value[key]
+            except (ValueError, KeyError, IndexError, TypeError):
+                return ""
+            return value if isinstance(value, str) else ""
+
+        return body
+
+    def __call__(self):
+        body, status_code = transport.fetch(self.url, timeout=self.timeout, method=self.method, max_bytes=self.max_bytes)
+        return self.extract(body), status_code
+
+
+class DnsProvider:
+    """ IP provider answering a single DNS query, e.g. myip.opendns.com. """
+    def __init__(self, name, qname, server, qtype="A", qclass="IN", port=53, family=4, weight=1.0, timeout=DEFAULT_DNS_TIMEOUT):
+        if not name:
+            raise ValueError("provider name not specified")
+        if not qname or not server:
+            raise ValueError(f"qname and server must be specified for provider {name}")
+        if family not in (4, 6):
+            raise ValueError(f"family must be 4 or 6 for provider {name}")
+        if qtype not in ("A", "AAAA", "TXT") or qclass not in ("IN", "CH"):
+            raise ValueError(f"unsupported query type {qtype} {qclass} for provider {name}")
+        if weight <= 0 or timeout <= 0:
+            raise ValueError(f"weight and timeout must be positive for provider {name}")
+
+        self.name = name
+        self.qname = qname
+        self.server = server
+        self.qtype = qtype
+        self.qclass = qclass
+        self.port = port
+        self.family = family
+        self.weight = weight
+        self.timeout = timeout
+
+    def __call__(self):
+        # only deployments using DNS providers need the wire format client
+        import dns_wire
+        qtype = getattr(dns_wire, f"QTYPE_{self.qtype}")
+        qclass = getattr(dns_wire, f"QCLASS_{self.qclass}")
+        return dns_wire.query_first(self.qname, qtype, self.server, port=self.port, qclass=qclass, timeout=self.timeout), 200
+
+
+def build_provider(entry):
+    """ Create a provider from its declaration. Unknown keys are rejected to catch typos. """
+    entry = dict(entry)
+    kind = entry.pop("type", TYPE_HTTP)
+    try:
+        if kind == TYPE_HTTP:
+            return HttpProvider(**entry)
+        if kind == TYPE_DNS:
+            return DnsProvider(**entry)
+    except TypeError as err:
+        raise ValueError(f"invalid declaration of provider {entry.get('name')}: {err}")
+    raise ValueError(f"unknown type '{kind}' of provider {entry.get('name')}")
+
+
+def load_providers(path) -> list:
+    """
+    Read the providers from a JSON file:
+    {"providers": [{"name": "ipify_org", "url": "https://api.ipify.org", "weight": 2}]}
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+
+    providers = [build_provider(entry) for entry in config.get("providers", [])]
+    if not providers:
+        raise ValueError(f"No providers defined in {path}")
+
+    names = [provider.name for provider in providers]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate providers in {path}: {', '.join(sorted(duplicates))}")
+    return providers
+
+
+def default_providers(use_dns_providers=False, family=4) -> list:
+    if family == 6:
+        entries = DEFAULT_IPV6_PROVIDERS + (DEFAULT_DNS_IPV6_PROVIDERS if use_dns_providers else [])
+    else:
+        entries = DEFAULT_PROVIDERS + (DEFAULT_DNS_PROVIDERS if use_dns_providers else [])
+    return [build_provider(entry) for entry in entries]
+
+
+def as_ip_providers(providers, family=4) -> list:
+    """ Returns the (name, callable) pairs of the providers of the address family. """
+    selected = [(provider.name, provider) for provider in providers if provider.family == family]
+    logging.info("Using %d of %d providers for IPv%d", len(selected), len(providers), family)
+    return selected
@@ -0,0 +1,145 @@
+import logging
+import random
+import threading
+import time
+
+from prometheus_client import Gauge
+
+prom_provider_expected = Gauge('dnsclient_provider_expected_seconds', 'Expected time in seconds until the provider yields a valid answer', ['site'])
+prom_provider_latency = Gauge('dnsclient_provider_latency_ewma_seconds', 'Exponentially weighted moving average of the provider latency', ['site'])
+prom_provider_success = Gauge('dnsclient_provider_success_ratio', 'Exponentially weighted moving average of successful queries', ['site'])
+prom_provider_breaker = Gauge('dnsclient_provider_breaker_state', 'State of the circuit breaker of the provider (0=closed, 1=half-open, 2=open)', ['site'])
+
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+# lower bound of the success ratio, keeps the expected time finite for providers that never answered
+_MIN_SUCCESS_RATIO = 0.05
+
+
+class ProviderStats:
+    def __init__(self, latency, success_ratio):
+        self.latency = latency
+        self.success_ratio = success_ratio
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_started = None
+
+    def expected_seconds(self) -> float:
+        """ Expected time to a valid answer, assuming failed attempts cost about as much as successful ones. """
+        return self.latency / max(self.success_ratio, _MIN_SUCCESS_RATIO)
+
+
+class ProviderScheduler:
+    """
+    Orders IP providers by their expected time to a valid answer. Providers failing
+    `failure_threshold` times in a row are benched for `cooldown` seconds and then probed
+    once (half-open) before being used again.
+    """
+    def __init__(self, alpha=0.3, failure_threshold=3, cooldown=300, initial_latency=1.0, clock=time.monotonic, rand=random.random):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.failure_threshold = failure_threshold
+
+        if cooldown < 0:
+            raise ValueError("cooldown must not be negative")
+        self.cooldown = cooldown
+
+        self.initial_latency = initial_latency
+        self._clock = clock
+        self._rand = rand
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def _get_stats(self, site) -> ProviderStats:
+        stats = self._stats.get(site)
+        if stats is None:
+            stats = ProviderStats(self.initial_latency, 1.0)
+            self._stats[site] = stats
+        return stats
+
+    def stats(self, site) -> ProviderStats:
+        with self._lock:
+            return self._get_stats(site)
+
+    def order(self, providers) -> list:
+        """
+        Returns the providers to query in order. Healthy providers are sorted by a weighted
+        random draw favoring short expected times, so load still spreads across all of them.
+        Half-open providers due for a probe come first, benched providers are left out unless
+        no other provider is available.
+        """
+        now = self._clock()
+        probes, healthy, benched = list(), list(), list()
+        with self._lock:
+            for provider in providers:
+                stats = self._get_stats(provider[0])
+                if stats.state == OPEN and now - stats.opened_at >= self.cooldown:
+                    logging.debug("Probing provider '%s' after cooldown", provider[0])
+                    self._set_state(provider[0], stats, HALF_OPEN)
+
+                if stats.state == HALF_OPEN:
+                    if stats.probe_started is None or now - stats.probe_started >= self.cooldown:
+                        stats.probe_started = now
+                        probes.append(provider)
+                    else:
+                        benched.append((stats.opened_at, provider))
+                elif stats.state == OPEN:
+                    benched.append((stats.opened_at, provider))
+                else:
+                    # weighted random sampling (Efraimidis-Spirakis), weight = configured weight / expected time
+                    key = self._rand() ** (stats.expected_seconds() / getattr(provider[1], "weight", 1.0))
+                    healthy.append((key, provider))
+
+        healthy.sort(key=lambda entry: entry[0], reverse=True)
+        ordered = probes + [provider for _, provider in healthy]
+        if not ordered:
+            logging.warning("All providers are benched, trying them anyway")
+            benched.sort(key=lambda entry: entry[0])
+            ordered = [provider for _, provider in benched]
+        return ordered
+
+    def record_success(self, site, latency) -> None:
+        with self._lock:
+            stats = self._get_stats(site)
+            self._update(stats, latency, 1.0)
+            stats.consecutive_failures = 0
+            if stats.state != CLOSED:
+                logging.info("Provider '%s' recovered", site)
+                self._set_state(site, stats, CLOSED)
+            self._export(site, stats)
+
+    def record_failure(self, site, latency, error=None) -> None:
+        with self._lock:
+            stats = self._get_stats(site)
+            self._update(stats, latency, 0.0)
+            stats.consecutive_failures += 1
+            stats.last_error = error
+            if stats.state == HALF_OPEN or (stats.state == CLOSED and stats.consecutive_failures >= self.failure_threshold):
+                logging.warning("Benching provider '%s' for %ds after %d failures: %s", site, self.cooldown, stats.consecutive_failures, error)
+                stats.opened_at = self._clock()
+                self._set_state(site, stats, OPEN)
+            self._export(site, stats)
+
+    def _update(self, stats, latency, success) -> None:
+        stats.latency += self.alpha * (latency - stats.latency)
+        stats.success_ratio += self.alpha * (success - stats.success_ratio)
+
+    @staticmethod
+    def _set_state(site, stats, state) -> None:
+        stats.state = state
+        stats.probe_started = None
+        prom_provider_breaker.labels(site).set(state)
+
+    @staticmethod
+    def _export(site, stats) -> None:
+        prom_provider_latency.labels(site).set(stats.latency)
+        prom_provider_success.labels(site).set(stats.success_ratio)
+        prom_provider_expected.labels(site).set(stats.expected_seconds())
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+from prometheus_client import Counter
+
+prom_ratelimit_skipped = Counter('dnsclient_ratelimit_skipped_total', 'Amount of provider queries skipped by the rate limiter', ['site', 'reason'])
+prom_ratelimit_throttled = Counter('dnsclient_ratelimit_throttled_total', 'Amount of throttling responses received from providers', ['site', 'status_code'])
+
+REASON_THROTTLED = "throttled"
+REASON_PROVIDER_LIMIT = "provider_limit"
+REASON_GLOBAL_LIMIT = "global_limit"
+
+
+class TokenBucket:
+    """ Allows `rate` operations per second on average with bursts of up to `burst` operations. """
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> bool:
+        self._refill()
+        return self._tokens >= 1
+
+    def take(self) -> None:
+        self._tokens -= 1
+
+
+class RateLimiter:
+    """
+    Limits queries per provider and across all providers of the process using token buckets,
+    and benches providers that answered with 429 or 503 for as long as their Retry-After asks.
+    A single instance is meant to be shared by all detectors of the process.
+    """
+    def __init__(self, provider_rate=None, provider_burst=1, global_rate=None, global_burst=1, default_penalty=60.0, max_penalty=3600.0, clock=time.monotonic):
+        if default_penalty < 0 or max_penalty < default_penalty:
+            raise ValueError("invalid penalties")
+
+        self.provider_rate = provider_rate
+        self.provider_burst = provider_burst
+        self.default_penalty = default_penalty
+        self.max_penalty = max_penalty
+        self._clock = clock
+        self._buckets = dict()
+        self._global = TokenBucket(global_rate, global_burst, clock) if global_rate else None
+        self._throttled_until = dict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, site):
+        if not self.provider_rate:
+            return None
+        if site not in self._buckets:
+            self._buckets[site] = TokenBucket(self.provider_rate, self.provider_burst, self._clock)
+        return self._buckets[site]
+
+    def acquire(self, site) -> bool:
+        """ Returns True if the provider may be queried now and accounts for the query. """
+        with self._lock:
+            reason = None
+            bucket = self._bucket(site)
+            if self._throttled_until.get(site, 0) > self._clock():
+                reason = REASON_THROTTLED
+            elif bucket and not bucket.available():
+                reason = REASON_PROVIDER_LIMIT
+            elif self._global and not self._global.available():
+                reason = REASON_GLOBAL_LIMIT
+            else:
+                if bucket:
+                    bucket.take()
+                if self._global:
+                    self._global.take()
+                return True
+
+        logging.debug("Skipping provider '%s': %s", site, reason)
+        prom_ratelimit_skipped.labels(site, reason).inc()
+        return False
+
+    def throttle(self, site, status_code, retry_after=None) -> None:
+        """ Bench the provider after it asked us to slow down. """
+        penalty = self.default_penalty if retry_after is None else min(self.max_penalty, retry_after)
+        logging.warning("Provider '%s' throttled us with status code %d, pausing it for %.0fs", site, status_code, penalty)
+        prom_ratelimit_throttled.labels(site, status_code).inc()
+        with self._lock:
+            self._throttled_until[site] = max(self._throttled_until.get(site, 0), self._clock() + penalty)
+
+    def throttled_until(self, site) -> float:
+        with self._lock:
+            return self._throttled_until.get(site, 0)
@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+
+from prometheus_client import Counter
+
+import dns_wire
+
+prom_record_lookups = Counter('dnsclient_record_lookups_total', 'Amount of lookups of the published record', ['result'])
+
+DEFAULT_MAX_TTL = 300
+
+
+class PublishedRecord:
+    """
+    Looks up the A values, or AAAA values for `family` 6, currently published for a record
+    at a nameserver. Answers are cached for the TTL of the record, capped at `max_ttl`
+    seconds. Missing records are cached as empty.
+    """
+    def __init__(self, dns_record, nameserver, port=53, max_ttl=DEFAULT_MAX_TTL, timeout=2.0, clock=time.monotonic, family=4):
+        if not dns_record:
+            raise ValueError("dns_record not specified")
+        self.dns_record = dns_record
+
+        if not nameserver:
+            raise ValueError("nameserver not specified")
+        self.nameserver = nameserver
+        self.port = port
+
+        if family not in (4, 6):
+            raise ValueError("family must be 4 or 6")
+        self.qtype = dns_wire.QTYPE_AAAA if family == 6 else dns_wire.QTYPE_A
+
+        self.max_ttl = max_ttl
+        self.timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._cached = None
+        self._expires = 0
+
+    def _resolve(self):
+        try:
+            answers = dns_wire.query(self.dns_record, self.qtype, self.nameserver, port=self.port, timeout=self.timeout)
+        except dns_wire.DnsError as err:
+            if err.rcode != dns_wire.RCODE_NXDOMAIN:
+                raise
+            answers = list()
+
+        ttl = min([answer.ttl for answer in answers] + [self.max_ttl])
+        return {answer.data for answer in answers}, ttl
+
+    def lookup(self) -> set:
+        """ Return the published addresses of the record. """
+        with self._lock:
+            now = self._clock()
+            if self._cached is not None and now < self._expires:
+                prom_record_lookups.labels("cached").inc()
+                return self._cached
+
+            try:
+                addresses, ttl = self._resolve()
+            except Exception:
+                prom_record_lookups.labels("error").inc()
+                raise
+
+            prom_record_lookups.labels("resolved").inc()
+            logging.debug("Record '%s' is published as %s (ttl %ds)", self.dns_record, addresses, ttl)
+            self._cached, self._expires = addresses, now + ttl
+            return addresses
+
+    def matches(self, ip) -> bool:
+        """ True if the record is published with exactly this address. """
+        return self.lookup() == {ip}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cached = None
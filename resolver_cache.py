@@ -0,0 +1,176 @@
+import ipaddress
+import logging
+import socket
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+prom_resolver_cache_requests = Counter('dnsclient_resolver_cache_requests_total', 'Amount of hostname resolutions through the cache', ['result'])
+prom_resolver_cache_refreshes = Counter('dnsclient_resolver_cache_refreshes_total', 'Amount of background refreshes of cached hostnames', ['status'])
+prom_resolver_cache_entries = Gauge('dnsclient_resolver_cache_entries', 'Amount of hostnames in the resolution cache')
+
+RESULT_HIT = "hit"
+RESULT_MISS = "miss"
+RESULT_STALE = "stale"
+RESULT_NEGATIVE = "negative"
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_TTL = 3600
+DEFAULT_NEGATIVE_TTL = 30
+DEFAULT_MAX_STALE = 3600
+
+
+def system_resolver(host, family=socket.AF_UNSPEC):
+    """ Resolve the host using getaddrinfo. It does not tell the TTL, so the default TTL applies. """
+    addresses = list()
+    for entry in socket.getaddrinfo(host, None, family, socket.SOCK_STREAM):
+        if entry[4][0] not in addresses:
+            addresses.append(entry[4][0])
+    return addresses, None
+
+
+class WireResolver:
+    """ Resolve A and AAAA records by querying a nameserver directly, respecting their TTL. """
+    def __init__(self, server, port=53, timeout=2.0):
+        if not server:
+            raise ValueError("server not specified")
+
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+
+    def __call__(self, host, family=socket.AF_UNSPEC):
+        # only deployments using a dedicated nameserver need the wire format client
+        import dns_wire
+        qtypes = {socket.AF_INET: [dns_wire.QTYPE_A], socket.AF_INET6: [dns_wire.QTYPE_AAAA]}.get(family, [dns_wire.QTYPE_A, dns_wire.QTYPE_AAAA])
+
+        answers, error = list(), None
+        for qtype in qtypes:
+            try:
+                answers += dns_wire.query(host, qtype, self.server, port=self.port, timeout=self.timeout)
+            except dns_wire.DnsError as err:
+                error = err
+        if not answers:
+            if error is not None and error.rcode != dns_wire.RCODE_NXDOMAIN:
+                raise socket.gaierror(socket.EAI_AGAIN, f"could not resolve {host}: {error}")
+            raise socket.gaierror(socket.EAI_NONAME, f"no addresses for {host}")
+        return [answer.data for answer in answers], min(answer.ttl for answer in answers)
+
+
+class _Entry:
+    def __init__(self, addresses, ttl, expires, stale_until=None, error=None):
+        self.addresses = addresses
+        self.ttl = ttl
+        self.expires = expires
+        # set once the addresses expired and are only served because resolving failed
+        self.stale_until = stale_until
+        self.error = error
+
+
+class ResolverCache:
+    """
+    Caches resolved hostnames for their TTL, or `default_ttl` seconds if the resolver does not
+    tell, capped at `max_ttl`. Entries are refreshed in the background once `refresh_ahead` of
+    their TTL is left. If resolving fails, expired addresses are served for up to `max_stale`
+    seconds, hostnames that could not be resolved at all are cached for `negative_ttl` seconds.
+    """
+    def __init__(self, resolver=system_resolver, default_ttl=DEFAULT_TTL, max_ttl=DEFAULT_MAX_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, max_stale=DEFAULT_MAX_STALE, refresh_ahead=0.1, clock=time.monotonic):
+        if default_ttl <= 0 or max_ttl < default_ttl:
+            raise ValueError("invalid ttl")
+        if negative_ttl < 0 or max_stale < 0:
+            raise ValueError("negative_ttl and max_stale must not be negative")
+        if not 0 <= refresh_ahead < 1:
+            raise ValueError("refresh_ahead must be between 0 and 1")
+
+        self.resolver = resolver
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.refresh_ahead = refresh_ahead
+        self._clock = clock
+        self._entries = dict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _ttl(self, ttl) -> float:
+        if ttl is None:
+            return self.default_ttl
+        return min(self.max_ttl, max(1, ttl))
+
+    def _resolve(self, key) -> _Entry:
+        """ Resolve the host and cache the result. Raises socket.gaierror if it failed. """
+        host, family = key
+        try:
+            addresses, ttl = self.resolver(host, family)
+            if not addresses:
+                raise socket.gaierror(socket.EAI_NONAME, f"no addresses for {host}")
+        except OSError as err:
+            with self._lock:
+                now = self._clock()
+                entry = self._entries.get(key)
+                if entry and entry.error is None:
+                    stale_until = entry.stale_until or entry.expires + self.max_stale
+                    if now < stale_until:
+                        logging.warning("Could not resolve %s, using stale addresses %s: %s", host, entry.addresses, err)
+                        prom_resolver_cache_requests.labels(RESULT_STALE).inc()
+                        # do not ask the failing resolver again for every connection
+                        entry = _Entry(entry.addresses, entry.ttl, min(stale_until, now + max(1, self.negative_ttl)), stale_until)
+                        self._entries[key] = entry
+                        return entry
+                self._entries[key] = _Entry(None, self.negative_ttl, now + self.negative_ttl, error=err)
+                prom_resolver_cache_entries.set(len(self._entries))
+            raise
+
+        ttl = self._ttl(ttl)
+        entry = _Entry(addresses, ttl, self._clock() + ttl)
+        with self._lock:
+            self._entries[key] = entry
+            prom_resolver_cache_entries.set(len(self._entries))
+        logging.debug("Resolved %s to %s (ttl %ds)", host, addresses, ttl)
+        return entry
+
+    def _refresh(self, key) -> None:
+        try:
+            self._resolve(key)
+            prom_resolver_cache_refreshes.labels("success").inc()
+        except OSError as err:
+            logging.debug("Background refresh of %s failed: %s", key[0], err)
+            prom_resolver_cache_refreshes.labels("error").inc()
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _maybe_refresh(self, key, entry, now) -> None:
+        """ Start a background refresh if the entry is about to expire. Requires the lock. """
+        if key in self._refreshing or entry.expires - now > entry.ttl * self.refresh_ahead:
+            return
+        self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key,), name="resolver-refresh", daemon=True).start()
+
+    def resolve(self, host, family=socket.AF_UNSPEC) -> list:
+        """ Returns the addresses of the host. Raises socket.gaierror if it can not be resolved. """
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+
+        key = (host.lower(), family)
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry and now < entry.expires:
+                if entry.error is not None:
+                    prom_resolver_cache_requests.labels(RESULT_NEGATIVE).inc()
+                    raise socket.gaierror(socket.EAI_NONAME, f"{host} could not be resolved: {entry.error}")
+                if entry.stale_until is not None:
+                    prom_resolver_cache_requests.labels(RESULT_STALE).inc()
+                    return entry.addresses
+                prom_resolver_cache_requests.labels(RESULT_HIT).inc()
+                self._maybe_refresh(key, entry, now)
+                return entry.addresses
+
+        prom_resolver_cache_requests.labels(RESULT_MISS).inc()
+        return self._resolve(key).addresses
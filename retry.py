@@ -0,0 +1,50 @@
+import functools
+import random
+import time
+
+import deadline
+import instrumentation
+
+
+def on_exception(exception, max_tries, operation):
+    """
+    Retry the decorated function with exponential backoff like backoff.on_exception. The first
+    attempt runs without importing backoff, which pulls in asyncio, so one-shot runs only pay
+    for it once something actually failed. Retries and waits never run past the deadline of
+    the current check. The amount of tries is recorded per operation.
+    """
+    handler = instrumentation.backoff_handler(operation)
+
+    def decorator(func):
+        retrying = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal retrying
+            try:
+                result = func(*args, **kwargs)
+            except exception:
+                if max_tries <= 1 or deadline.expired():
+                    handler({"tries": 1})
+                    raise
+            else:
+                handler({"tries": 1})
+                return result
+
+            if retrying is None:
+                import backoff
+
+                def shifted(details):
+                    # the first attempt already failed before backoff took over
+                    handler({"tries": details["tries"] + 1})
+
+                def jitter(value):
+                    return deadline.clamp(backoff.full_jitter(value))
+
+                # continue the exponential sequence where the first wait leaves off
+                retrying = backoff.on_exception(backoff.expo, exception, max_tries=max_tries - 1, factor=2, jitter=jitter,
+                                                giveup=lambda err: deadline.expired(), on_success=shifted, on_giveup=shifted)(func)
+            time.sleep(deadline.clamp(random.uniform(0, 1)))
+            return retrying(*args, **kwargs)
+        return wrapper
+    return decorator
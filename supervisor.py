@@ -0,0 +1,247 @@
+import glob
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+from prometheus_client import multiprocess
+
+import multi_record
+
+# registered on the registry of the supervisor only, see metrics_registry()
+prom_worker_restarts = Counter('dnsclient_supervisor_worker_restarts_total', 'Amount of restarts of crashed worker processes', ['worker'], registry=None)
+prom_worker_records = Gauge('dnsclient_supervisor_worker_records', 'Amount of records assigned to a worker process', ['worker'], registry=None)
+prom_rebalances = Counter('dnsclient_supervisor_rebalances_total', 'Amount of times the records were reassigned to the workers', registry=None)
+
+DEFAULT_RESTART_DELAY = 1.0
+DEFAULT_MAX_RESTART_DELAY = 60.0
+DEFAULT_RELOAD_INTERVAL = 30.0
+# a metrics file starts with the amount of used bytes, shorter files are still being created
+_MIN_METRICS_FILE_SIZE = 8
+
+
+class _WorkerMetricsCollector(multiprocess.MultiProcessCollector):
+    """ MultiProcessCollector that tolerates metrics files being created or removed while collecting. """
+    def collect(self):
+        for attempt in range(3):
+            files = list()
+            for path in glob.glob(os.path.join(self._path, "*.db")):
+                try:
+                    if os.path.getsize(path) >= _MIN_METRICS_FILE_SIZE:
+                        files.append(path)
+                except FileNotFoundError:
+                    pass
+            try:
+                return self.merge(files, accumulate=True)
+            except FileNotFoundError:
+                # the files of a reaped worker were removed after listing them
+                if attempt == 2:
+                    raise
+
+
+def _remove_worker_metrics(pid, path) -> None:
+    """
+    Remove the gauges of a dead worker. Gauges in the default multiprocess mode keep a series
+    per pid, they would be exported forever and pile up with every restart otherwise.
+    """
+    multiprocess.mark_process_dead(pid, path)
+    try:
+        os.remove(os.path.join(path, f"gauge_all_{pid}.db"))
+    except FileNotFoundError:
+        pass
+
+
+def _score(key, worker) -> int:
+    return int.from_bytes(hashlib.sha1(f"{worker}:{key}".encode("utf-8")).digest()[:8], "big")
+
+
+def assign(records, workers) -> list:
+    """
+    Spread the records across the workers using rendezvous hashing. A record always ends up
+    at the same worker, adding or removing records never moves other records and changing
+    the amount of workers only moves the records of the added or removed workers.
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    shards = [list() for _ in range(workers)]
+    for record in records:
+        shards[max(range(workers), key=lambda worker: _score(record.record, worker))].append(record)
+    return shards
+
+
+class Supervisor:
+    """
+    Runs the records of a records file in `workers` processes, each calling
+    `target(index, records, *args)` with its share of the records. Crashed workers are
+    restarted with exponential backoff. The records file is checked for changes every
+    `reload_interval` seconds, only workers whose share changed are restarted. Workers
+    export their metrics to `metrics_dir`, the supervisor combines them.
+    """
+    def __init__(self, target, records_file, workers, args=(), metrics_dir=None, restart_delay=DEFAULT_RESTART_DELAY, max_restart_delay=DEFAULT_MAX_RESTART_DELAY,
+                 stable_after=60.0, reload_interval=DEFAULT_RELOAD_INTERVAL, clock=time.monotonic):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if restart_delay <= 0 or max_restart_delay < restart_delay:
+            raise ValueError("invalid restart delays")
+
+        self.target = target
+        self.records_file = records_file
+        self.workers = workers
+        self.args = args
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self.reload_interval = reload_interval
+        self._clock = clock
+
+        self._owns_metrics_dir = metrics_dir is None
+        self.metrics_dir = metrics_dir or tempfile.mkdtemp(prefix="dnsclient-metrics-")
+        # fresh interpreters, so the workers pick up the multiprocess mode of the prometheus client
+        self._context = multiprocessing.get_context("spawn")
+        self._shards = [list() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._started_at = [0.0] * workers
+        self._failures = [0] * workers
+        self._restart_at = [None] * workers
+        self._records_version = None
+        self._next_reload = 0.0
+        self._environ = None
+        self._quit = False
+
+    def _read_version(self):
+        stat = os.stat(self.records_file)
+        return stat.st_mtime, stat.st_size
+
+    def _spawn(self, index) -> None:
+        self._restart_at[index] = None
+        shard = self._shards[index]
+        prom_worker_records.labels(str(index)).set(len(shard))
+        if not shard:
+            logging.info("Worker %d has no records, not starting it", index)
+            self._processes[index] = None
+            return
+
+        process = self._context.Process(target=self.target, args=(index, shard) + tuple(self.args), name=f"dnsclient-worker-{index}", daemon=True)
+        process.start()
+        logging.info("Started worker %d (pid %d) with %d records", index, process.pid, len(shard))
+        self._processes[index] = process
+        self._started_at[index] = self._clock()
+
+    def _stop_worker(self, index, timeout=5.0) -> None:
+        process = self._processes[index]
+        self._processes[index] = None
+        if process is None:
+            return
+
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning("Worker %d (pid %d) did not stop, killing it", index, process.pid)
+                process.kill()
+                process.join()
+        _remove_worker_metrics(process.pid, self.metrics_dir)
+
+    def start(self) -> None:
+        # inherited by the spawned workers only, this process keeps its in-memory metrics
+        self._environ = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = self.metrics_dir
+        self._records_version = self._read_version()
+        self._next_reload = self._clock() + self.reload_interval
+        self._shards = assign(multi_record.load_records(self.records_file), self.workers)
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def pids(self) -> list:
+        return [process.pid if process else None for process in self._processes]
+
+    def rebalance(self, records) -> int:
+        """ Reassign the records and restart the workers whose share changed. Returns their amount. """
+        shards = assign(records, self.workers)
+        changed = [index for index in range(self.workers) if [vars(r) for r in shards[index]] != [vars(r) for r in self._shards[index]]]
+        if not changed:
+            return 0
+
+        logging.info("Rebalancing %d records, restarting workers %s", len(records), changed)
+        prom_rebalances.inc()
+        self._shards = shards
+        for index in changed:
+            self._stop_worker(index)
+            self._failures[index] = 0
+            self._spawn(index)
+        return len(changed)
+
+    def _reload(self) -> None:
+        self._next_reload = self._clock() + self.reload_interval
+        try:
+            version = self._read_version()
+            if version == self._records_version:
+                return
+            records = multi_record.load_records(self.records_file)
+        except (OSError, ValueError) as err:
+            logging.error("Could not reload records from %s, keeping the current ones: %s", self.records_file, err)
+            return
+
+        self._records_version = version
+        self.rebalance(records)
+
+    def poll(self) -> None:
+        """ Restart crashed workers once their backoff passed and pick up changes of the records. """
+        now = self._clock()
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                self._processes[index] = None
+                _remove_worker_metrics(process.pid, self.metrics_dir)
+                if now - self._started_at[index] >= self.stable_after:
+                    self._failures[index] = 0
+                delay = min(self.max_restart_delay, self.restart_delay * 2 ** self._failures[index])
+                self._failures[index] += 1
+                self._restart_at[index] = now + delay
+                logging.error("Worker %d (pid %d) exited with code %s, restarting it in %.1fs", index, process.pid, process.exitcode, delay)
+
+            if self._restart_at[index] is not None and now >= self._restart_at[index]:
+                prom_worker_restarts.labels(str(index)).inc()
+                self._spawn(index)
+
+        if now >= self._next_reload:
+            self._reload()
+
+    def metrics_registry(self) -> CollectorRegistry:
+        """ Registry combining the metrics of all workers with the ones of the supervisor. """
+        registry = CollectorRegistry()
+        _WorkerMetricsCollector(registry, path=self.metrics_dir)
+        for metric in (prom_worker_restarts, prom_worker_records, prom_rebalances):
+            registry.register(metric)
+        return registry
+
+    def quit(self, *_) -> None:
+        self._quit = True
+
+    def run(self, poll_interval=1.0) -> None:
+        """ Supervise the workers until SIGTERM or SIGINT is received. """
+        signal.signal(signal.SIGTERM, self.quit)
+        self.start()
+        try:
+            while not self._quit:
+                time.sleep(poll_interval)
+                self.poll()
+        except KeyboardInterrupt:
+            logging.info("Received signal, quitting")
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        for index in range(self.workers):
+            self._stop_worker(index)
+        if self._environ is None:
+            os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        else:
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = self._environ
+        if self._owns_metrics_dir:
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
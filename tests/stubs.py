@@ -0,0 +1,229 @@
+import socket
+import struct
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Clock:
+    """ Clock that only moves when a test advances `now`. """
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Dummy:
+    """ Notifier that ignores all updates. """
+    def notify_update(self, fetched_ip, retry=True, fetched_ipv6=None):
+        pass
+
+
+class RecordingNotifier:
+    """ Notifier that records the sent IPs. It fails the first `fail` updates and waits for `block` if given. """
+    def __init__(self, dns_record="my.record.tld.", fail=0, block=None):
+        self.dns_record = dns_record
+        self.fail = fail
+        self.block = block
+        self.sent = list()
+
+    def notify_update(self, fetched_ip, retry=True, fetched_ipv6=None):
+        if self.block:
+            self.block.wait(5)
+        if self.fail > 0:
+            self.fail -= 1
+            raise ValueError("server down")
+        self.sent.append(fetched_ip)
+
+
+class StubResponse:
+    """
+    A canned response of the stub server, optionally delayed to simulate latency or sent chunked
+    without a length. Chunks can be delayed as well to drip-feed the body.
+    """
+    def __init__(self, body="", status=200, delay=0.0, headers=None, chunked=False, chunk_size=1024, chunk_delay=0.0):
+        self.body = body
+        self.status = status
+        self.delay = delay
+        self.headers = headers or dict()
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+
+
+class StubServer:
+    """
+    Small in-process HTTP server that answers with canned responses, similar to a
+    mountebank imposter. Responses of a route are cycled through on every request. A route
+    can also be a callable that builds the response from the request body.
+    """
+    def __init__(self, host="127.0.0.1"):
+        self._host = host
+        self._routes = dict()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.requests = list()
+
+    def add_route(self, path, responses, method="GET"):
+        if isinstance(responses, StubResponse) or callable(responses):
+            responses = [responses]
+        self._routes[(method, path)] = list(responses)
+
+    def url(self, path="/"):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def _next_response(self, method, path, body):
+        with self._lock:
+            self.requests.append((method, path, body))
+            responses = self._routes.get((method, path))
+            if not responses:
+                return StubResponse("not found", 404)
+            response = responses.pop(0)
+            responses.append(response)
+        if callable(response):
+            return response(body)
+        return response
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                response = stub._next_response(self.command, self.path, body)
+                if response.delay:
+                    time.sleep(response.delay)
+
+                payload = response.body.encode("utf-8") if isinstance(response.body, str) else response.body
+                try:
+                    self.send_response(response.status)
+                    for key, value in response.headers.items():
+                        self.send_header(key, value)
+                    if response.chunked:
+                        self.send_header("Transfer-Encoding", "chunked")
+                        self.end_headers()
+                        for offset in range(0, len(payload), response.chunk_size):
+                            chunk = payload[offset:offset + response.chunk_size]
+                            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                            self.wfile.flush()
+                            time.sleep(response.chunk_delay)
+                        self.wfile.write(b"0\r\n\r\n")
+                    else:
+                        self.send_header("Content-Length", str(len(payload)))
+                        self.end_headers()
+                        self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self._host, 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubDnsServer:
+    """
+    In-process UDP DNS server answering from a static table of
+    (qname, qtype) -> [(rdata, ttl)]. Unknown names are answered with NXDOMAIN.
+    """
+    def __init__(self, host="127.0.0.1"):
+        self._host = host
+        self.answers = dict()
+        self.delay = 0.0
+        self.rcode = None
+        self.wrong_id = False
+        self.queries = list()
+        self._sock = None
+        self._thread = None
+
+    def add(self, qname, qtype, rdata, ttl=60):
+        self.answers.setdefault((qname.rstrip(".").lower(), qtype), []).append((rdata, ttl))
+
+    @property
+    def address(self):
+        return self._sock.getsockname()[:2]
+
+    def _respond(self, data):
+        query_id, flags = struct.unpack_from("!HH", data)
+        offset, labels = 12, list()
+        while data[offset]:
+            labels.append(data[offset + 1:offset + 1 + data[offset]].decode())
+            offset += 1 + data[offset]
+        offset += 1
+        qtype, qclass = struct.unpack_from("!HH", data, offset)
+        question = data[12:offset + 4]
+        qname = ".".join(labels).lower()
+        self.queries.append((qname, qtype))
+
+        answers = self.answers.get((qname, qtype))
+        rcode = self.rcode if self.rcode is not None else (0 if answers else 3)
+        if self.wrong_id:
+            query_id ^= 0xFFFF
+
+        packet = struct.pack("!HHHHHH", query_id, 0x8000 | (flags & 0x0100) | 0x0080 | rcode, 1, len(answers or []), 0, 0) + question
+        for rdata, ttl in answers or []:
+            if isinstance(rdata, str):
+                rdata = bytes([len(rdata)]) + rdata.encode()
+            packet += struct.pack("!HHHIH", 0xC00C, qtype, qclass, ttl, len(rdata)) + rdata
+        return packet
+
+    def _serve(self, sock):
+        while True:
+            try:
+                data, addr = sock.recvfrom(4096)
+            except OSError:
+                return
+            if self.delay:
+                time.sleep(self.delay)
+            try:
+                sock.sendto(self._respond(data), addr)
+            except OSError:
+                return
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self._host, 0))
+        self._thread = threading.Thread(target=self._serve, args=(self._sock,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+
+from unittest import TestCase
+
+from async_updater import AsyncUpdateDetector, AsyncUpdateNotifier, run, serve_metrics
+
+
+class SlowNotifier:
+    def __init__(self, delay=0.0, fail=0):
+        self.delay = delay
+        self.fail = fail
+        self.sent = list()
+        self.attempts = 0
+
+    def notify_update(self, fetched_ip, retry=True):
+        self.attempts += 1
+        time.sleep(self.delay)
+        if self.fail > 0:
+            self.fail -= 1
+            raise ValueError("server down")
+        self.sent.append(fetched_ip)
+
+
+class Provider:
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.answers[min(self.calls, len(self.answers)) - 1], 200
+
+
+class TestAsyncUpdater(TestCase):
+    def test_slow_notifier_does_not_delay_detection(self):
+        notifier = SlowNotifier(delay=0.5)
+        provider = Provider("1.1.1.1")
+        detector = AsyncUpdateDetector(update_notifier=notifier, ip_providers=[("test", provider)], interval=0.02)
+
+        async def scenario():
+            task = asyncio.ensure_future(detector.run())
+            await asyncio.sleep(0.3)
+            checks = provider.calls
+            await asyncio.sleep(0.5)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return checks
+
+        checks = asyncio.run(scenario())
+        self.assertGreater(checks, 5)
+        self.assertEqual(["1.1.1.1"], notifier.sent)
+
+    def test_newer_ip_supersedes_running_notification(self):
+        notifier = SlowNotifier(fail=100)
+        provider = Provider("1.1.1.1", "1.1.1.2")
+        async_notifier = AsyncUpdateNotifier(notifier, base_delay=10)
+        detector = AsyncUpdateDetector(update_notifier=async_notifier, ip_providers=[("test", provider)])
+
+        async def scenario():
+            await detector.perform_check_async()
+            await asyncio.sleep(0.05)
+            first = detector._notification
+            notifier.fail = 0
+            await detector.perform_check_async()
+            await detector._notification
+            return first
+
+        first = asyncio.run(scenario())
+        self.assertTrue(first.cancelled())
+        self.assertEqual(["1.1.1.2"], notifier.sent)
+
+    def test_superseded_update_does_not_arrive_last(self):
+        notifier = SlowNotifier()
+        send = notifier.notify_update
+
+        def slow_for_first_ip(fetched_ip, retry=True):
+            if fetched_ip == "1.1.1.1":
+                time.sleep(0.3)
+            send(fetched_ip, retry)
+
+        notifier.notify_update = slow_for_first_ip
+        provider = Provider("1.1.1.1", "1.1.1.2", "1.1.1.3")
+        detector = AsyncUpdateDetector(update_notifier=notifier, ip_providers=[("test", provider)])
+
+        async def scenario():
+            for _ in range(3):
+                await detector.perform_check_async()
+                await asyncio.sleep(0.05)
+            await detector._notification
+
+        asyncio.run(scenario())
+        self.assertEqual(["1.1.1.1", "1.1.1.3"], notifier.sent)
+
+    def test_cancel_mid_retry_is_prompt(self):
+        notifier = AsyncUpdateNotifier(SlowNotifier(fail=100), base_delay=30)
+
+        async def scenario():
+            task = asyncio.ensure_future(notifier.notify_update("1.1.1.1"))
+            await asyncio.sleep(0.05)
+            start = time.monotonic()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return time.monotonic() - start
+
+        self.assertLess(asyncio.run(scenario()), 0.1)
+
+    def test_failed_notification_retried_next_cycle(self):
+        notifier = AsyncUpdateNotifier(SlowNotifier(fail=1), max_tries=1)
+        detector = AsyncUpdateDetector(update_notifier=notifier, ip_providers=[("test", Provider("1.1.1.1"))])
+
+        async def scenario():
+            await detector.perform_check_async()
+            await detector._notification
+            await detector.perform_check_async()
+            await detector._notification
+
+        asyncio.run(scenario())
+        self.assertEqual(["1.1.1.1"], notifier.notifier.sent)
+
+    def test_sigterm_shuts_down(self):
+        detector = AsyncUpdateDetector(update_notifier=SlowNotifier(), ip_providers=[("test", Provider("1.1.1.1"))], interval=60)
+        threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM)).start()
+
+        start = time.monotonic()
+        asyncio.run(run([detector]))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_metrics_endpoint(self):
+        async def scenario():
+            server = await serve_metrics(0, host="127.0.0.1")
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        response = asyncio.run(scenario())
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"dnsclient_", response)
@@ -0,0 +1,94 @@
+import json
+
+from unittest import TestCase
+
+from batch_notifier import BatchNotifier
+from multi_record import FanoutError, RecordFanout
+from notifier import UpdateNotifier
+from tests.stubs import StubResponse, StubServer
+
+
+def batch_results(rejected=()):
+    def respond(body):
+        updates = json.loads(body)["updates"]
+        results = [{"dns_record": u["dns_record"], "status_code": 403 if u["dns_record"] in rejected else 200} for u in updates]
+        return StubResponse(json.dumps({"results": results}), headers={"Content-Type": "application/json"})
+    return respond
+
+
+class TestBatchNotifier(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/single", StubResponse("okay"), method="POST")
+        self.batcher = BatchNotifier(batch_size=10, flush_interval=0.01)
+        self.addCleanup(self.batcher.quit)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def notifiers(self, path, count):
+        return [UpdateNotifier(f"batch{i}.example.com.", self.server.url(path), "secret") for i in range(count)]
+
+    def batches(self):
+        return [json.loads(body)["updates"] for method, path, body in self.server.requests if path.endswith("/batch")]
+
+    def test_updates_are_batched(self):
+        self.server.add_route("/update/batch", batch_results(), method="POST")
+        errors = self.batcher.notify_many(self.notifiers("/update", 25), "1.1.1.1")
+        self.assertEqual([None] * 25, errors)
+        self.assertEqual([10, 10, 5], sorted((len(batch) for batch in self.batches()), reverse=True))
+
+        update = self.batches()[0][0]
+        expected = UpdateNotifier.hash_request(update["dns_record"], "1.1.1.1", "secret")
+        self.assertEqual(expected, update["validation_hash"])
+
+    def test_partial_failure(self):
+        self.server.add_route("/update/batch", batch_results(rejected={"batch1.example.com."}), method="POST")
+        errors = self.batcher.notify_many(self.notifiers("/update", 3), "1.1.1.1")
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], ValueError)
+        self.assertIsNone(errors[2])
+
+    def test_missing_results_fail(self):
+        self.server.add_route("/update/batch", StubResponse(json.dumps({"results": [{"status_code": 200}]})), method="POST")
+        errors = self.batcher.notify_many(self.notifiers("/update", 2), "1.1.1.1")
+        self.assertIsNone(errors[0])
+        self.assertIsNotNone(errors[1])
+
+    def test_fallback_to_single_updates(self):
+        errors = self.batcher.notify_many(self.notifiers("/single", 3), "1.1.1.1", retry=False)
+        self.assertEqual([None] * 3, errors)
+        paths = [path for method, path, body in self.server.requests]
+        self.assertEqual(1, paths.count("/single/batch"))
+        self.assertEqual(3, paths.count("/single"))
+
+        # the server is not probed again for batching until the probe interval passed
+        self.batcher.notify_many(self.notifiers("/single", 3), "1.1.1.2", retry=False)
+        self.assertEqual(1, [path for method, path, body in self.server.requests].count("/single/batch"))
+
+    def test_rejected_combined_updates_are_sent_separately(self):
+        def respond(body):
+            updates = json.loads(body)["updates"]
+            return StubResponse(json.dumps({"results": [{"status_code": 400 if "public_ipv6" in u else 200} for u in updates]}))
+        self.server.add_route("/update/batch", respond, method="POST")
+        self.server.add_route("/update", StubResponse("okay"), method="POST")
+        notifiers = [UpdateNotifier(f"batch{i}.example.com.", self.server.url("/update"), "secret", combined=True) for i in range(2)]
+
+        errors = self.batcher.notify_many(notifiers, "1.1.1.1", fetched_ipv6="2001:db8::1")
+        self.assertEqual([None, None], errors)
+        self.assertFalse(any(notifier.combined for notifier in notifiers))
+        singles = [json.loads(body) for method, path, body in self.server.requests if path == "/update"]
+        self.assertEqual(4, len(singles))
+        self.assertFalse(any("public_ipv6" in payload for payload in singles))
+
+    def test_fanout_uses_batcher(self):
+        self.server.add_route("/update/batch", batch_results(rejected={"batch0.example.com."}), method="POST")
+        fanout = RecordFanout(self.notifiers("/update", 3), batcher=self.batcher)
+        with self.assertRaises(FanoutError) as ctx:
+            fanout.notify_update("1.1.1.1")
+        self.assertEqual(["batch0.example.com."], ctx.exception.failed)
+        self.assertEqual("1.1.1.1", fanout.last_ip("batch1.example.com."))
+
+        self.server.add_route("/update/batch", batch_results(), method="POST")
+        fanout.notify_update("1.1.1.1")
+        self.assertEqual(["batch0.example.com."], [update["dns_record"] for update in self.batches()[-1]])
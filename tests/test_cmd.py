@@ -2,7 +2,7 @@ import argparse
 import logging
 
 from unittest import TestCase
-from dns_client import get_ipv4_providers, print_config
+from dns_client import default_outbox_file, get_ipv4_providers, print_config
 
 class TestCmd(TestCase):
     @staticmethod
@@ -12,7 +12,35 @@ class TestCmd(TestCase):
         logging.getLogger("urllib3").setLevel(logging.WARNING)
 
     def test_print_config(self):
-        args = argparse.Namespace(url="http://host.tld", record="bla.blub.bla.", interval=60, promport=8181)
+        args = argparse.Namespace(url="http://host.tld", records_file=None, nameserver=None, watch=None, record="bla.blub.bla.", interval=60, max_interval=0, jitter=0.1, promport=8181, asyncio=False, fanout=1, hedge_delay=0.0, quorum=1, outbox=False, outbox_file=None, breaker_threshold=3, breaker_cooldown=300, pool_connections=10, pool_maxsize=2, pool_idle_timeout=120.0, db=None, history_retention=0, latency_buckets=(0.1, 1.0), low_cardinality_metrics=False, once=False, textfile=None, ip_cache=None, provider_rate=0, global_rate=0, check_budget=30, provider_timeout=10, provider_timeouts={}, providers_file=None, ipv6=False, combined_updates=False, dns_cache=False, profile_dir=None)
         providers = get_ipv4_providers()
         print_config(args, providers)
-        
\ No newline at end of file
+
+
+    def test_default_outbox_file(self):
+        def args(**kwargs):
+            defaults = dict(db=None, file=None, state_dir=None, records_file=None)
+            defaults.update(kwargs)
+            return argparse.Namespace(**defaults)
+
+        self.assertEqual("/var/lib/dnsclient/ip.outbox", default_outbox_file(args(file="/var/lib/dnsclient/ip")))
+        self.assertEqual("/var/lib/dnsclient/state.db.outbox", default_outbox_file(args(db="/var/lib/dnsclient/state.db", file="/var/lib/dnsclient/ip")))
+        self.assertEqual("/var/lib/dnsclient/outbox", default_outbox_file(args(records_file="records.json", state_dir="/var/lib/dnsclient")))
+        # without persisted state a restart detects the IP as changed and sends it again
+        self.assertIsNone(default_outbox_file(args()))
+
+    def test_defaults_of_deferred_modules(self):
+        import batch_notifier
+        import dns_client
+        import multi_record
+        import profiling
+        import record_lookup
+        import resolver_cache
+
+        self.assertEqual(multi_record.DEFAULT_CONCURRENCY, dns_client.DEFAULT_CONCURRENCY)
+        self.assertEqual(batch_notifier.DEFAULT_FLUSH_INTERVAL, dns_client.DEFAULT_BATCH_FLUSH_INTERVAL)
+        self.assertEqual(record_lookup.DEFAULT_MAX_TTL, dns_client.DEFAULT_RECORD_MAX_TTL)
+        self.assertEqual(resolver_cache.DEFAULT_TTL, dns_client.DEFAULT_DNS_CACHE_TTL)
+        self.assertEqual(resolver_cache.DEFAULT_NEGATIVE_TTL, dns_client.DEFAULT_DNS_CACHE_NEGATIVE_TTL)
+        self.assertEqual(resolver_cache.DEFAULT_MAX_STALE, dns_client.DEFAULT_DNS_CACHE_MAX_STALE)
+        self.assertEqual(profiling.DEFAULT_CYCLES, dns_client.DEFAULT_PROFILE_CYCLES)
@@ -0,0 +1,112 @@
+import time
+
+from unittest import TestCase
+
+import deadline
+import requests
+import transport
+from dyndns_updater import UpdateDetector
+from provider_scheduler import ProviderScheduler
+from tests.stubs import Dummy, StubResponse, StubServer
+
+
+class Refused:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        raise requests.exceptions.ConnectionError("connection refused")
+
+
+class TestDeadline(TestCase):
+    def test_nested_budget_never_extends(self):
+        self.assertIsNone(deadline.remaining())
+        with deadline.budget(1):
+            with deadline.budget(10):
+                self.assertLessEqual(deadline.remaining(), 1)
+            with deadline.budget(0.5):
+                self.assertLessEqual(deadline.remaining(), 0.5)
+        self.assertIsNone(deadline.remaining())
+
+    def test_timeout_raises_when_expired(self):
+        self.assertEqual(5, deadline.timeout(5))
+        with deadline.budget(0.01):
+            time.sleep(0.02)
+            self.assertTrue(deadline.expired())
+            self.assertEqual(0, deadline.clamp(5))
+            with self.assertRaises(deadline.DeadlineExceeded):
+                deadline.timeout(5)
+
+
+class TestCheckBudget(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/hang", StubResponse("1.1.1.1", delay=3))
+        self.server.add_route("/ok", StubResponse("1.1.1.1"))
+        # every byte arrives well within the read timeout, the whole body does not
+        self.server.add_route("/drip", StubResponse("1.1.1.1", chunked=True, chunk_size=1, chunk_delay=0.2))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def provider(self, path):
+        url = self.server.url(path)
+        return path, lambda: transport.fetch(url, timeout=5)
+
+    def assertTakesLessThan(self, seconds, func):
+        start = time.monotonic()
+        result = func()
+        self.assertLess(time.monotonic() - start, seconds)
+        return result
+
+    def test_hanging_providers_bounded_by_budget(self):
+        providers = [self.provider("/hang") for _ in range(5)]
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=providers, budget=0.5)
+        self.assertIsNone(self.assertTakesLessThan(0.8, detector.get_external_ip))
+
+    def test_provider_timeout_moves_on(self):
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[self.provider("/hang"), self.provider("/ok")], budget=5, provider_timeout=0.3)
+        self.assertEqual("1.1.1.1", self.assertTakesLessThan(0.6, detector.get_external_ip))
+
+    def test_per_provider_timeouts(self):
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[self.provider("/hang"), self.provider("/ok")], budget=5,
+                                  provider_timeout=10, provider_timeouts={"/hang": 0.2})
+        self.assertEqual("1.1.1.1", self.assertTakesLessThan(0.5, detector.get_external_ip))
+
+    def test_race_bounded_by_budget(self):
+        providers = [self.provider("/hang") for _ in range(4)]
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=providers, fanout=2, hedge_delay=0.1, budget=0.5)
+        self.assertIsNone(self.assertTakesLessThan(0.8, detector.get_external_ip))
+
+    def test_quorum_bounded_by_budget(self):
+        providers = [self.provider("/hang"), self.provider("/ok"), self.provider("/hang")]
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=providers, fanout=3, quorum=2, budget=0.5)
+        self.assertIsNone(self.assertTakesLessThan(0.8, detector.get_external_ip))
+
+    def test_retries_stop_at_deadline(self):
+        refused = Refused()
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[("refused", refused)], budget=0.3)
+        self.assertIsNone(self.assertTakesLessThan(0.5, detector.get_external_ip))
+        self.assertLessEqual(refused.calls, 3)
+
+    def test_drip_fed_response_bounded_by_budget(self):
+        url = self.server.url("/drip")
+        start = time.monotonic()
+        with deadline.budget(0.5):
+            with self.assertRaises(deadline.DeadlineExceeded):
+                transport.fetch(url, timeout=5)
+        self.assertLess(time.monotonic() - start, 0.8)
+
+    def test_deadline_is_not_a_provider_failure(self):
+        url = self.server.url("/ok")
+
+        def late():
+            # the request would only start after the budget ran out
+            time.sleep(0.4)
+            return transport.fetch(url, timeout=5)
+
+        scheduler = ProviderScheduler()
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[("late", late)], budget=0.3, scheduler=scheduler)
+        self.assertIsNone(self.assertTakesLessThan(0.6, detector.get_external_ip))
+        self.assertEqual(0, scheduler.stats("late").consecutive_failures)
@@ -0,0 +1,59 @@
+import socket
+import time
+
+from unittest import TestCase
+
+import dns_wire
+from dyndns_updater import UpdateDetector
+from tests.stubs import Dummy, StubDnsServer
+
+
+class TestDnsWire(TestCase):
+    def setUp(self):
+        self.server = StubDnsServer().start()
+        self.server.add("myip.opendns.com", dns_wire.QTYPE_A, socket.inet_aton("1.2.3.4"), ttl=300)
+        self.server.add("o-o.myaddr.l.google.com", dns_wire.QTYPE_TXT, "5.6.7.8")
+        self.host, self.port = self.server.address
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_query_a(self):
+        answers = dns_wire.query("myip.opendns.com", dns_wire.QTYPE_A, self.host, port=self.port)
+        self.assertEqual(1, len(answers))
+        self.assertEqual("1.2.3.4", answers[0].data)
+        self.assertEqual(300, answers[0].ttl)
+
+    def test_query_txt(self):
+        self.assertEqual("5.6.7.8", dns_wire.query_first("o-o.myaddr.l.google.com", dns_wire.QTYPE_TXT, self.host, port=self.port))
+
+    def test_nxdomain(self):
+        with self.assertRaises(dns_wire.DnsError) as ctx:
+            dns_wire.query("unknown.example.com", dns_wire.QTYPE_A, self.host, port=self.port)
+        self.assertEqual(dns_wire.RCODE_NXDOMAIN, ctx.exception.rcode)
+
+    def test_mismatching_id_ignored(self):
+        self.server.wrong_id = True
+        start = time.monotonic()
+        with self.assertRaises(dns_wire.DnsError):
+            dns_wire.query("myip.opendns.com", dns_wire.QTYPE_A, self.host, port=self.port, timeout=0.2, attempts=1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_timeout(self):
+        self.server.delay = 1
+        start = time.monotonic()
+        with self.assertRaises(dns_wire.DnsError):
+            dns_wire.query("myip.opendns.com", dns_wire.QTYPE_A, self.host, port=self.port, timeout=0.2, attempts=2)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_parse_rejects_garbage(self):
+        query_id, _ = dns_wire.build_query("myip.opendns.com", dns_wire.QTYPE_A)
+        with self.assertRaises(dns_wire.DnsError):
+            dns_wire.parse_response(b"\x00\x01garbage", query_id, "myip.opendns.com", dns_wire.QTYPE_A)
+
+    def test_provider_contract(self):
+        def provider():
+            return dns_wire.query_first("myip.opendns.com", dns_wire.QTYPE_A, self.host, port=self.port, timeout=1), 200
+
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[("opendns", provider)])
+        self.assertEqual("1.2.3.4", detector.get_external_ip())
@@ -0,0 +1,190 @@
+import os
+import tempfile
+import time
+
+from unittest import TestCase
+
+from dyndns_updater import UpdateDetector
+from multi_record import RecordFanout
+from notifier import UpdateNotifier, UpdateRejected
+from persistence import FilePersistence, SqliteStore
+
+
+class Notifier:
+    def __init__(self, dns_record="a.example.com."):
+        self.dns_record = dns_record
+        self.sent = list()
+
+    def notify_update(self, fetched_ip, retry=True, fetched_ipv6=None):
+        self.sent.append((fetched_ip, fetched_ipv6))
+
+
+class PayloadNotifier(UpdateNotifier):
+    def __init__(self, combined):
+        super().__init__("a.example.com", "http://localhost", "secret", combined=combined)
+        self.payloads = list()
+
+    def _post_update(self, payload):
+        self.payloads.append(payload)
+
+
+class LegacyServerNotifier(PayloadNotifier):
+    """ Talks to a server that does not know combined updates. """
+    def __init__(self, status_code=400):
+        super().__init__(combined=True)
+        self.status_code = status_code
+
+    def _post_update(self, payload):
+        self.payloads.append(payload)
+        if "public_ipv6" in payload:
+            raise UpdateRejected(self.status_code)
+
+
+def provider(answer, delay=0.0):
+    def query():
+        time.sleep(delay)
+        return answer, 200
+    return query
+
+
+class TestIpv6Validation(TestCase):
+    def test_valid(self):
+        self.assertTrue(UpdateDetector.is_valid_ipv6("2001:db8::1"))
+        self.assertTrue(UpdateDetector.is_valid_ipv6("::ffff:1.2.3.4"))
+
+    def test_invalid(self):
+        self.assertFalse(UpdateDetector.is_valid_ipv6("1.2.3.4"))
+        self.assertFalse(UpdateDetector.is_valid_ipv6("<html>"))
+        self.assertFalse(UpdateDetector.is_valid_ipv6(":" * 100000))
+        self.assertFalse(UpdateDetector.is_valid_ipv6(None))
+
+    def test_normalize(self):
+        self.assertEqual("2001:db8::1", UpdateDetector.normalize_ip("2001:0DB8:0000:0000:0000:0000:0000:0001", 6))
+        self.assertIsNone(UpdateDetector.normalize_ip("1.2.3.4", 6))
+        self.assertIsNone(UpdateDetector.normalize_ip("2001:db8::1", 4))
+
+
+class TestDualStackDetector(TestCase):
+    def build(self, ipv4="1.1.1.1", ipv6="2001:db8::1", delay=0.0, persistence=None):
+        self.notifier = Notifier()
+        return UpdateDetector(
+            update_notifier=self.notifier,
+            ip_providers=[("v4", provider(ipv4, delay))],
+            ipv6_providers=[("v6", provider(ipv6, delay))],
+            persistence=persistence)
+
+    def test_families_are_detected_concurrently(self):
+        detector = self.build(delay=0.3)
+        start = time.monotonic()
+        self.assertEqual("1.1.1.1", detector.perform_check(None))
+        self.assertLess(time.monotonic() - start, 0.55)
+        self.assertEqual("2001:db8::1", detector.last_ipv6)
+        self.assertEqual([("1.1.1.1", "2001:db8::1")], self.notifier.sent)
+
+    def test_ipv6_change_alone_triggers_update(self):
+        detector = self.build()
+        detector.last_ipv6 = "2001:db8::2"
+        detector.perform_check("1.1.1.1")
+        self.assertEqual([("1.1.1.1", "2001:db8::1")], self.notifier.sent)
+
+        detector.perform_check("1.1.1.1")
+        self.assertEqual(1, len(self.notifier.sent))
+
+    def test_failed_family_keeps_last_address(self):
+        detector = self.build(ipv6="garbage")
+        detector.last_ipv6 = "2001:db8::2"
+        detector.perform_check(None)
+        self.assertEqual([("1.1.1.1", "2001:db8::2")], self.notifier.sent)
+        self.assertEqual("2001:db8::2", detector.last_ipv6)
+
+    def test_state_is_restored_per_family(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            persistence = FilePersistence(os.path.join(tmp, "ip"))
+            self.build(persistence=persistence).check_once()
+            self.assertEqual("1.1.1.1", persistence.read())
+            self.assertEqual("2001:db8::1", persistence.read(family=6))
+
+            detector = self.build(persistence=persistence)
+            detector.check_once()
+            self.assertEqual([], self.notifier.sent)
+
+
+class TestDualStackNotifier(TestCase):
+    def test_combined_request(self):
+        notifier = PayloadNotifier(combined=True)
+        notifier.notify_update("1.1.1.1", fetched_ipv6="2001:db8::1")
+        self.assertEqual(1, len(notifier.payloads))
+        self.assertEqual("1.1.1.1", notifier.payloads[0]["public_ip"])
+        self.assertEqual("2001:db8::1", notifier.payloads[0]["public_ipv6"])
+        expected = UpdateNotifier.hash_request("a.example.com.", "1.1.1.12001:db8::1", "secret")
+        self.assertEqual(expected, notifier.payloads[0]["validation_hash"])
+
+    def test_separate_requests(self):
+        notifier = PayloadNotifier(combined=False)
+        notifier.notify_update("1.1.1.1", fetched_ipv6="2001:db8::1")
+        self.assertEqual(["1.1.1.1", "2001:db8::1"], [payload["public_ip"] for payload in notifier.payloads])
+
+    def test_rejected_combined_request_falls_back(self):
+        notifier = LegacyServerNotifier()
+        notifier.notify_update("1.1.1.1", fetched_ipv6="2001:db8::1")
+        self.assertEqual("2001:db8::1", notifier.payloads[0]["public_ipv6"])
+        self.assertEqual(["1.1.1.1", "2001:db8::1"], [payload["public_ip"] for payload in notifier.payloads[1:]])
+        self.assertFalse(notifier.combined)
+
+        # the server is not asked for combined updates again
+        notifier.payloads.clear()
+        notifier.notify_update("1.1.1.2", fetched_ipv6="2001:db8::2")
+        self.assertEqual(["1.1.1.2", "2001:db8::2"], [payload["public_ip"] for payload in notifier.payloads])
+
+    def test_server_errors_do_not_fall_back(self):
+        notifier = LegacyServerNotifier(status_code=500)
+        with self.assertRaises(UpdateRejected):
+            notifier.notify_update("1.1.1.1", fetched_ipv6="2001:db8::1", retry=False)
+        self.assertTrue(notifier.combined)
+
+    def test_ipv4_only_request_is_unchanged(self):
+        notifier = PayloadNotifier(combined=True)
+        notifier.notify_update("1.1.1.1")
+        self.assertEqual({"validation_hash", "dns_record", "public_ip"}, set(notifier.payloads[0]))
+
+
+class TestDualStackPersistence(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_file_without_ipv6_stays_bare(self):
+        path = os.path.join(self.dir.name, "ip")
+        FilePersistence(path).write("1.1.1.1")
+        with open(path) as f:
+            self.assertEqual("1.1.1.1", f.read())
+
+    def test_file_with_both_families(self):
+        path = os.path.join(self.dir.name, "ip")
+        persistence = FilePersistence(path)
+        persistence.write("1.1.1.1")
+        persistence.write("2001:db8::1", family=6)
+        persistence.write("1.1.1.2")
+        self.assertEqual("1.1.1.2", persistence.read())
+        self.assertEqual("2001:db8::1", persistence.read(family=6))
+
+    def test_sqlite_families_are_separate(self):
+        store = SqliteStore(os.path.join(self.dir.name, "state.db"))
+        self.addCleanup(store.close)
+        store.write("a.example.com.", "1.1.1.1")
+        store.write("a.example.com.", "2001:db8::1", family=6)
+        self.assertEqual("1.1.1.1", store.read("a.example.com."))
+        self.assertEqual({"a.example.com.": "2001:db8::1"}, store.read_all(family=6))
+        self.assertEqual(1, len(store.history("a.example.com.", family=6)))
+
+    def test_fanout_tracks_families(self):
+        store = SqliteStore(os.path.join(self.dir.name, "state.db"))
+        self.addCleanup(store.close)
+        notifiers = [Notifier("a.example.com."), Notifier("b.example.com.")]
+        RecordFanout(notifiers, store=store).notify_update("1.1.1.1", fetched_ipv6="2001:db8::1")
+
+        fanout = RecordFanout(notifiers, store=store)
+        fanout.notify_update("1.1.1.1", fetched_ipv6="2001:db8::1")
+        self.assertEqual([("1.1.1.1", "2001:db8::1")], notifiers[0].sent)
+        fanout.notify_update("1.1.1.1", fetched_ipv6="2001:db8::2")
+        self.assertEqual(("1.1.1.1", "2001:db8::2"), notifiers[1].sent[-1])
@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+import requests
+from prometheus_client import REGISTRY
+
+import instrumentation
+from dyndns_updater import UpdateDetector
+from multi_record import RecordFanout
+from persistence import Persistence
+from tests.stubs import Dummy, RecordingNotifier
+
+
+class Flaky:
+    def __init__(self, failures):
+        self.failures = failures
+
+    def __call__(self):
+        if self.failures > 0:
+            self.failures -= 1
+            raise requests.exceptions.ConnectionError("connection refused")
+        return "1.1.1.1", 200
+
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or dict()) or 0
+
+
+class TestInstrumentation(TestCase):
+    def tearDown(self):
+        instrumentation.configure()
+
+    def test_check_phases_observed(self):
+        checks = sample("dnsclient_check_duration_seconds_count")
+        writes = sample("dnsclient_persistence_seconds_count", {"operation": "write", "backend_name": "Dummy"})
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[("phases", lambda: ("1.1.1.1", 200))], persistence=Persistence())
+
+        detector.perform_check(None)
+        self.assertEqual(checks + 1, sample("dnsclient_check_duration_seconds_count"))
+        self.assertEqual(1, sample("dnsclient_provider_request_seconds_count", {"site": "phases"}))
+        self.assertEqual(writes + 1, sample("dnsclient_persistence_seconds_count", {"operation": "write", "backend_name": "Dummy"}))
+
+    def test_backoff_tries_observed(self):
+        tries = sample("dnsclient_backoff_tries_sum", {"operation": instrumentation.OPERATION_PROVIDER})
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[("flaky", Flaky(1))])
+        self.assertEqual("1.1.1.1", detector.get_external_ip())
+        self.assertEqual(tries + 2, sample("dnsclient_backoff_tries_sum", {"operation": instrumentation.OPERATION_PROVIDER}))
+
+    def test_configurable_buckets(self):
+        instrumentation.configure(buckets=(0.5, 0.1))
+        instrumentation.observe_check(0.2)
+        self.assertEqual(0, sample("dnsclient_check_duration_seconds_bucket", {"le": "0.1"}))
+        self.assertEqual(1, sample("dnsclient_check_duration_seconds_bucket", {"le": "0.5"}))
+        self.assertIsNone(REGISTRY.get_sample_value("dnsclient_check_duration_seconds_bucket", {"le": "0.25"}))
+
+    def test_parse_buckets(self):
+        self.assertEqual((0.1, 1.0, 2.5), instrumentation.parse_buckets("2.5, 0.1,1"))
+        self.assertEqual(instrumentation.DEFAULT_BUCKETS, instrumentation.parse_buckets(None))
+        with self.assertRaises(ValueError):
+            instrumentation.parse_buckets("0.1,abc")
+        with self.assertRaises(ValueError):
+            instrumentation.parse_buckets("0,1")
+
+    def test_low_cardinality_aggregates_labels(self):
+        instrumentation.configure(detailed_labels=False)
+        before = sample("dnsclient_record_updates_total", {"record": instrumentation.AGGREGATED, "status": "success"})
+        RecordFanout([RecordingNotifier(f"record{i}.example.com.") for i in range(5)]).notify_update("1.1.1.1")
+        UpdateDetector(update_notifier=Dummy(), ip_providers=[("hidden", lambda: ("1.1.1.1", 200))]).get_external_ip()
+
+        self.assertEqual(before + 5, sample("dnsclient_record_updates_total", {"record": instrumentation.AGGREGATED, "status": "success"}))
+        self.assertEqual(0, sample("dnsclient_record_updates_total", {"record": "record0.example.com.", "status": "success"}))
+        self.assertEqual(1, sample("dnsclient_provider_request_seconds_count", {"site": instrumentation.AGGREGATED}))
+        self.assertEqual(0, sample("dnsclient_provider_request_seconds_count", {"site": "hidden"}))
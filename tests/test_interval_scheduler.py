@@ -0,0 +1,89 @@
+import random
+
+from unittest import TestCase
+
+from dyndns_updater import UpdateDetector
+from interval_scheduler import IntervalScheduler, prom_next_check_ts
+from tests.stubs import Clock, Dummy
+
+
+class SimulatedDetector(UpdateDetector):
+    """ Replaces sleeping with advancing the simulated clock. """
+    def __init__(self, clock, checks, **kwargs):
+        super().__init__(**kwargs)
+        self.clock = clock
+        self.checks = checks
+        self.delays = list()
+
+    def _wait(self, seconds):
+        self.delays.append(seconds)
+        self.clock.now += seconds
+        if len(self.delays) >= self.checks:
+            self.quit()
+        return "poll", None
+
+
+class TestIntervalScheduler(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_grows_while_stable(self):
+        scheduler = IntervalScheduler(60, 600, growth=2, clock=self.clock, rand=lambda: 1.0)
+        delays = [scheduler.next_delay() for _ in range(5)]
+        self.assertEqual([240, 480, 600, 600, 600], delays)
+
+    def test_tightens_after_change_and_failure(self):
+        scheduler = IntervalScheduler(60, 600, growth=2, clock=self.clock, rand=lambda: 1.0)
+        for _ in range(5):
+            scheduler.next_delay()
+        self.assertEqual(120, scheduler.next_delay(changed=True))
+        for _ in range(5):
+            scheduler.next_delay()
+        self.assertEqual(120, scheduler.next_delay(failed=True))
+
+    def test_bounds(self):
+        rand = random.Random(42)
+        scheduler = IntervalScheduler(60, 600, clock=self.clock, rand=rand.random)
+        for i in range(1000):
+            delay = scheduler.next_delay(changed=i % 7 == 0, failed=i % 11 == 0)
+            self.assertGreaterEqual(delay, 60)
+            self.assertLessEqual(delay, 600)
+
+    def test_next_check_exported(self):
+        scheduler = IntervalScheduler(60, 600, clock=self.clock, rand=lambda: 0.0)
+        self.assertEqual(60, scheduler.next_delay())
+        self.assertEqual(1060, prom_next_check_ts._value.get())
+
+    def test_jitter_breaks_lockstep(self):
+        rand = random.Random(1)
+        fleet = [IntervalScheduler(60, 600, clock=self.clock, rand=rand.random) for _ in range(1000)]
+        next_checks = set()
+        for scheduler in fleet:
+            elapsed = sum(scheduler.next_delay() for _ in range(3))
+            next_checks.add(int(elapsed))
+        self.assertGreater(len(next_checks), 500)
+
+    def test_fixed_interval_is_jittered(self):
+        rand = random.Random(1)
+        scheduler = IntervalScheduler(60, 60, jitter=0.1, clock=self.clock, rand=rand.random)
+        delays = [scheduler.next_delay(changed=i % 3 == 0) for i in range(1000)]
+        self.assertTrue(all(54 <= delay <= 60 for delay in delays))
+        self.assertGreater(len({int(delay * 10) for delay in delays}), 50)
+
+    def test_jitter_shortens_min_interval(self):
+        scheduler = IntervalScheduler(60, 600, jitter=0.5, clock=self.clock, rand=lambda: 0.0)
+        self.assertEqual(30, scheduler.next_delay())
+
+    def test_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            IntervalScheduler(60, 30)
+        with self.assertRaises(ValueError):
+            IntervalScheduler(60, 600, jitter=1)
+
+    def test_detector_uses_scheduler(self):
+        answers = iter(["1.1.1.1", "1.1.1.1", "1.1.1.1", "garbage", "1.1.1.2", "1.1.1.2"])
+        scheduler = IntervalScheduler(10, 1000, growth=2, clock=self.clock, rand=lambda: 1.0)
+        detector = SimulatedDetector(self.clock, 6, update_notifier=Dummy(), ip_providers=[("test", lambda: (next(answers), 200))], interval_scheduler=scheduler)
+        detector.start()
+        # changed, stable, stable, failed, changed, stable
+        self.assertEqual([20, 40, 80, 20, 20, 40], detector.delays)
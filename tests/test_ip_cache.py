@@ -0,0 +1,105 @@
+import fcntl
+import os
+import tempfile
+import threading
+import time
+
+from unittest import TestCase
+
+import deadline
+from dyndns_updater import UpdateDetector
+from ip_cache import SharedIpCache
+from tests.stubs import Clock, Dummy
+
+
+class Upstream:
+    def __init__(self, ip="1.1.1.1", delay=0.0):
+        self.ip = ip
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.ip
+
+
+class TestSharedIpCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, "ip.json")
+        self.clock = Clock()
+
+    def cache(self, max_age=60):
+        return SharedIpCache(self.path, max_age=max_age, clock=self.clock)
+
+    def test_serves_fresh_ip(self):
+        upstream = Upstream()
+        self.assertEqual("1.1.1.1", self.cache().get(upstream))
+        self.clock.now += 59
+        self.assertEqual("1.1.1.1", self.cache().get(upstream))
+        self.assertEqual(1, upstream.calls)
+
+    def test_refreshes_stale_ip(self):
+        upstream = Upstream()
+        self.cache().get(upstream)
+        self.clock.now += 61
+        upstream.ip = "1.1.1.2"
+        self.assertEqual("1.1.1.2", self.cache().get(upstream))
+        self.assertEqual(2, upstream.calls)
+
+    def test_single_flight(self):
+        upstream = Upstream(delay=0.2)
+        results = list()
+        threads = [threading.Thread(target=lambda: results.append(self.cache().get(upstream))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["1.1.1.1"] * 8, results)
+        self.assertEqual(1, upstream.calls)
+
+    def hold_lock(self):
+        lock = open(self.path + ".lock", "a")
+        self.addCleanup(lock.close)
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+    def test_lock_wait_bounded_by_deadline(self):
+        self.hold_lock()
+        upstream = Upstream()
+        start = time.monotonic()
+        with deadline.budget(0.2):
+            with self.assertRaises(deadline.DeadlineExceeded):
+                self.cache().get(upstream)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(0, upstream.calls)
+
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[("test", lambda: ("1.1.1.1", 200))], ip_cache=self.cache(), budget=0.2)
+        self.assertIsNone(detector.get_external_ip())
+
+    def test_failed_refresh_not_cached(self):
+        self.assertIsNone(self.cache().get(Upstream(ip=None)))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_corrupt_file_is_refreshed(self):
+        with open(self.path, "w") as f:
+            f.write("{garbage")
+        self.assertEqual("1.1.1.1", self.cache().get(Upstream()))
+
+    def test_invalidate(self):
+        upstream = Upstream()
+        cache = self.cache()
+        cache.get(upstream)
+        cache.invalidate()
+        cache.invalidate()
+        cache.get(upstream)
+        self.assertEqual(2, upstream.calls)
+
+    def test_detectors_share_discovery(self):
+        provider = Upstream()
+        detectors = [UpdateDetector(update_notifier=Dummy(), ip_providers=[("test", lambda: (provider(), 200))], ip_cache=self.cache()) for _ in range(3)]
+        self.assertEqual(["1.1.1.1"] * 3, [detector.get_external_ip() for detector in detectors])
+        self.assertEqual(1, provider.calls)
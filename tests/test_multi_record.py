@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+
+from unittest import TestCase
+
+from multi_record import FanoutError, RecordFanout, build_detectors, load_records
+from notifier import UpdateNotifier
+from tests.stubs import StubResponse, StubServer
+
+
+class TestMultiRecord(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/ok", StubResponse("okay"), method="POST")
+        self.server.add_route("/flaky", [StubResponse("nonono", 403), StubResponse("okay")], method="POST")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def write_config(self, config):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(config, f)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_load_records_defaults(self):
+        path = self.write_config({
+            "url": "http://server",
+            "secret": "secret",
+            "records": [
+                {"record": "a.example.com."},
+                {"record": "b.example.com.", "secret": "other", "interval": 30, "network": "lte"},
+            ]
+        })
+        records = load_records(path)
+        self.assertEqual(2, len(records))
+        self.assertEqual(("http://server", "secret", 60, "default"), (records[0].url, records[0].secret, records[0].interval, records[0].network))
+        self.assertEqual(("other", 30, "lte"), (records[1].secret, records[1].interval, records[1].network))
+
+    def test_load_records_missing_secret(self):
+        path = self.write_config({"url": "http://server", "records": [{"record": "a.example.com."}]})
+        with self.assertRaises(ValueError):
+            load_records(path)
+
+    def test_build_detectors_per_network(self):
+        path = self.write_config({
+            "url": "http://server",
+            "secret": "secret",
+            "records": [
+                {"record": "a.example.com.", "interval": 120},
+                {"record": "b.example.com.", "interval": 30},
+                {"record": "c.example.com.", "network": "lte"},
+            ]
+        })
+        detectors = build_detectors(load_records(path), [("test", lambda: ("1.1.1.1", 200))])
+        self.assertEqual(2, len(detectors))
+        self.assertEqual(30, detectors[0].interval)
+        self.assertEqual(2, len(detectors[0].update_notifier.notifiers))
+
+    def test_fanout_retries_failed_records_only(self):
+        notifiers = [UpdateNotifier(f"{i}.example.com.", self.server.url("/ok"), "secret") for i in range(20)]
+        notifiers.append(UpdateNotifier("flaky.example.com.", self.server.url("/flaky"), "secret"))
+        fanout = RecordFanout(notifiers, concurrency=4)
+
+        with self.assertRaises(FanoutError) as ctx:
+            fanout.notify_update("1.1.1.1")
+        self.assertEqual(["flaky.example.com."], ctx.exception.failed)
+        self.assertEqual(21, len(self.server.requests))
+
+        fanout.notify_update("1.1.1.1")
+        self.assertEqual(22, len(self.server.requests))
+        self.assertEqual("1.1.1.1", fanout.last_ip("flaky.example.com."))
@@ -0,0 +1,80 @@
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from unittest import TestCase
+
+from dyndns_updater import UpdateDetector, prom_check_triggers
+from netwatch import SOURCE_POLL, ChangeWatcher, NetlinkWatcher, ProcNetWatcher
+from tests.stubs import Dummy
+
+
+class CountingProvider:
+    def __init__(self):
+        self.calls = 0
+        self.checked = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.checked.set()
+        return "1.1.1.1", 200
+
+
+def nlmsg(msg_type, payload=b"\x00" * 8):
+    return struct.pack("=IHHII", 16 + len(payload), msg_type, 0, 0, 0) + payload
+
+
+class TestNetwatch(TestCase):
+    def test_wait_timeout_is_poll(self):
+        watcher = ChangeWatcher(settle=0)
+        self.assertEqual((SOURCE_POLL, None), watcher.wait(0.01))
+
+    def test_events_are_merged(self):
+        watcher = ChangeWatcher(settle=0.05)
+        watcher.notify("netlink")
+        first = time.monotonic()
+        watcher.notify("netlink")
+        source, changed_at = watcher.wait(1)
+        self.assertEqual("netlink", source)
+        self.assertLessEqual(changed_at, first)
+        self.assertEqual((SOURCE_POLL, None), watcher.wait(0.01))
+
+    def test_parse_netlink_messages(self):
+        data = nlmsg(20) + nlmsg(3) + nlmsg(25)
+        self.assertEqual(["newaddr", "delroute"], NetlinkWatcher.parse_messages(data))
+        self.assertEqual([], NetlinkWatcher.parse_messages(b"\x01\x02"))
+
+    def test_procfs_change(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        watcher = ProcNetWatcher(poll_interval=0.02, files=(path,))
+        watcher.start()
+        self.addCleanup(watcher.stop)
+        time.sleep(0.05)
+        with open(path, "w") as f:
+            f.write("0.0.0.0 192.168.0.1")
+        self.assertEqual("procfs", watcher.wait(1)[0])
+
+    def test_event_triggers_immediate_check(self):
+        watcher = ChangeWatcher(settle=0)
+        provider = CountingProvider()
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[("test", provider)], interval=60, watcher=watcher)
+        triggers = prom_check_triggers.labels("fake")._value.get()
+
+        thread = threading.Thread(target=detector.start, daemon=True)
+        thread.start()
+        self.assertTrue(provider.checked.wait(1))
+        provider.checked.clear()
+
+        watcher.notify("fake")
+        self.assertTrue(provider.checked.wait(1))
+        self.assertEqual(2, provider.calls)
+        self.assertEqual(triggers + 1, prom_check_triggers.labels("fake")._value.get())
+
+        detector.quit()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
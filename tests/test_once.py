@@ -0,0 +1,47 @@
+import argparse
+import os
+import tempfile
+
+from unittest import TestCase
+
+from dns_client import EXIT_NO_IP, EXIT_OK, EXIT_UPDATE_FAILED, run_once
+from dyndns_updater import UpdateDetector
+from persistence import FilePersistence
+from tests.stubs import RecordingNotifier
+
+
+class TestOnce(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.state = FilePersistence(os.path.join(self.dir.name, "ip"))
+        self.args = argparse.Namespace(textfile=None)
+
+    def detector(self, answer, notifier):
+        return UpdateDetector(update_notifier=notifier, ip_providers=[("test", lambda: (answer, 200))], persistence=self.state)
+
+    def test_updates_and_persists(self):
+        notifier = RecordingNotifier()
+        self.assertEqual(EXIT_OK, run_once([self.detector("1.1.1.1", notifier)], self.args))
+        self.assertEqual(EXIT_OK, run_once([self.detector("1.1.1.1", notifier)], self.args))
+        self.assertEqual(["1.1.1.1"], notifier.sent)
+        self.assertEqual("1.1.1.1", self.state.read())
+
+    def test_no_ip(self):
+        self.assertEqual(EXIT_NO_IP, run_once([self.detector("garbage", RecordingNotifier())], self.args))
+
+    def test_update_failed_is_retried_next_run(self):
+        self.assertEqual(EXIT_UPDATE_FAILED, run_once([self.detector("1.1.1.1", RecordingNotifier(fail=1))], self.args))
+        notifier = RecordingNotifier()
+        self.assertEqual(EXIT_OK, run_once([self.detector("1.1.1.1", notifier)], self.args))
+        self.assertEqual(["1.1.1.1"], notifier.sent)
+
+    def test_worst_exit_code_wins(self):
+        detectors = [self.detector("garbage", RecordingNotifier()), self.detector("1.1.1.1", RecordingNotifier(fail=1))]
+        self.assertEqual(EXIT_UPDATE_FAILED, run_once(detectors, self.args))
+
+    def test_textfile(self):
+        self.args.textfile = os.path.join(self.dir.name, "dnsclient.prom")
+        run_once([self.detector("1.1.1.1", RecordingNotifier())], self.args)
+        with open(self.args.textfile) as f:
+            self.assertIn("dnsclient_check_duration_seconds_count", f.read())
@@ -0,0 +1,121 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from unittest import TestCase
+
+from dyndns_updater import UpdateDetector
+from outbox import Outbox, OutboxFile
+from tests.stubs import Clock, RecordingNotifier
+
+
+class TestOutbox(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_send(self):
+        outbox = Outbox(clock=self.clock)
+        notifier = RecordingNotifier()
+        outbox.register(notifier).notify_update("1.1.1.1")
+        self.assertEqual(1, outbox.depth())
+        self.assertEqual(1, outbox.process_once())
+        self.assertEqual(["1.1.1.1"], notifier.sent)
+        self.assertEqual(0, outbox.depth())
+
+    def test_coalesce(self):
+        outbox = Outbox(clock=self.clock)
+        notifier = RecordingNotifier()
+        queued = outbox.register(notifier)
+        for ip in ("1.1.1.1", "1.1.1.2", "1.1.1.3"):
+            queued.notify_update(ip)
+        self.assertEqual(1, outbox.depth())
+        outbox.process_once()
+        self.assertEqual(["1.1.1.3"], notifier.sent)
+
+    def test_retry_with_backoff(self):
+        outbox = Outbox(clock=self.clock, min_retry=10)
+        notifier = RecordingNotifier(fail=1)
+        outbox.register(notifier).notify_update("1.1.1.1")
+
+        self.assertEqual(1, outbox.process_once())
+        self.assertEqual(1, outbox.depth())
+        self.assertEqual(0, outbox.process_once())
+
+        self.clock.now += 10
+        self.assertEqual(1, outbox.process_once())
+        self.assertEqual(["1.1.1.1"], notifier.sent)
+
+    def test_oldest_age(self):
+        outbox = Outbox(clock=self.clock)
+        outbox.enqueue("a.", "1.1.1.1")
+        self.clock.now += 5
+        outbox.enqueue("b.", "1.1.1.1")
+        self.clock.now += 5
+        self.assertEqual(10, outbox.oldest_age())
+
+    def state_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return OutboxFile(os.path.join(directory.name, "outbox"))
+
+    def test_survives_restart(self):
+        state_file = self.state_file()
+        outbox = Outbox(state_file=state_file, clock=self.clock)
+        outbox.enqueue("my.record.tld.", "1.1.1.1")
+        outbox.quit()
+
+        restored = Outbox(state_file=state_file, clock=self.clock)
+        self.assertEqual(1, restored.depth())
+        notifier = RecordingNotifier()
+        restored.register(notifier)
+        restored.process_once()
+        restored.quit()
+        self.assertEqual(["1.1.1.1"], notifier.sent)
+
+        self.assertEqual(0, Outbox(state_file=state_file).depth())
+
+    def test_missing_state_file_is_empty(self):
+        with self.assertLogs(level="DEBUG") as logs:
+            logging.debug("restoring")
+            self.assertEqual(0, Outbox(state_file=self.state_file()).depth())
+        self.assertEqual(["restoring"], [record.getMessage() for record in logs.records])
+
+    def test_saves_are_coalesced(self):
+        state_file = self.state_file()
+        writes = list()
+        save = state_file.save
+        state_file.save = lambda state: writes.append(state) or save(state)
+
+        outbox = Outbox(state_file=state_file, save_delay=0.2, clock=self.clock)
+        outbox.start()
+        self.addCleanup(outbox.quit, 1)
+        for i in range(100):
+            outbox.enqueue(f"record{i}.", "1.1.1.1")
+
+        deadline = time.monotonic() + 5
+        while not writes and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(1, len(writes))
+        self.assertEqual(100, len(writes[0]))
+
+    def test_slow_server_does_not_block_detection(self):
+        block = threading.Event()
+        outbox = Outbox()
+        outbox.start()
+        self.addCleanup(outbox.quit, 1)
+        self.addCleanup(block.set)
+
+        notifier = RecordingNotifier(block=block)
+        detector = UpdateDetector(update_notifier=outbox.register(notifier), ip_providers=[("test", lambda: ("1.1.1.1", 200))])
+
+        start = time.monotonic()
+        self.assertEqual("1.1.1.1", detector.perform_check(None))
+        self.assertLess(time.monotonic() - start, 1)
+
+        block.set()
+        deadline = time.monotonic() + 5
+        while outbox.depth() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(["1.1.1.1"], notifier.sent)
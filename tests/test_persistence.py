@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+
+from unittest import TestCase
+
+from multi_record import RecordFanout
+from persistence import FilePersistence, SqlitePersistence, SqliteStore
+from tests.stubs import Clock, RecordingNotifier
+
+
+class TestFilePersistence(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_write_replaces_atomically(self):
+        path = os.path.join(self.dir.name, "ip")
+        persistence = FilePersistence(path)
+        persistence.write("1.1.1.1")
+        persistence.write("1.1.1.2")
+        self.assertEqual("1.1.1.2", persistence.read())
+        self.assertEqual(["ip"], os.listdir(self.dir.name))
+
+
+class TestSqliteStore(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.clock = Clock()
+        self.path = os.path.join(self.dir.name, "state.db")
+        self.store = SqliteStore(self.path, clock=self.clock)
+        self.addCleanup(self.store.close)
+
+    def test_read_unknown_record(self):
+        self.assertIsNone(self.store.read("a.example.com."))
+
+    def test_wal_mode(self):
+        mode = self.store._conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual("wal", mode)
+
+    def test_history_only_records_changes(self):
+        persistence = self.store.for_record("a.example.com.")
+        for ip in ("1.1.1.1", "1.1.1.1", "1.1.1.2", "1.1.1.2"):
+            self.clock.now += 1
+            persistence.write(ip)
+        self.assertEqual("1.1.1.2", persistence.read())
+        self.assertEqual([("1.1.1.2", 1003.0), ("1.1.1.1", 1001.0)], self.store.history("a.example.com."))
+
+    def test_write_many_and_reopen(self):
+        updates = {f"record{i}.example.com.": "1.1.1.1" for i in range(1000)}
+        self.store.write_many(updates)
+        self.store.close()
+
+        self.store = SqliteStore(self.path)
+        self.assertEqual(updates, self.store.read_all())
+
+    def test_failed_batch_is_rolled_back(self):
+        self.store.write("a.example.com.", "1.1.1.1")
+        with self.assertRaises(Exception):
+            self.store.write_many({"a.example.com.": "1.1.1.2", "b.example.com.": object()})
+        self.assertEqual({"a.example.com.": "1.1.1.1"}, self.store.read_all())
+
+    def test_compaction_keeps_newest_entry(self):
+        for ip in ("1.1.1.1", "1.1.1.2", "1.1.1.3"):
+            self.store.write("a.example.com.", ip)
+            self.store.write("b.example.com.", ip)
+            self.clock.now += 100
+        self.store.write("b.example.com.", "1.1.1.4")
+
+        self.assertEqual(4, self.store.compact(max_age=150))
+        self.assertEqual([("1.1.1.3", 1200.0)], self.store.history("a.example.com."))
+        self.assertEqual([("1.1.1.4", 1300.0), ("1.1.1.3", 1200.0)], self.store.history("b.example.com."))
+
+    def test_retention_compacts_on_write(self):
+        store = SqliteStore(os.path.join(self.dir.name, "retention.db"), retention=10, clock=self.clock)
+        self.addCleanup(store.close)
+        store.write("a.example.com.", "1.1.1.1")
+        self.clock.now += SqliteStore.COMPACTION_INTERVAL
+        store.write("a.example.com.", "1.1.1.2")
+        self.assertEqual(1, len(store.history("a.example.com.")))
+
+    def test_concurrent_writers(self):
+        def write(n):
+            persistence = self.store.for_record(f"record{n}.example.com.")
+            for i in range(50):
+                persistence.write(f"10.0.{n}.{i}")
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8, len(self.store.read_all()))
+        self.assertEqual(50, len(self.store.history("record0.example.com.")))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            SqliteStore("")
+        with self.assertRaises(ValueError):
+            SqlitePersistence(self.store, "")
+
+    def test_fanout_restores_state(self):
+        notifiers = [RecordingNotifier(f"record{i}.example.com.") for i in range(3)]
+        RecordFanout(notifiers, store=self.store).notify_update("1.1.1.1")
+        self.assertEqual(3, len(self.store.read_all()))
+
+        notifiers.append(RecordingNotifier("new.example.com."))
+        RecordFanout(notifiers, store=self.store).notify_update("1.1.1.1")
+        # records already at the IP before the restart are not notified again
+        self.assertEqual([["1.1.1.1"]] * 4, [n.sent for n in notifiers])
@@ -0,0 +1,136 @@
+import glob
+import os
+import signal
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from unittest import TestCase
+
+from profiling import Profiler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.profiler = Profiler(self.dir.name, cycles=2)
+        self.profiled = list()
+        self.check = self.profiler.profiled(self.cycle)
+
+    def cycle(self, ip):
+        self.profiled.append(sys.getprofile() is not None)
+        return ip
+
+    def files(self, pattern):
+        return glob.glob(os.path.join(self.dir.name, pattern))
+
+    def test_idle_profiler_does_not_profile(self):
+        for _ in range(3):
+            self.assertEqual("1.1.1.1", self.check("1.1.1.1"))
+        self.assertEqual([False] * 3, self.profiled)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual([], os.listdir(self.dir.name))
+
+    def test_requested_cycles_are_profiled(self):
+        self.profiler.request_cpu_profile()
+        for _ in range(4):
+            self.check("1.1.1.1")
+        self.assertEqual([True, True, False, False], self.profiled)
+        self.assertEqual(1, len(self.files("cpu-*.prof")))
+        with open(self.files("cpu-*.txt")[0]) as f:
+            report = f.read()
+        self.assertIn("2 check cycles", report)
+        self.assertIn("cycle", report)
+
+    def test_profiling_stopped_early(self):
+        profiler = Profiler(self.dir.name, cycles=100)
+        check = profiler.profiled(self.cycle)
+        profiler.request_cpu_profile()
+        check("1.1.1.1")
+        profiler.request_cpu_profile()
+        check("1.1.1.1")
+        self.assertEqual([True, False], self.profiled)
+        self.assertEqual(1, len(self.files("cpu-*.prof")))
+
+    def test_stopped_profile_written_without_cycle(self):
+        profiler = Profiler(self.dir.name, cycles=100)
+        profiler.start()
+        self.addCleanup(profiler.stop, 1)
+        check = profiler.profiled(self.cycle)
+        profiler.request_cpu_profile()
+        check("1.1.1.1")
+
+        profiler.request_cpu_profile()
+        # stopping the thread handles the pending request first
+        profiler.stop(5)
+        self.assertEqual(1, len(self.files("cpu-*.prof")))
+        with open(self.files("cpu-*.txt")[0]) as f:
+            self.assertIn("1 check cycles", f.read())
+
+    def test_threads_started_during_cycle_are_profiled(self):
+        def query_provider():
+            return sum(range(1000))
+
+        def cycle(ip):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(lambda _: query_provider(), range(2)))
+            return ip
+
+        profiler = Profiler(self.dir.name, cycles=1)
+        profiler.request_cpu_profile()
+        profiler.profiled(cycle)("1.1.1.1")
+        with open(self.files("cpu-*.txt")[0]) as f:
+            self.assertIn("query_provider", f.read())
+
+    def test_memory_trace(self):
+        self.profiler.start()
+        self.addCleanup(self.profiler.stop, 1)
+        with self.assertLogs(level="INFO") as logs:
+            self.profiler.request_memory_trace()
+            # no check cycle is needed to start tracing or to write the report
+            wait_for(tracemalloc.is_tracing)
+        self.assertIn("Received request", logs.output[0])
+        allocated = [bytearray(1024) for _ in range(100)]
+
+        self.profiler.request_memory_trace()
+        self.profiler.stop(5)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual([], self.profiled)
+        self.assertEqual(1, len(self.files("memory-*.snapshot")))
+        with open(self.files("memory-*.txt")[0]) as f:
+            report = f.read()
+        self.assertIn("differences since tracing started", report)
+        self.assertIn("test_profiling.py", report)
+        del allocated
+
+    def test_signals(self):
+        for sig in (signal.SIGUSR1, signal.SIGUSR2):
+            self.addCleanup(signal.signal, sig, signal.getsignal(sig))
+        self.profiler.install()
+
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.check("1.1.1.1")
+        self.assertEqual([True], self.profiled)
+
+        os.kill(os.getpid(), signal.SIGUSR2)
+        wait_for(tracemalloc.is_tracing)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        wait_for(lambda: not tracemalloc.is_tracing())
+        self.profiler.stop(1)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            Profiler(None)
+        with self.assertRaises(ValueError):
+            Profiler(self.dir.name, cycles=0)
@@ -0,0 +1,98 @@
+import json
+import os
+import random
+import tempfile
+
+from unittest import TestCase
+
+import transport
+from dyndns_updater import UpdateDetector
+from provider_registry import HttpProvider, as_ip_providers, build_provider, default_providers, load_providers
+from tests.stubs import Dummy, StubResponse, StubServer
+
+
+class TestProviderRegistry(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/plain", StubResponse("1.2.3.4\n"))
+        self.server.add_route("/html", StubResponse("<html><body>Your IP: <b>1.2.3.4</b></body></html>"))
+        self.server.add_route("/json", StubResponse(json.dumps({"data": {"addresses": ["1.2.3.4"]}})))
+        self.server.add_route("/huge", StubResponse("1.2.3.4" + " " * 100000))
+        self.server.add_route("/huge-chunked", StubResponse("x" * 100000, chunked=True))
+        self.server.add_route("/binary", StubResponse(bytes(range(256)) * 4))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def write_config(self, config):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(config, f)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_plain(self):
+        self.assertEqual(("1.2.3.4\n", 200), HttpProvider("plain", self.server.url("/plain"))())
+
+    def test_regex(self):
+        provider = HttpProvider("html", self.server.url("/html"), regex=r"<b>([0-9.]+)</b>")
+        self.assertEqual(("1.2.3.4", 200), provider())
+
+    def test_json_path(self):
+        provider = HttpProvider("json", self.server.url("/json"), json_path="data.addresses.0")
+        self.assertEqual(("1.2.3.4", 200), provider())
+        self.assertEqual("", HttpProvider("json", self.server.url("/json"), json_path="data.missing").extract('{"data": {}}'))
+        self.assertEqual("", HttpProvider("json", self.server.url("/json"), json_path="ip").extract("<html>"))
+
+    def test_oversized_bodies_rejected(self):
+        for path in ("/huge", "/huge-chunked"):
+            with self.assertRaises(transport.ResponseTooLarge):
+                HttpProvider(path, self.server.url(path), max_bytes=1024)()
+
+    def test_garbage_and_oversized_skipped(self):
+        providers = [(path, HttpProvider(path, self.server.url(path))) for path in ("/huge", "/huge-chunked", "/binary", "/html")]
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=providers)
+        self.assertIsNone(detector.get_external_ip())
+
+        providers.append(("/plain", HttpProvider("/plain", self.server.url("/plain"))))
+        self.assertEqual("1.2.3.4", UpdateDetector(update_notifier=Dummy(), ip_providers=providers).get_external_ip())
+
+    def test_cheap_validation(self):
+        self.assertFalse(UpdateDetector.is_valid_ipv4("1" * 100000))
+        self.assertFalse(UpdateDetector.is_valid_ipv4("<html>"))
+        self.assertTrue(UpdateDetector.is_valid_ipv4("1.2.3.4"))
+
+    def test_load_providers(self):
+        path = self.write_config({"providers": [
+            {"name": "plain", "url": self.server.url("/plain"), "weight": 2, "timeout": 1},
+            {"name": "v6", "url": "https://api6.ipify.org", "family": 6},
+            {"name": "dns", "type": "dns", "qname": "myip.opendns.com", "server": "208.67.222.222"},
+        ]})
+        providers = as_ip_providers(load_providers(path))
+        self.assertEqual(["plain", "dns"], [name for name, _ in providers])
+        self.assertEqual(2, providers[0][1].weight)
+
+    def test_invalid_declarations(self):
+        with self.assertRaises(ValueError):
+            build_provider({"name": "typo", "ulr": "https://example.com"})
+        with self.assertRaises(ValueError):
+            build_provider({"name": "unknown", "type": "smtp"})
+        with self.assertRaises(ValueError):
+            build_provider({"name": "both", "url": "https://example.com", "regex": ".", "json_path": "ip"})
+        with self.assertRaises(ValueError):
+            load_providers(self.write_config({"providers": [{"name": "a", "url": "http://a"}, {"name": "a", "url": "http://b"}]}))
+
+    def test_defaults(self):
+        self.assertEqual(5, len(default_providers()))
+        self.assertEqual(9, len(default_providers(use_dns_providers=True)))
+
+    def test_weighted_shuffle(self):
+        random.seed(3)
+        heavy = HttpProvider("heavy", "http://heavy", weight=9)
+        light = HttpProvider("light", "http://light")
+        first = list()
+        for _ in range(1000):
+            providers = [("light", light), ("heavy", heavy)]
+            UpdateDetector.shuffle_providers(providers)
+            first.append(providers[0][0])
+        self.assertGreater(first.count("heavy"), 850)
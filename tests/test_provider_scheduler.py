@@ -0,0 +1,70 @@
+from collections import Counter
+from unittest import TestCase
+
+from dyndns_updater import UpdateDetector
+from provider_scheduler import CLOSED, HALF_OPEN, OPEN, ProviderScheduler
+from tests.stubs import Clock, Dummy
+
+
+def providers(*names):
+    return [(name, None) for name in names]
+
+
+def names(ordered):
+    return [provider[0] for provider in ordered]
+
+
+class TestProviderScheduler(TestCase):
+    def setUp(self):
+        self.clock = Clock(now=0.0)
+        self.scheduler = ProviderScheduler(failure_threshold=2, cooldown=60, clock=self.clock)
+
+    def test_fast_provider_preferred(self):
+        for _ in range(10):
+            self.scheduler.record_success("fast", 0.1)
+            self.scheduler.record_success("slow", 3)
+
+        first = Counter(names(self.scheduler.order(providers("fast", "slow")))[0] for _ in range(1000))
+        self.assertGreater(first["fast"], 900)
+        self.assertGreater(first["slow"], 0)
+
+    def test_equal_providers_share_load(self):
+        first = Counter(names(self.scheduler.order(providers("a", "b", "c")))[0] for _ in range(3000))
+        for site in ("a", "b", "c"):
+            self.assertGreater(first[site], 800)
+
+    def test_breaker_opens_and_probes(self):
+        self.scheduler.record_failure("dead", 1, "timeout")
+        self.assertEqual(CLOSED, self.scheduler.stats("dead").state)
+        self.scheduler.record_failure("dead", 1, "timeout")
+        self.assertEqual(OPEN, self.scheduler.stats("dead").state)
+        self.assertEqual(["ok"], names(self.scheduler.order(providers("dead", "ok"))))
+
+        self.clock.now = 61
+        self.assertEqual(["dead", "ok"], names(self.scheduler.order(providers("dead", "ok"))))
+        self.assertEqual(HALF_OPEN, self.scheduler.stats("dead").state)
+        # only a single probe is handed out while half-open
+        self.assertEqual(["ok"], names(self.scheduler.order(providers("dead", "ok"))))
+
+        self.scheduler.record_failure("dead", 1, "timeout")
+        self.assertEqual(OPEN, self.scheduler.stats("dead").state)
+
+        self.clock.now = 122
+        self.scheduler.order(providers("dead", "ok"))
+        self.scheduler.record_success("dead", 0.1)
+        self.assertEqual(CLOSED, self.scheduler.stats("dead").state)
+
+    def test_all_benched_still_tried(self):
+        for site in ("a", "b"):
+            self.scheduler.record_failure(site, 1)
+            self.scheduler.record_failure(site, 1)
+        self.assertEqual(["a", "b"], sorted(names(self.scheduler.order(providers("a", "b")))))
+
+    def test_detector_records_results(self):
+        ip_providers = [("good", lambda: ("1.1.1.1", 200)), ("bad", lambda: ("garbage", 200))]
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=ip_providers, scheduler=self.scheduler)
+        detector._query_provider(ip_providers[1])
+        detector._query_provider(ip_providers[1])
+        self.assertEqual(OPEN, self.scheduler.stats("bad").state)
+        self.assertEqual("1.1.1.1", detector.perform_check(None))
+        self.assertEqual(CLOSED, self.scheduler.stats("good").state)
@@ -0,0 +1,54 @@
+import time
+
+from unittest import TestCase
+
+from dyndns_updater import UpdateDetector, prom_ipresolver_disagreements
+from tests.stubs import Dummy
+
+
+def provider(ip, status_code=200, delay=0.0):
+    def resolve():
+        time.sleep(delay)
+        return ip, status_code
+    return resolve
+
+
+def disagreements(site):
+    return prom_ipresolver_disagreements.labels(site)._value.get()
+
+
+class TestQuorum(TestCase):
+    def build(self, providers, fanout, quorum):
+        return UpdateDetector(update_notifier=Dummy(), ip_providers=providers, fanout=fanout, quorum=quorum)
+
+    def test_quorum_reached(self):
+        detector = self.build([("a", provider("1.1.1.1")), ("b", provider("1.1.1.1")), ("c", provider("1.1.1.1"))], fanout=3, quorum=2)
+        self.assertEqual("1.1.1.1", detector.get_external_ip())
+
+    def test_quorum_outvotes_liar(self):
+        before = disagreements("liar")
+        detector = self.build([("liar", provider("10.0.0.1")), ("d", provider("1.1.1.1", delay=0.05)), ("e", provider("1.1.1.1", delay=0.05))], fanout=3, quorum=2)
+        self.assertEqual("1.1.1.1", detector.get_external_ip())
+        self.assertEqual(before + 1, disagreements("liar"))
+
+    def test_quorum_returns_early(self):
+        detector = self.build([("f", provider("1.1.1.1")), ("g", provider("1.1.1.1")), ("h", provider("1.1.1.1", delay=2))], fanout=3, quorum=2)
+        start = time.monotonic()
+        self.assertEqual("1.1.1.1", detector.get_external_ip())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_quorum_replaces_failed_providers(self):
+        detector = self.build([("i", provider("500", 500)), ("j", provider("1.1.1.1")), ("k", provider("1.1.1.1"))], fanout=2, quorum=2)
+        self.assertEqual("1.1.1.1", detector.get_external_ip())
+
+    def test_quorum_replaces_disagreeing_providers(self):
+        detector = self.build([("liar2", provider("10.0.0.1")), ("p", provider("1.1.1.1")), ("q", provider("1.1.1.1"))], fanout=2, quorum=2)
+        self.assertEqual("1.1.1.1", detector.get_external_ip())
+
+    def test_quorum_not_reached(self):
+        detector = self.build([("l", provider("1.1.1.1")), ("m", provider("2.2.2.2")), ("n", provider("garbage"))], fanout=3, quorum=2)
+        self.assertIsNone(detector.get_external_ip())
+
+    def test_quorum_larger_than_fanout(self):
+        with self.assertRaises(ValueError):
+            self.build([("o", provider("1.1.1.1"))], fanout=1, quorum=2)
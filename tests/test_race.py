@@ -0,0 +1,63 @@
+import time
+
+import requests
+
+from unittest import TestCase
+
+from dyndns_updater import UpdateDetector
+from tests.stubs import Dummy, StubResponse, StubServer
+
+
+def http_provider(url):
+    def provider():
+        resp = requests.get(url, timeout=5)
+        return resp.text, resp.status_code
+    return provider
+
+
+class TestRace(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/slow", StubResponse("1.1.1.1", delay=2))
+        self.server.add_route("/fast", StubResponse("2.2.2.2", delay=0.05))
+        self.server.add_route("/error", StubResponse("500", status=500))
+        self.server.add_route("/garbage", StubResponse("<html>captive portal</html>"))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def build(self, paths, fanout, hedge_delay=0.0):
+        providers = [(path, http_provider(self.server.url(path))) for path in paths]
+        return UpdateDetector(update_notifier=Dummy(), ip_providers=providers, fanout=fanout, hedge_delay=hedge_delay)
+
+    def test_race_fastest_wins(self):
+        detector = self.build(["/slow", "/fast"], fanout=2)
+        start = time.monotonic()
+        self.assertEqual("2.2.2.2", detector.get_external_ip())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_race_hedge_delay(self):
+        detector = self.build(["/slow", "/fast"], fanout=2, hedge_delay=0.3)
+        start = time.monotonic()
+        self.assertEqual("2.2.2.2", detector.get_external_ip())
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.3)
+        self.assertLess(elapsed, 1)
+
+    def test_race_no_hedge_waits_for_answer(self):
+        detector = self.build(["/slow", "/fast"], fanout=2, hedge_delay=None)
+        self.assertEqual("1.1.1.1", detector.get_external_ip())
+
+    def test_race_failures_start_next_provider(self):
+        detector = self.build(["/error", "/garbage", "/fast"], fanout=2, hedge_delay=10)
+        start = time.monotonic()
+        self.assertEqual("2.2.2.2", detector.get_external_ip())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_race_all_failing(self):
+        detector = self.build(["/error", "/garbage"], fanout=3)
+        self.assertIsNone(detector.get_external_ip())
+
+    def test_invalid_fanout(self):
+        with self.assertRaises(ValueError):
+            self.build(["/fast"], fanout=0)
@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+import transport
+from dyndns_updater import UpdateDetector
+from rate_limiter import RateLimiter, TokenBucket
+from tests.stubs import Clock, Dummy, StubResponse, StubServer
+
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=0.5, burst=2, clock=self.clock)
+        for _ in range(2):
+            self.assertTrue(bucket.available())
+            bucket.take()
+        self.assertFalse(bucket.available())
+        self.clock.now += 2
+        self.assertTrue(bucket.available())
+
+    def test_provider_limit(self):
+        limiter = RateLimiter(provider_rate=1 / 60, clock=self.clock)
+        self.assertTrue(limiter.acquire("a"))
+        self.assertFalse(limiter.acquire("a"))
+        self.assertTrue(limiter.acquire("b"))
+        self.clock.now += 60
+        self.assertTrue(limiter.acquire("a"))
+
+    def test_global_limit(self):
+        limiter = RateLimiter(global_rate=1, global_burst=2, clock=self.clock)
+        self.assertEqual([True, True, False], [limiter.acquire(site) for site in "abc"])
+
+    def test_throttle(self):
+        limiter = RateLimiter(default_penalty=30, max_penalty=600, clock=self.clock)
+        limiter.throttle("a", 429, retry_after=120)
+        limiter.throttle("b", 503)
+        limiter.throttle("c", 429, retry_after=86400)
+        self.assertEqual([1120, 1030, 1600], [limiter.throttled_until(site) for site in "abc"])
+        self.assertFalse(limiter.acquire("a"))
+        self.clock.now += 120
+        self.assertTrue(limiter.acquire("a"))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(120, transport.parse_retry_after("120"))
+        self.assertEqual(60, transport.parse_retry_after("Wed, 21 Oct 2015 07:29:00 GMT", now=1445412480))
+        self.assertIsNone(transport.parse_retry_after("soon"))
+        self.assertIsNone(transport.parse_retry_after(None))
+
+
+class TestThrottledProviders(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/throttled", StubResponse("slow down", 429, headers={"Retry-After": "120"}))
+        self.server.add_route("/unavailable", StubResponse("maintenance", 503))
+        self.server.add_route("/ok", StubResponse("1.1.1.1"))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def provider(self, path):
+        url = self.server.url(path)
+        return path, lambda: transport.fetch(url, timeout=5)
+
+    def test_throttled_provider_skipped(self):
+        limiter = RateLimiter()
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[self.provider("/throttled"), self.provider("/ok")], rate_limiter=limiter)
+
+        for _ in range(3):
+            self.assertEqual("1.1.1.1", detector.get_external_ip())
+        paths = [request[1] for request in self.server.requests]
+        self.assertEqual(1, paths.count("/throttled"))
+        self.assertEqual(3, paths.count("/ok"))
+        self.assertGreater(limiter.throttled_until("/throttled"), 0)
+
+    def test_503_without_retry_after(self):
+        limiter = RateLimiter(default_penalty=60)
+        detector = UpdateDetector(update_notifier=Dummy(), ip_providers=[self.provider("/unavailable")], rate_limiter=limiter)
+        self.assertIsNone(detector.get_external_ip())
+        self.assertIsNone(detector.get_external_ip())
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_limiter_shared_between_detectors(self):
+        limiter = RateLimiter(provider_rate=1 / 60)
+        detectors = [UpdateDetector(update_notifier=Dummy(), ip_providers=[self.provider("/ok")], rate_limiter=limiter) for _ in range(3)]
+        self.assertEqual(["1.1.1.1", None, None], [detector.get_external_ip() for detector in detectors])
+        self.assertEqual(1, len(self.server.requests))
@@ -0,0 +1,65 @@
+import socket
+
+from unittest import TestCase
+
+import dns_wire
+from dyndns_updater import UpdateDetector, prom_updates_avoided
+from record_lookup import PublishedRecord
+from tests.stubs import Clock, RecordingNotifier, StubDnsServer
+
+
+class TestPublishedRecord(TestCase):
+    def setUp(self):
+        self.server = StubDnsServer().start()
+        self.server.add("my.record.tld", dns_wire.QTYPE_A, socket.inet_aton("1.1.1.1"), ttl=60)
+        self.clock = Clock(now=0.0)
+        host, port = self.server.address
+        self.record = PublishedRecord("my.record.tld.", host, port=port, max_ttl=300, timeout=0.5, clock=self.clock)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_cached_for_ttl(self):
+        self.assertEqual({"1.1.1.1"}, self.record.lookup())
+        self.clock.now = 59
+        self.assertTrue(self.record.matches("1.1.1.1"))
+        self.assertEqual(1, len(self.server.queries))
+
+        self.clock.now = 60
+        self.record.lookup()
+        self.assertEqual(2, len(self.server.queries))
+
+    def test_ttl_capped(self):
+        record = PublishedRecord("my.record.tld.", *self.server.address, max_ttl=10, clock=self.clock)
+        record.lookup()
+        self.clock.now = 10
+        record.lookup()
+        self.assertEqual(2, len(self.server.queries))
+
+    def test_missing_record(self):
+        host, port = self.server.address
+        record = PublishedRecord("other.record.tld.", host, port=port, clock=self.clock)
+        self.assertEqual(set(), record.lookup())
+        self.assertFalse(record.matches("1.1.1.1"))
+
+    def test_detector_skips_published_ip(self):
+        notifier = RecordingNotifier()
+        detector = UpdateDetector(update_notifier=notifier, ip_providers=[("test", lambda: ("1.1.1.1", 200))], published_record=self.record)
+        avoided = prom_updates_avoided._value.get()
+
+        self.assertEqual("1.1.1.1", detector.perform_check(None))
+        self.assertEqual([], notifier.sent)
+        self.assertEqual(avoided + 1, prom_updates_avoided._value.get())
+
+    def test_detector_updates_changed_ip(self):
+        notifier = RecordingNotifier()
+        detector = UpdateDetector(update_notifier=notifier, ip_providers=[("test", lambda: ("2.2.2.2", 200))], published_record=self.record)
+        detector.perform_check(None)
+        self.assertEqual(["2.2.2.2"], notifier.sent)
+
+    def test_detector_updates_if_lookup_fails(self):
+        self.server.stop()
+        notifier = RecordingNotifier()
+        detector = UpdateDetector(update_notifier=notifier, ip_providers=[("test", lambda: ("1.1.1.1", 200))], published_record=self.record)
+        detector.perform_check(None)
+        self.assertEqual(["1.1.1.1"], notifier.sent)
@@ -0,0 +1,171 @@
+import socket
+import threading
+
+from unittest import TestCase
+
+import dns_wire
+import requests
+import transport
+from resolver_cache import ResolverCache, WireResolver, prom_resolver_cache_requests
+from tests.stubs import Clock, StubDnsServer, StubResponse, StubServer
+
+
+class FakeResolver:
+    def __init__(self, addresses=("127.0.0.1",), ttl=None):
+        self.addresses = list(addresses)
+        self.ttl = ttl
+        self.error = None
+        self.calls = list()
+        self.called = threading.Event()
+
+    def __call__(self, host, family):
+        self.calls.append(host)
+        self.called.set()
+        if self.error:
+            raise self.error
+        return list(self.addresses), self.ttl
+
+
+def requests_total(result):
+    return prom_resolver_cache_requests.labels(result)._value.get()
+
+
+class TestResolverCache(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.resolver = FakeResolver()
+        self.cache = ResolverCache(self.resolver, default_ttl=60, negative_ttl=10, max_stale=100, refresh_ahead=0.1, clock=self.clock)
+
+    def test_cached_until_ttl(self):
+        hits, misses = requests_total("hit"), requests_total("miss")
+        self.assertEqual(["127.0.0.1"], self.cache.resolve("provider.example.com"))
+        self.clock.now += 30
+        self.assertEqual(["127.0.0.1"], self.cache.resolve("PROVIDER.example.com"))
+        self.assertEqual(1, len(self.resolver.calls))
+
+        self.clock.now += 31
+        self.cache.resolve("provider.example.com")
+        self.assertEqual(2, len(self.resolver.calls))
+        self.assertEqual(hits + 1, requests_total("hit"))
+        self.assertEqual(misses + 2, requests_total("miss"))
+
+    def test_ttl_of_resolver_is_respected(self):
+        self.resolver.ttl = 5
+        self.cache.resolve("provider.example.com")
+        self.clock.now += 6
+        self.cache.resolve("provider.example.com")
+        self.assertEqual(2, len(self.resolver.calls))
+
+    def test_ip_literals_are_not_resolved(self):
+        self.assertEqual(["2001:db8::1"], self.cache.resolve("2001:db8::1"))
+        self.assertEqual([], self.resolver.calls)
+
+    def test_stale_addresses_served_while_resolver_fails(self):
+        self.cache.resolve("provider.example.com")
+        self.resolver.error = socket.gaierror(socket.EAI_AGAIN, "resolver down")
+        self.clock.now += 61
+
+        stale = requests_total("stale")
+        self.assertEqual(["127.0.0.1"], self.cache.resolve("provider.example.com"))
+        # the failing resolver is not asked again for every connection
+        self.assertEqual(["127.0.0.1"], self.cache.resolve("provider.example.com"))
+        self.assertEqual(2, len(self.resolver.calls))
+        self.assertEqual(stale + 2, requests_total("stale"))
+
+        # once max_stale passed the stale addresses are given up
+        self.clock.now += 100
+        with self.assertRaises(socket.gaierror):
+            self.cache.resolve("provider.example.com")
+
+    def test_negative_caching(self):
+        self.resolver.error = socket.gaierror(socket.EAI_NONAME, "unknown host")
+        with self.assertRaises(socket.gaierror):
+            self.cache.resolve("unknown.example.com")
+
+        negative = requests_total("negative")
+        with self.assertRaises(socket.gaierror):
+            self.cache.resolve("unknown.example.com")
+        self.assertEqual(1, len(self.resolver.calls))
+        self.assertEqual(negative + 1, requests_total("negative"))
+
+        self.resolver.error = None
+        self.clock.now += 11
+        self.assertEqual(["127.0.0.1"], self.cache.resolve("unknown.example.com"))
+
+    def test_refreshed_in_background_before_expiry(self):
+        self.cache.resolve("provider.example.com")
+        self.resolver.called.clear()
+        self.resolver.addresses = ["127.0.0.2"]
+
+        self.clock.now += 55
+        # the cached addresses are returned right away while refreshing
+        self.assertEqual(["127.0.0.1"], self.cache.resolve("provider.example.com"))
+        self.assertTrue(self.resolver.called.wait(2))
+        for _ in range(100):
+            if not self.cache._refreshing:
+                break
+            threading.Event().wait(0.01)
+
+        self.clock.now += 10
+        self.assertEqual(["127.0.0.2"], self.cache.resolve("provider.example.com"))
+        self.assertEqual(2, len(self.resolver.calls))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            ResolverCache(default_ttl=0)
+        with self.assertRaises(ValueError):
+            ResolverCache(refresh_ahead=1)
+
+
+class TestWireResolver(TestCase):
+    def setUp(self):
+        self.server = StubDnsServer().start()
+        self.host, self.port = self.server.address
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_addresses_and_ttl(self):
+        self.server.add("provider.example.com", dns_wire.QTYPE_A, socket.inet_pton(socket.AF_INET, "192.0.2.1"), ttl=120)
+        self.server.add("provider.example.com", dns_wire.QTYPE_AAAA, socket.inet_pton(socket.AF_INET6, "2001:db8::1"), ttl=60)
+        resolver = WireResolver(self.host, port=self.port, timeout=1)
+        self.assertEqual((["192.0.2.1", "2001:db8::1"], 60), resolver("provider.example.com"))
+        self.assertEqual((["192.0.2.1"], 120), resolver("provider.example.com", socket.AF_INET))
+
+    def test_unknown_host(self):
+        resolver = WireResolver(self.host, port=self.port, timeout=1)
+        with self.assertRaises(socket.gaierror):
+            resolver("unknown.example.com")
+
+
+class TestCachedTransport(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/ip", StubResponse("1.1.1.1"))
+        self.port = self.server.url().split(":")[2].rstrip("/")
+        self.resolver = FakeResolver()
+        transport.configure(resolver_cache=ResolverCache(self.resolver))
+
+    def tearDown(self):
+        transport.close()
+        self.server.stop()
+
+    def test_connections_resolve_through_cache(self):
+        url = f"http://provider.invalid:{self.port}/ip"
+        # idle connections are closed, so every request needs a new connection
+        transport.configure(idle_timeout=0.000001, resolver_cache=ResolverCache(self.resolver))
+        for _ in range(3):
+            threading.Event().wait(0.01)
+            self.assertEqual(("1.1.1.1", 200), transport.fetch(url, timeout=1))
+        self.assertEqual(["provider.invalid"], self.resolver.calls)
+
+    def test_next_address_tried(self):
+        # the stub server only listens on 127.0.0.1, so connecting to 127.0.0.2 is refused
+        self.resolver.addresses = ["127.0.0.2", "127.0.0.1"]
+        self.assertEqual(("1.1.1.1", 200), transport.fetch(f"http://provider.invalid:{self.port}/ip", timeout=1))
+
+    def test_resolution_failure(self):
+        self.resolver.error = socket.gaierror(socket.EAI_NONAME, "unknown host")
+        with self.assertRaises(requests.exceptions.ConnectionError) as ctx:
+            transport.fetch(f"http://provider.invalid:{self.port}/ip", timeout=1)
+        self.assertIn("Failed to resolve 'provider.invalid'", str(ctx.exception))
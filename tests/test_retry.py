@@ -0,0 +1,43 @@
+from unittest import TestCase, mock
+
+import retry
+
+
+class Failing:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("refused")
+        return "okay"
+
+
+@mock.patch("retry.time.sleep")
+class TestRetry(TestCase):
+    def test_first_attempt_succeeds(self, sleep):
+        func = Failing(0)
+        self.assertEqual("okay", retry.on_exception(ConnectionError, max_tries=3, operation="test")(func.__call__)())
+        self.assertEqual(1, func.calls)
+        sleep.assert_not_called()
+
+    def test_retried_after_failure(self, sleep):
+        func = Failing(1)
+        self.assertEqual("okay", retry.on_exception(ConnectionError, max_tries=2, operation="test")(func.__call__)())
+        self.assertEqual(2, func.calls)
+        sleep.assert_called_once()
+
+    def test_gives_up(self, sleep):
+        func = Failing(5)
+        with self.assertRaises(ConnectionError):
+            retry.on_exception(ConnectionError, max_tries=2, operation="test")(func.__call__)()
+        self.assertEqual(2, func.calls)
+
+    def test_other_exceptions_not_retried(self, sleep):
+        def func():
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            retry.on_exception(ConnectionError, max_tries=3, operation="test")(func)()
+        sleep.assert_not_called()
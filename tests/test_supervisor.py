@@ -0,0 +1,207 @@
+import json
+import os
+import sys
+import tempfile
+import time
+
+from unittest import TestCase, skipIf
+
+from multi_record import RecordConfig
+from notifier import UpdateNotifier
+from supervisor import Supervisor, assign
+from tests.stubs import StubResponse, StubServer
+
+
+def crashing_worker(index, records, marker_dir):
+    """ Crashes on its first start and keeps running after being restarted. """
+    marker = os.path.join(marker_dir, f"started-{index}")
+    first_start = not os.path.exists(marker)
+    with open(marker, "a") as f:
+        f.write("x")
+    if first_start:
+        sys.exit(1)
+    time.sleep(60)
+
+
+def counting_worker(index, records, marker_dir=None):
+    from prometheus_client import Counter, Gauge
+    Counter("dnsclient_test_worker_records_total", "Records handled by the test worker").inc(len(records))
+    Gauge("dnsclient_test_worker_started_ts_seconds", "Start of the test worker").set_to_current_time()
+    if marker_dir:
+        with open(os.path.join(marker_dir, f"ready-{index}-{os.getpid()}"), "w"):
+            pass
+    time.sleep(60)
+
+
+# enough signing to make a record take a few dozen milliseconds of cpu
+SIGNING_ROUNDS = 10000
+
+
+def signing_worker(index, records):
+    """ Signs every update many times before sending it, so the worker is bound by the cpu and the GIL. """
+    for r in records:
+        notifier = UpdateNotifier(r.record, r.url, r.secret)
+        for _ in range(SIGNING_ROUNDS):
+            notifier.build_payloads("1.1.1.1")
+        notifier.notify_update("1.1.1.1", retry=False)
+    time.sleep(60)
+
+
+def wait_for(condition, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.05)
+
+
+def records(count, url="http://localhost"):
+    return [RecordConfig(f"worker{i}.example.com.", url, "secret") for i in range(count)]
+
+
+class TestAssign(TestCase):
+    def test_all_records_are_assigned_once(self):
+        shards = assign(records(1000), 4)
+        self.assertEqual(1000, sum(len(shard) for shard in shards))
+        self.assertTrue(all(150 < len(shard) < 350 for shard in shards))
+
+    def test_adding_records_does_not_move_others(self):
+        before = assign(records(100), 4)
+        after = assign(records(120), 4)
+        for old, new in zip(before, after):
+            self.assertEqual([r.record for r in old], [r.record for r in new if r.record in {o.record for o in old}])
+        moved = sum(len(new) - len(old) for old, new in zip(before, after))
+        self.assertEqual(20, moved)
+
+    def test_adding_a_worker_only_moves_records_to_it(self):
+        before = assign(records(1000), 4)
+        after = assign(records(1000), 5)
+        for old, new in zip(before, after):
+            self.assertTrue({r.record for r in new} <= {r.record for r in old})
+        self.assertTrue(100 < len(after[4]) < 300)
+
+
+class TestSupervisor(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.records_file = os.path.join(self.dir.name, "records.json")
+
+    def write_records(self, count, url="http://localhost"):
+        with open(self.records_file, "w") as f:
+            json.dump({"url": url, "secret": "secret", "records": [{"record": f"worker{i}.example.com."} for i in range(count)]}, f)
+
+    def supervise(self, target, workers, args=(), **kwargs):
+        supervisor = Supervisor(target, self.records_file, workers, args=args, **kwargs)
+        supervisor.start()
+        self.addCleanup(supervisor.stop)
+        return supervisor
+
+    def test_crashed_worker_is_restarted(self):
+        self.write_records(10)
+        supervisor = self.supervise(crashing_worker, 2, args=(self.dir.name,), restart_delay=0.1)
+        first = supervisor.pids()
+
+        def starts(index):
+            with open(os.path.join(self.dir.name, f"started-{index}")) as f:
+                return len(f.read())
+
+        def restarted():
+            supervisor.poll()
+            return all(pid is not None and pid not in first for pid in supervisor.pids()) and starts(0) == starts(1) == 2
+        wait_for(restarted)
+
+        # the restarted workers keep running
+        time.sleep(0.5)
+        supervisor.poll()
+        self.assertEqual([starts(0), starts(1)], [2, 2])
+        self.assertTrue(all(pid not in first for pid in supervisor.pids()))
+
+    def test_rebalance_restarts_changed_workers_only(self):
+        self.write_records(50)
+        supervisor = self.supervise(counting_worker, 4, reload_interval=0)
+        before = [list(shard) for shard in supervisor._shards]
+        pids = supervisor.pids()
+
+        # one more record only changes the share of a single worker
+        self.write_records(51)
+        supervisor.poll()
+        changed = [index for index in range(4) if supervisor.pids()[index] != pids[index]]
+        self.assertEqual(1, len(changed))
+        self.assertEqual(len(before[changed[0]]) + 1, len(supervisor._shards[changed[0]]))
+
+    def ready_workers(self):
+        return [name for name in os.listdir(self.dir.name) if name.startswith("ready-")]
+
+    def test_metrics_are_combined(self):
+        self.write_records(30)
+        supervisor = self.supervise(counting_worker, 3, args=(self.dir.name,))
+        wait_for(lambda: len(self.ready_workers()) == 3)
+
+        registry = supervisor.metrics_registry()
+        self.assertEqual(30, registry.get_sample_value("dnsclient_test_worker_records_total"))
+        self.assertEqual(30, sum(registry.get_sample_value("dnsclient_supervisor_worker_records", {"worker": str(index)}) for index in range(3)))
+
+    def test_metrics_files_being_created_are_skipped(self):
+        self.write_records(10)
+        supervisor = self.supervise(counting_worker, 1, args=(self.dir.name,))
+        wait_for(lambda: len(self.ready_workers()) == 1)
+        # a worker just created the file of a metric but did not initialize it yet
+        open(os.path.join(supervisor.metrics_dir, "counter_99999.db"), "w").close()
+
+        registry = supervisor.metrics_registry()
+        self.assertEqual(10, registry.get_sample_value("dnsclient_test_worker_records_total"))
+
+    def test_gauges_of_dead_workers_are_removed(self):
+        self.write_records(10)
+        supervisor = self.supervise(counting_worker, 1, args=(self.dir.name,), reload_interval=0)
+        wait_for(lambda: len(self.ready_workers()) == 1)
+        old_pid = supervisor.pids()[0]
+
+        # more records restart the worker
+        self.write_records(11)
+        supervisor.poll()
+        wait_for(lambda: len(self.ready_workers()) == 2)
+
+        registry = supervisor.metrics_registry()
+        pids = [sample.labels["pid"] for metric in registry.collect() if metric.name == "dnsclient_test_worker_started_ts_seconds" for sample in metric.samples]
+        self.assertEqual([str(supervisor.pids()[0])], pids)
+        self.assertNotIn(str(old_pid), pids)
+
+
+@skipIf((os.cpu_count() or 1) < 2, "spreading cpu bound work across processes needs more than one cpu")
+class TestSupervisorThroughput(TestCase):
+    RECORDS = 40
+
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/update", self.respond, method="POST")
+        self.received = list()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.records_file = os.path.join(self.dir.name, "records.json")
+        with open(self.records_file, "w") as f:
+            json.dump({"url": self.server.url("/update"), "secret": "secret", "records": [{"record": f"worker{i}.example.com."} for i in range(self.RECORDS)]}, f)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, body):
+        self.received.append(time.monotonic())
+        return StubResponse("okay")
+
+    def measure(self, workers):
+        """ Returns the updates per second, not counting the start of the workers. """
+        self.received.clear()
+        supervisor = Supervisor(signing_worker, self.records_file, workers)
+        supervisor.start()
+        try:
+            wait_for(lambda: len(self.received) >= self.RECORDS, timeout=30)
+        finally:
+            supervisor.stop()
+        return self.RECORDS / (self.received[-1] - self.received[0])
+
+    def test_throughput_scales_with_workers(self):
+        single = self.measure(1)
+        pooled = self.measure(min(4, os.cpu_count()))
+        self.assertGreater(pooled, single * 1.5)
@@ -0,0 +1,56 @@
+import time
+
+from unittest import TestCase
+
+import transport
+from notifier import UpdateNotifier
+from tests.stubs import StubResponse, StubServer
+
+
+def counter(metric, host):
+    return metric.labels(host)._value.get()
+
+
+class TestTransport(TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.add_route("/ip", StubResponse("1.1.1.1"))
+        self.server.add_route("/", StubResponse("okay"), method="POST")
+        self.host = "127.0.0.1"
+
+    def tearDown(self):
+        transport.close()
+        self.server.stop()
+
+    def test_connection_reused(self):
+        transport.configure()
+        new = counter(transport.prom_connections_new, self.host)
+        reused = counter(transport.prom_connections_reused, self.host)
+
+        for _ in range(3):
+            self.assertEqual(("1.1.1.1", 200), transport.fetch(self.server.url("/ip"), timeout=1))
+
+        self.assertEqual(new + 1, counter(transport.prom_connections_new, self.host))
+        self.assertEqual(reused + 2, counter(transport.prom_connections_reused, self.host))
+
+    def test_idle_connection_evicted(self):
+        transport.configure(idle_timeout=0.1)
+        new = counter(transport.prom_connections_new, self.host)
+        evicted = counter(transport.prom_connections_evicted, self.host)
+
+        transport.fetch(self.server.url("/ip"), timeout=1)
+        time.sleep(0.2)
+        transport.fetch(self.server.url("/ip"), timeout=1)
+
+        self.assertEqual(new + 2, counter(transport.prom_connections_new, self.host))
+        self.assertEqual(evicted + 1, counter(transport.prom_connections_evicted, self.host))
+
+    def test_notifier_shares_session(self):
+        transport.configure()
+        reused = counter(transport.prom_connections_reused, self.host)
+
+        transport.fetch(self.server.url("/ip"), timeout=1)
+        notifier = UpdateNotifier(dns_record="my.record.tld.", host=self.server.url("/"), shared_secret="secret")
+        notifier.notify_update("1.1.1.1")
+
+        self.assertEqual(reused + 1, counter(transport.prom_connections_reused, self.host))
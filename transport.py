@@ -0,0 +1,227 @@
+import logging
+import queue
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from prometheus_client import Counter
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+import deadline
+
+prom_connections_new = Counter('dnsclient_http_connections_new_total', 'Amount of newly established HTTP connections', ['host'])
+prom_connections_reused = Counter('dnsclient_http_connections_reused_total', 'Amount of HTTP requests that reused a pooled keep-alive connection', ['host'])
+prom_connections_evicted = Counter('dnsclient_http_connections_evicted_total', 'Amount of pooled connections closed after being idle for too long', ['host'])
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 2
+DEFAULT_IDLE_TIMEOUT = 120.0
+THROTTLE_STATUS_CODES = (429, 503)
+DEFAULT_MAX_BYTES = 4096
+
+
+class ThrottledError(Exception):
+    """ Raised when the server asks us to slow down (429 or 503), optionally telling for how long. """
+    def __init__(self, url, status_code, retry_after=None):
+        super().__init__(f"{url} throttled with status code {status_code}, retry after {retry_after}s")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ResponseTooLarge(Exception):
+    """ Raised when a response body exceeds the allowed size. """
+
+
+def parse_retry_after(value, now=None):
+    """ Parse a Retry-After header given in seconds or as HTTP date. Returns seconds or None. """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None or date.tzinfo is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, date.timestamp() - now)
+
+
+class _ConnectionTracking:
+    """
+    Mixin for urllib3 connection pools that keeps track of connection reuse and closes
+    pooled connections that have not been used for more than `idle_timeout` seconds.
+    """
+    idle_timeout = None
+    _last_used = None
+
+    def _get_conn(self, timeout=None):
+        if self.idle_timeout and self._last_used is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self._evict_idle()
+
+        conn = super()._get_conn(timeout)
+        # connections without a socket (fresh or dropped by the remote) connect on their next request
+        if getattr(conn, "sock", None) is None:
+            prom_connections_new.labels(self.host).inc()
+        else:
+            prom_connections_reused.labels(self.host).inc()
+        return conn
+
+    def _put_conn(self, conn):
+        self._last_used = time.monotonic()
+        super()._put_conn(conn)
+
+    def _evict_idle(self):
+        pool = self.pool
+        if pool is None:
+            return
+
+        for _ in range(pool.qsize()):
+            try:
+                conn = pool.get(block=False)
+            except queue.Empty:
+                break
+            if conn:
+                conn.close()
+                prom_connections_evicted.labels(self.host).inc()
+            pool.put(None, block=False)
+
+
+class _CachedResolution:
+    """
+    Mixin for urllib3 connections that looks up the host in a ResolverCache instead of asking
+    the system resolver on every new connection. The addresses are tried one after another,
+    the hostname is still used for the Host header and TLS.
+    """
+    resolver_cache = None
+
+    def _new_conn(self):
+        try:
+            addresses = self.resolver_cache.resolve(self._dns_host)
+        except OSError as err:
+            raise NewConnectionError(self, f"Failed to resolve '{self.host}': {err}") from err
+
+        dns_host = self._dns_host
+        try:
+            for index, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError as err:
+                    if index == len(addresses) - 1:
+                        raise
+                    logging.debug("Could not connect to %s at %s, trying next address: %s", self.host, address, err)
+        finally:
+            self._dns_host = dns_host
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools count reused connections and evict idle ones. If a
+    `resolver_cache` is given, new connections resolve their host through it.
+    """
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, resolver_cache=None):
+        self.idle_timeout = idle_timeout
+        self.resolver_cache = resolver_cache
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        http_attrs = {"idle_timeout": self.idle_timeout}
+        https_attrs = dict(http_attrs)
+        if self.resolver_cache is not None:
+            attrs = {"resolver_cache": self.resolver_cache}
+            http_attrs["ConnectionCls"] = type("CachedHTTPConnection", (_CachedResolution, HTTPConnection), attrs)
+            https_attrs["ConnectionCls"] = type("CachedHTTPSConnection", (_CachedResolution, HTTPSConnection), attrs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("PooledHTTPConnectionPool", (_ConnectionTracking, HTTPConnectionPool), http_attrs),
+            "https": type("PooledHTTPSConnectionPool", (_ConnectionTracking, HTTPSConnectionPool), https_attrs),
+        }
+
+
+def build_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, resolver_cache=None):
+    """ Create a keep-alive session with at most `pool_maxsize` pooled connections per host. """
+    session = requests.Session()
+    adapter = PooledAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, idle_timeout=idle_timeout, resolver_cache=resolver_cache)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_session = None
+_lock = threading.Lock()
+
+
+def configure(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, resolver_cache=None):
+    """ Replace the shared session with one using the given pool settings and resolver cache. """
+    global _session
+    logging.debug("Configuring HTTP transport: pool_connections=%d, pool_maxsize=%d, idle_timeout=%s, resolver_cache=%s", pool_connections, pool_maxsize, idle_timeout, resolver_cache is not None)
+    session = build_session(pool_connections, pool_maxsize, idle_timeout, resolver_cache)
+    with _lock:
+        old, _session = _session, session
+    if old:
+        old.close()
+
+
+def get_session():
+    """ Return the session shared by the IP providers and the notifier. """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def close():
+    global _session
+    with _lock:
+        old, _session = _session, None
+    if old:
+        old.close()
+
+
+def _read_bounded(resp, max_bytes) -> str:
+    """
+    Read the streamed body, giving up as soon as it exceeds max_bytes or, as the read timeout
+    only bounds single reads, once the deadline of the current check passed.
+    """
+    length = resp.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ResponseTooLarge(f"response of {length} bytes exceeds limit of {max_bytes} bytes")
+
+    body = bytearray()
+    for chunk in resp.iter_content(chunk_size=min(max_bytes + 1, 8192)):
+        body += chunk
+        if len(body) > max_bytes:
+            raise ResponseTooLarge(f"response exceeds limit of {max_bytes} bytes")
+        if deadline.expired():
+            raise deadline.DeadlineExceeded()
+    return body.decode(resp.encoding or "utf-8", errors="replace")
+
+
+def fetch(url, timeout=None, method="GET", max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Request the url using the shared session and return the body and status code. The body is
+    streamed and limited to max_bytes, the timeout is shortened to the deadline of the current
+    check. Raises ThrottledError on 429 and 503, ResponseTooLarge for oversized bodies and
+    DeadlineExceeded if the deadline passed while the body was still being read.
+    """
+    resp = get_session().request(method, url, timeout=deadline.timeout(timeout), stream=True)
+    try:
+        if resp.status_code in THROTTLE_STATUS_CODES:
+            raise ThrottledError(url, resp.status_code, parse_retry_after(resp.headers.get("Retry-After")))
+        return _read_bounded(resp, max_bytes), resp.status_code
+    except BaseException:
+        # the rest of the body is not read, so the connection can not be reused
+        resp.close()
+        raise